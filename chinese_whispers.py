@@ -0,0 +1,51 @@
+import numpy as np
+from tqdm import tqdm
+
+def chinese_whispers(indptr, indices, weights, iterations=20, batches=10, seed=0):
+    """
+    在加权图上运行 chinese whispers 聚类。
+    每轮把节点随机分成若干批，批内节点同时把标签更新为邻居中权重之和最大的标签，
+    分批更新既能向量化，又避免了全同步更新时标签来回振荡。
+    参数:
+        indptr, indices, weights: CSR 形式的邻接图。
+        iterations: int, 最大迭代轮数，标签不再变化时提前结束。
+        batches: int, 每轮分批数。
+    返回:
+        labels: ndarray, 从 0 开始连续编号的簇标签，孤立节点自成一簇。
+    """
+    n = len(indptr) - 1
+    labels = np.arange(n)
+    if n == 0 or len(indices) == 0:
+        return labels
+    rng = np.random.default_rng(seed)
+    src = np.repeat(np.arange(n), np.diff(indptr))
+    for iteration in range(iterations):
+        changed = 0
+        in_batch = np.zeros(n, dtype=bool)
+        for batch in np.array_split(rng.permutation(n), batches):
+            in_batch[:] = False
+            in_batch[batch] = True
+            edge_mask = in_batch[src]
+            if not edge_mask.any():
+                continue
+            nodes = src[edge_mask]
+            neighbor_labels = labels[indices[edge_mask]]
+            edge_weights = weights[edge_mask]
+            # 按 (节点, 邻居标签) 汇总边权重
+            order = np.lexsort((neighbor_labels, nodes))
+            nodes, neighbor_labels, edge_weights = nodes[order], neighbor_labels[order], edge_weights[order]
+            starts = np.flatnonzero(np.r_[True, (nodes[1:] != nodes[:-1]) | (neighbor_labels[1:] != neighbor_labels[:-1])])
+            sums = np.add.reduceat(edge_weights, starts)
+            nodes, neighbor_labels = nodes[starts], neighbor_labels[starts]
+            # 每个节点取权重之和最大的标签
+            order = np.lexsort((-sums, nodes))
+            nodes, neighbor_labels = nodes[order], neighbor_labels[order]
+            first = np.r_[True, nodes[1:] != nodes[:-1]]
+            nodes, new_labels = nodes[first], neighbor_labels[first]
+            changed += int(np.count_nonzero(labels[nodes] != new_labels))
+            labels[nodes] = new_labels
+        tqdm.write(f"chinese whispers 第 {iteration + 1} 轮, 标签变化 {changed} 个")
+        if changed == 0:
+            break
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels
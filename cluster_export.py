@@ -0,0 +1,99 @@
+import os
+import json
+import shutil
+import numpy as np
+from tqdm import tqdm
+
+EXPORT_MODES = ('hardlink', 'symlink', 'copy')
+
+def group_by_label(labels, min_cluster_size=1):
+    """
+    对标签数组做一次向量化分组。
+    返回: list of (标签, 成员下标数组)，按簇大小降序排列，小于 min_cluster_size 的簇以及标签为 -1 的噪声被丢弃。
+    """
+    labels = np.asarray(labels)
+    if len(labels) == 0:
+        return []
+    order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    sizes = np.diff(np.r_[starts, len(labels)])
+    groups = [(sorted_labels[start], order[start:start + size]) for start, size in zip(starts, sizes)
+              if size >= min_cluster_size and sorted_labels[start] != -1]
+    groups.sort(key=lambda group: len(group[1]), reverse=True)
+    return groups
+
+def save_cluster_dict(labels, names, embeddings, output_file_path, min_cluster_size=2):
+    """
+    按 face_classify_*.txt 的格式保存聚类结果，供图片浏览工具按簇浏览。
+    小于 min_cluster_size 的簇和噪声归入未归类 (-1)；每簇的代表人脸为离簇中心最近的成员。
+    参数:
+        labels: array, 每张人脸的簇标签。
+        names: list, 与 labels 一一对应的人脸名（不含扩展名）。
+        embeddings: array, 与 labels 一一对应的特征，用于选取代表人脸。
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    groups = group_by_label(labels, min_cluster_size)
+    cluster_dict = {}
+    medoids = {}
+    grouped = np.zeros(len(names), dtype=bool)
+    for id, (label, members) in enumerate(groups):
+        cluster_dict[id] = [names[index] for index in members]
+        distances = np.linalg.norm(embeddings[members] - embeddings[members].mean(axis=0), axis=1)
+        medoids[id] = names[members[np.argmin(distances)]]
+        grouped[members] = True
+    if not grouped.all():
+        cluster_dict[-1] = [names[index] for index in np.flatnonzero(~grouped)]
+    with open(output_file_path, 'w', encoding='utf-8') as file:
+        json.dump({'cluster_dict': cluster_dict, 'core_sample_indices': [], 'medoids': medoids}, file, indent=4, ensure_ascii=False)
+    tqdm.write(f"聚类结果已保存到: {output_file_path}")
+
+def link_file(source_path, target_path, mode='hardlink'):
+    """
+    不经解码和重新编码，把已有的图片文件放入目标位置。
+    hardlink 在跨文件系统等不支持硬链接的情况下退回到按字节复制。
+    """
+    if os.path.lexists(target_path):
+        os.remove(target_path)
+    if mode == 'hardlink':
+        try:
+            os.link(source_path, target_path)
+            return
+        except OSError:
+            pass
+    elif mode == 'symlink':
+        os.symlink(os.path.abspath(source_path), target_path)
+        return
+    shutil.copyfile(source_path, target_path)
+
+def export_clusters(labels, source_paths, output_folder_path, min_cluster_size=2, mode='hardlink'):
+    """
+    按聚类标签把人脸图片导出到 cluster_<序号>(<大小>) 文件夹，序号按簇大小降序排列。
+    图片以硬链接、符号链接或按字节复制的方式导出，内存占用只与标签数组有关。
+    参数:
+        labels: array, 每张人脸的簇标签，-1 为噪声。
+        source_paths: list, 与 labels 一一对应的人脸图片路径。
+        mode: str, 'hardlink'、'symlink' 或 'copy'。
+    返回:
+        int, 导出的文件数。
+    """
+    if mode not in EXPORT_MODES:
+        raise ValueError(f"不支持的导出方式: {mode}")
+    groups = group_by_label(labels, min_cluster_size)
+    exported = 0
+    missing = 0
+    progress = tqdm(total=sum(len(members) for _, members in groups), desc="导出聚类结果")
+    for id, (label, members) in enumerate(groups):
+        cluster_dir = os.path.join(output_folder_path, f"cluster_{id}({len(members)})")
+        os.makedirs(cluster_dir, exist_ok=True)
+        for index in members:
+            source_path = source_paths[index]
+            progress.update(1)
+            if not os.path.exists(source_path):
+                missing += 1
+                continue
+            link_file(source_path, os.path.join(cluster_dir, os.path.basename(source_path)), mode)
+            exported += 1
+    progress.close()
+    tqdm.write(f"导出 {len(groups)} 个簇, {exported} 个文件到 {output_folder_path}" + (f", 缺失 {missing} 个文件" if missing else ""))
+    return exported
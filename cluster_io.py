@@ -0,0 +1,55 @@
+import json
+import logging
+import numpy as np
+from pathlib import Path
+from face_store import open_face_store
+
+# 人脸聚类脚本共用的数据读写函数，只依赖 numpy 和人脸数据存储，不引入 dlib、matplotlib 等重量级依赖
+
+def load_face_data(directory_path, num_limit):
+    """
+    从指定目录的列式人脸数据存储中加载符合条件的人脸特征和人脸名。
+    筛选条件是对内存映射列的向量化操作，不再逐个反序列化 pkl 文件。
+    参数:
+        directory_path: str, 目标目录（包含 face_store 或旧版 faces/*.pkl）。
+        num_limit: int, 最多加载的人脸数量。
+    返回:
+        embeddings: ndarray, 形状为 (n, 512) 的人脸特征。
+        face_files: list, 对应的人脸名。
+    """
+    logging.info(f"加载数据从目录: {directory_path}")
+    store = open_face_store(directory_path)
+    # 过滤掉不符合条件的数据
+    mask = store.filter_mask(gender=0, min_det_score=0.6, age_range=(10, 50))
+    rows = np.flatnonzero(mask)[:num_limit]
+    embeddings = np.asarray(store.column('embedding')[rows], dtype=np.float32)
+    face_files = [store.names[row] for row in rows]
+    logging.info(f"已加载{len(face_files)}个人脸数据, 淘汰 {int(store.live_mask().sum() - mask.sum())} 个数据")
+    return embeddings, face_files
+
+def save_cluster_results(labels, core_sample_indices, face_files, output_file_path):
+    """
+    根据聚类结果和面部文件名生成字典并保存到文件。
+    参数:
+        labels: list, 每个数据点的簇标签。
+        core_sample_indices: 核心样本的索引。
+        face_files: list, 对应的人脸文件名。
+        output_file_path: str, 输出文件的路径。
+    """
+    cluster_dict = {}
+    cluster_cnt = 0
+    for label, file in zip(labels, face_files):
+        # 确保label是标准的int类型
+        label = int(label)  # 转换numpy.int64到Python的int
+        if label not in cluster_dict:
+            cluster_dict[label] = []
+            if label != -1: cluster_cnt += 1
+        cluster_dict[label].append(Path(file).stem)
+    logging.info(f"聚类字典创建完成，包含 {cluster_cnt} 个簇")
+    print({f"{key}: {len(value)}" for key, value in cluster_dict.items()})
+    logging.info(f"核心样本数量: {len(core_sample_indices)}")
+    core_sample_indices = [face_files[int(x)].split('.')[0] for x in core_sample_indices]  # 转换 numpy.int64 为 Python int
+
+    with open(output_file_path, 'w', encoding='utf-8') as file:
+        json.dump({'cluster_dict': cluster_dict, 'core_sample_indices': list(core_sample_indices)}, file, indent=4, ensure_ascii=False)
+    logging.info(f"聚类结果已保存为JSON格式到文件: {output_file_path}")
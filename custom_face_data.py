@@ -15,11 +15,9 @@ class CustomFace:
         self.embedding = data['embedding']  # 人脸的特征向量，用于人脸识别和验证等高级任务。
 
 
-def serialize_face(face, file_path):
-    if os.path.exists(file_path):
-        return
-    # 将面部数据转换为字典并序列化
-    data_to_save = {
+def face_to_dict(face):
+    # 将面部数据转换为字典，CustomFace(face_to_dict(face)) 可以还原出等价的面部数据对象
+    return {
         'bbox': face.bbox,
         'kps': face.kps,
         'det_score': face.det_score,
@@ -30,6 +28,12 @@ def serialize_face(face, file_path):
         'age': face.age,
         'embedding': face.embedding
     }
+
+def serialize_face(face, file_path):
+    if os.path.exists(file_path):
+        return
+    # 将面部数据转换为字典并序列化
+    data_to_save = face_to_dict(face)
     with open(file_path, 'wb') as f:
         pickle.dump(data_to_save, f)
 
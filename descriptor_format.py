@@ -0,0 +1,196 @@
+import os
+import struct
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+MAGIC = b'IMGDESC1'
+VERSION = 1
+BINARY_SUFFIX = '.imgdesc'
+# 魔数, 版本, 相似组数, 字符串数, 条目数, 组偏移表位置, 组标志位置, 条目位置, 字符串偏移表位置, 字符串数据位置
+HEADER = struct.Struct('<8sIIQQQQQQQ')
+FLAG_REMOVED = 1
+
+def binary_descriptor_path(text_path):
+    """文本描述文件对应的二进制描述文件路径，与文本文件放在同一目录。"""
+    return os.path.splitext(text_path)[0] + BINARY_SUFFIX
+
+def binary_is_current(text_path):
+    """二进制描述文件存在且不比文本描述文件旧。"""
+    binary_path = binary_descriptor_path(text_path)
+    return os.path.exists(binary_path) and (not os.path.exists(text_path) or os.path.getmtime(binary_path) >= os.path.getmtime(text_path))
+
+def _align(position, alignment=8):
+    return (position + alignment - 1) // alignment * alignment
+
+def write_binary_descriptor(filepath, unique_images, similar_groups, group_flags, new_unique_images):
+    """
+    写入二进制描述文件。
+    文件布局（小端，各段按 8 字节对齐）:
+        文件头      魔数、版本、各段的数量与位置
+        组偏移表    uint64[相似组数 + 3]，条目数组中各列表的起始位置前缀和；
+                    列表依次为唯一图片、各相似组、后一判断器新增的唯一图片
+        组标志      uint8[相似组数]，FLAG_REMOVED 表示该组被后一判断器拆除
+        条目        uint32[条目数]，字符串序号，顺序即查看工具中图片的全局序号
+        字符串偏移  uint32[字符串数 + 1]
+        字符串数据  UTF-8 文件名，去重后依次拼接
+    读取时内存映射整个文件，任意一组或唯一图片切片都只访问各自的条目和字符串。
+    参数:
+        unique_images: [文件名]，保持顺序去重。
+        similar_groups: [[文件名]]
+        group_flags: [bool]，各相似组是否被拆除。
+        new_unique_images: [文件名]
+    """
+    if len(similar_groups) != len(group_flags):
+        raise ValueError(f"相似组数 {len(similar_groups)} 与组标志数 {len(group_flags)} 不一致")
+    lists = [list(dict.fromkeys(unique_images))] + [list(group) for group in similar_groups] + [list(new_unique_images)]
+    string_ids = {}
+    entries = np.fromiter((string_ids.setdefault(name, len(string_ids)) for names in lists for name in names), dtype='<u4')
+    group_offsets = np.zeros(len(lists) + 1, dtype='<u8')
+    np.cumsum([len(names) for names in lists], out=group_offsets[1:])
+    flags = np.array([FLAG_REMOVED if removed else 0 for removed in group_flags], dtype=np.uint8)
+    encoded = [name.encode('utf-8') for name in string_ids]
+    string_offsets = np.zeros(len(encoded) + 1, dtype='<u4')
+    np.cumsum([len(data) for data in encoded], out=string_offsets[1:])
+
+    sections = [group_offsets.tobytes(), flags.tobytes(), entries.tobytes(), string_offsets.tobytes(), b''.join(encoded)]
+    positions = []
+    position = HEADER.size
+    for data in sections:
+        position = _align(position)
+        positions.append(position)
+        position += len(data)
+    tmp_path = filepath + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(similar_groups), len(encoded), len(entries), *positions))
+        for data, section_position in zip(sections, positions):
+            file.write(b'\0' * (section_position - file.tell()))
+            file.write(data)
+    os.replace(tmp_path, filepath)
+
+class BinaryDescriptor:
+    """内存映射的二进制描述文件读取器，打开时只解析文件头，各列表按需读取。"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.data = np.memmap(filepath, dtype=np.uint8, mode='r')
+        if len(self.data) < HEADER.size:
+            raise ValueError(f"Not a valid binary descriptor file: {filepath}")
+        (magic, version, self.group_count, self.string_count, self.entry_count,
+         offsets_pos, flags_pos, entries_pos, string_offsets_pos, string_data_pos) = HEADER.unpack(bytes(self.data[:HEADER.size]))
+        if magic != MAGIC:
+            raise ValueError(f"Not a valid binary descriptor file: {filepath}")
+        if version != VERSION:
+            raise ValueError(f"Unsupported binary descriptor version {version}: {filepath}")
+        self.group_offsets = np.frombuffer(self.data, dtype='<u8', count=self.group_count + 3, offset=offsets_pos)
+        self.flags = np.frombuffer(self.data, dtype=np.uint8, count=self.group_count, offset=flags_pos)
+        self.entries = np.frombuffer(self.data, dtype='<u4', count=self.entry_count, offset=entries_pos)
+        self.string_offsets = np.frombuffer(self.data, dtype='<u4', count=self.string_count + 1, offset=string_offsets_pos)
+        self.string_data_pos = string_data_pos
+
+    def string(self, string_id):
+        start = self.string_data_pos + int(self.string_offsets[string_id])
+        end = self.string_data_pos + int(self.string_offsets[string_id + 1])
+        return bytes(self.data[start:end]).decode('utf-8')
+
+    def list_sizes(self):
+        """各列表的图片数: [唯一图片, 相似组..., 新增唯一图片]。"""
+        return np.diff(self.group_offsets).astype(np.int64).tolist()
+
+    def entry(self, position):
+        """条目数组中第 position 个图片的文件名，即查看工具中的全局序号。"""
+        return self.string(int(self.entries[position]))
+
+    def _list(self, list_idx):
+        start, end = int(self.group_offsets[list_idx]), int(self.group_offsets[list_idx + 1])
+        return [self.string(int(string_id)) for string_id in self.entries[start:end]]
+
+    def unique_images(self):
+        return self._list(0)
+
+    def group(self, group_idx):
+        return self._list(group_idx + 1)
+
+    def group_removed(self, group_idx):
+        return bool(self.flags[group_idx] & FLAG_REMOVED)
+
+    def new_unique_images(self):
+        return self._list(self.group_count + 1)
+
+    def close(self):
+        self.data._mmap.close()
+
+def read_text_descriptor(filepath):
+    """解析文本描述文件，返回 (唯一图片, 相似组, 组是否拆除, 后一判断器新增的唯一图片)。"""
+    unique_images, similar_groups, group_flags, new_unique_images = [], [], [], []
+    current_group, current_removed = [], False
+    parsing_mode = None
+    with open(filepath, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line == "Unique Images:":
+                parsing_mode = 'unique'
+            elif line == "Similar Groups:":
+                parsing_mode = 'groups'
+            elif line.startswith("Group:"):
+                if current_group:
+                    similar_groups.append(current_group)
+                    group_flags.append(current_removed)
+                current_group, current_removed = [], line.split(':')[1].strip() != ""
+            elif line == "New unique Images by next detector:":
+                parsing_mode = 'new_unique'
+            elif line:
+                if parsing_mode == 'unique':
+                    unique_images.append(line)
+                elif parsing_mode == 'groups':
+                    current_group.append(line)
+                elif parsing_mode == 'new_unique':
+                    new_unique_images.append(line)
+    if parsing_mode is None:
+        raise ValueError(f"Not a valid descriptor file: {filepath}")
+    if current_group:
+        similar_groups.append(current_group)
+        group_flags.append(current_removed)
+    return unique_images, similar_groups, group_flags, new_unique_images
+
+def write_text_descriptor(filepath, unique_images, similar_groups, group_flags, new_unique_images):
+    """按图片去重工具的格式写出文本描述文件。"""
+    with open(filepath, 'w') as file:
+        file.write("Unique Images:\n")
+        file.writelines(f"{name}\n" for name in unique_images)
+        file.write("\nSimilar Groups:\n")
+        for group, removed in zip(similar_groups, group_flags):
+            file.write("Group:removed\n" if removed else "Group:\n")
+            file.writelines(f"{name}\n" for name in group)
+            file.write("\n")
+        file.write("New unique Images by next detector:\n")
+        file.writelines(f"{name}\n" for name in new_unique_images)
+
+def text_to_binary(text_path, binary_path=None):
+    binary_path = binary_path or binary_descriptor_path(text_path)
+    write_binary_descriptor(binary_path, *read_text_descriptor(text_path))
+    return binary_path
+
+def binary_to_text(binary_path, text_path):
+    descriptor = BinaryDescriptor(binary_path)
+    groups = [descriptor.group(group_idx) for group_idx in range(descriptor.group_count)]
+    flags = [descriptor.group_removed(group_idx) for group_idx in range(descriptor.group_count)]
+    write_text_descriptor(text_path, descriptor.unique_images(), groups, flags, descriptor.new_unique_images())
+    return text_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="文本描述文件与二进制描述文件互相转换")
+    parser.add_argument('input', help="输入文件，.txt 转为二进制，" + BINARY_SUFFIX + " 转为文本")
+    parser.add_argument('output', nargs='?', default=None, help="输出文件，默认与输入文件同名、扩展名不同")
+    args = parser.parse_args()
+    if not os.path.isfile(args.input):
+        print("请输入有效的文件路径")
+        exit(1)
+    if args.input.endswith(BINARY_SUFFIX):
+        output = args.output or os.path.splitext(args.input)[0] + '.txt'
+        if args.output is None and os.path.exists(output):
+            print(f"{output} 已存在，请指定输出文件")
+            exit(1)
+        tqdm.write(f"已写出文本描述文件: {binary_to_text(args.input, output)}")
+    else:
+        tqdm.write(f"已写出二进制描述文件: {text_to_binary(args.input, args.output)}")
@@ -0,0 +1,131 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+from pathlib import Path
+from tqdm import tqdm
+from custom_face_data import CustomFace, face_to_dict
+
+# 默认的库级缓存位置，放在本地磁盘上（sqlite 不适合放在网络共享目录）
+DEFAULT_CACHE_PATH = os.path.expanduser('~/.face_image_preprocessing/embedding_cache.db')
+
+def content_hash(data):
+    """计算图像文件内容的哈希值。"""
+    return hashlib.sha1(data).hexdigest()
+
+class EmbeddingCache:
+    """
+    以图像内容哈希 + 模型配置版本为键的人脸检测结果缓存，跨文件夹、跨运行共享。
+    缓存内容为该图像上检测到的全部人脸（包括 bbox、关键点、属性和特征向量），没有人脸的图像也会缓存空列表。
+    数据存放在一个 sqlite 文件中，总大小超过 max_bytes 时按最近使用时间淘汰最旧的条目。
+    命中时的最近使用时间先记在内存中，每 touch_batch 次命中、淘汰前、report 和 close 时批量写入，避免每次命中都提交一次事务。
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, profile='default', max_bytes=20 * 1024 ** 3, touch_batch=1000):
+        self.cache_path = Path(cache_path)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.profile = profile
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.touch_batch = touch_batch
+        self._touched = {}  # 键 -> 尚未写入的最近使用时间
+        self.conn = sqlite3.connect(str(self.cache_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS faces ("
+                          "key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS faces_last_used ON faces (last_used)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM faces").fetchone()[0]
+
+    def _key(self, image_hash):
+        return f"{self.profile}:{image_hash}"
+
+    def get(self, image_hash):
+        """查询缓存，命中时返回 CustomFace 列表，未命中返回 None。"""
+        key = self._key(image_hash)
+        row = self.conn.execute("SELECT data FROM faces WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        try:
+            faces = [CustomFace(data) for data in pickle.loads(row[0])]
+        except Exception as e:
+            tqdm.write(f"缓存条目损坏, 已删除 {key}: {e}")
+            self._delete(key)
+            self.misses += 1
+            return None
+        self._touched[key] = time.time()
+        if len(self._touched) >= self.touch_batch:
+            self.flush_touched()
+        self.hits += 1
+        return faces
+
+    def put(self, image_hash, faces):
+        """写入一张图像的检测结果。"""
+        key = self._key(image_hash)
+        data = pickle.dumps([face_to_dict(face) for face in faces])
+        old = self.conn.execute("SELECT size FROM faces WHERE key = ?", (key,)).fetchone()
+        if old is not None:
+            self.total_bytes -= old[0]
+        self.conn.execute("INSERT OR REPLACE INTO faces (key, data, size, last_used) VALUES (?, ?, ?, ?)",
+                          (key, data, len(data), time.time()))
+        self.total_bytes += len(data)
+        self.conn.commit()
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def _delete(self, key):
+        row = self.conn.execute("SELECT size FROM faces WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.total_bytes -= row[0]
+            self.conn.execute("DELETE FROM faces WHERE key = ?", (key,))
+            self.conn.commit()
+
+    def flush_touched(self):
+        """把内存中记录的最近使用时间批量写入缓存文件。"""
+        if len(self._touched) == 0:
+            return
+        self.conn.executemany("UPDATE faces SET last_used = ? WHERE key = ?",
+                              [(last_used, key) for key, last_used in self._touched.items()])
+        self.conn.commit()
+        self._touched = {}
+
+    def evict(self, target_ratio=0.9):
+        """按最近使用时间淘汰最旧的条目，直到总大小降到 max_bytes * target_ratio 以下。"""
+        self.flush_touched()
+        target = self.max_bytes * target_ratio
+        while self.total_bytes > target:
+            rows = self.conn.execute("SELECT key, size FROM faces ORDER BY last_used LIMIT 256").fetchall()
+            if len(rows) == 0:
+                break
+            for key, size in rows:
+                if self.total_bytes <= target:
+                    break
+                self.conn.execute("DELETE FROM faces WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.evicted += 1
+            self.conn.commit()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def report(self):
+        """输出本次运行的缓存命中情况。"""
+        self.flush_touched()
+        tqdm.write(f"特征缓存命中 {self.hits}/{self.hits + self.misses} ({self.hit_rate():.2%}), "
+                   f"淘汰 {self.evicted} 条, 缓存大小 {self.total_bytes / 1024 ** 2:.1f} MB / {self.max_bytes / 1024 ** 2:.0f} MB")
+
+    def close(self):
+        self.flush_touched()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,340 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+from pathlib import Path
+from scipy.sparse import csr_matrix
+from tqdm import tqdm
+from face_store import open_face_store
+from similarity_engine import normalize_embeddings
+
+def kmeans(x, k, iterations=10, seed=0, block_size=16384):
+    """欧氏距离 k-means，返回聚类中心。用于训练乘积量化的子空间码本。样本数少于 k 时调用方应先减小 k。"""
+    if not 0 < k <= len(x):
+        raise ValueError(f"聚类中心数 {k} 应在 1 到样本数 {len(x)} 之间")
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.empty(len(x), dtype=np.int64)
+        c_norms = np.sum(centroids ** 2, axis=1)
+        for start in range(0, len(x), block_size):
+            # |x - c|^2 = |x|^2 - 2 x·c + |c|^2，|x|^2 对 argmin 无影响
+            assign[start:start + block_size] = np.argmin(c_norms - 2 * x[start:start + block_size] @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        centroids = sums / np.maximum(counts, 1)[:, None]
+        # 空簇重新随机选取中心
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+    return centroids.astype(np.float32)
+
+class Float16Codec:
+    """半精度浮点量化，每维 2 字节。"""
+    kind = 'float16'
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.code_dtype, self.code_shape = np.dtype(np.float16), (dim,)
+
+    def train(self, x):
+        pass
+
+    def encode(self, x):
+        return np.asarray(x, dtype=np.float16)
+
+    def scores(self, queries, codes):
+        return queries @ np.asarray(codes, dtype=np.float32).T
+
+    def state(self):
+        return {}
+
+    def load_state(self, state):
+        pass
+
+class Int8Codec:
+    """
+    逐维仿射的 int8 标量量化，每维 1 字节。
+    x ≈ vmin + scale * (code + 128)，因此 q·x ≈ (q * scale)·code + q·(vmin + 128 * scale)，
+    相似度直接在码上用一次矩阵乘法计算，无需解码。
+    """
+    kind = 'int8'
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.code_dtype, self.code_shape = np.dtype(np.int8), (dim,)
+        self.vmin = self.scale = None
+
+    def train(self, x):
+        self.vmin = x.min(axis=0).astype(np.float32)
+        self.scale = np.maximum((x.max(axis=0) - self.vmin) / 255, 1e-8).astype(np.float32)
+
+    def encode(self, x):
+        codes = np.rint((np.asarray(x, dtype=np.float32) - self.vmin) / self.scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def scores(self, queries, codes):
+        offset = queries @ (self.vmin + 128 * self.scale)
+        return (queries * self.scale) @ np.asarray(codes, dtype=np.float32).T + offset[:, None]
+
+    def state(self):
+        return {'vmin': self.vmin, 'scale': self.scale}
+
+    def load_state(self, state):
+        self.vmin, self.scale = state['vmin'], state['scale']
+
+class PQCodec:
+    """
+    乘积量化：把特征切成 m 个子向量，每个子向量用 256 个中心的码本编码为 1 字节，每条特征 m 字节。
+    查询时先计算查询子向量与各子空间码本的点积表（m × 256），再按码查表求和（非对称距离计算，ADC）。
+    训练样本少于 256 条时码本中心数减为样本数，实际的中心数记录在 ks 中。
+    """
+    kind = 'pq'
+
+    def __init__(self, dim, m=64, ks=256):
+        if dim % m:
+            raise ValueError(f"特征维度 {dim} 不能被子空间数 {m} 整除")
+        self.dim, self.m, self.ks = dim, m, ks
+        self.code_dtype, self.code_shape = np.dtype(np.uint8), (m,)
+        self.codebooks = None
+
+    def train(self, x, iterations=10):
+        if len(x) == 0:
+            raise ValueError("没有可用于训练 PQ 码本的特征")
+        self.ks = min(self.ks, len(x))
+        sub_dim = self.dim // self.m
+        self.codebooks = np.stack([kmeans(x[:, j * sub_dim:(j + 1) * sub_dim], self.ks, iterations, seed=j)
+                                   for j in tqdm(range(self.m), desc="训练 PQ 码本")])
+
+    def encode(self, x, block_size=16384):
+        x = np.asarray(x, dtype=np.float32)
+        sub_dim = self.dim // self.m
+        codes = np.empty((len(x), self.m), dtype=np.uint8)
+        c_norms = np.sum(self.codebooks ** 2, axis=2)
+        for j in range(self.m):
+            sub = x[:, j * sub_dim:(j + 1) * sub_dim]
+            for start in range(0, len(x), block_size):
+                codes[start:start + block_size, j] = np.argmin(c_norms[j] - 2 * sub[start:start + block_size] @ self.codebooks[j].T, axis=1)
+        return codes
+
+    def scores(self, queries, codes):
+        sub_dim = self.dim // self.m
+        # 点积表 (查询数, m * ks)
+        tables = np.einsum('qjd,jkd->qjk', queries.reshape(len(queries), self.m, sub_dim), self.codebooks).reshape(len(queries), -1)
+        # 码展开为每行 m 个非零元的独热稀疏矩阵，查表求和即一次稀疏矩阵乘法，比逐子空间取值快一个数量级
+        codes = np.asarray(codes)
+        indices = (codes.astype(np.int32) + np.arange(self.m, dtype=np.int32) * self.ks).ravel()
+        one_hot = csr_matrix((np.ones(len(indices), dtype=np.float32), indices, np.arange(0, len(indices) + 1, self.m)),
+                             shape=(len(codes), self.m * self.ks))
+        return np.asarray((one_hot @ tables.T).T)
+
+    def state(self):
+        return {'codebooks': self.codebooks}
+
+    def load_state(self, state):
+        self.codebooks = state['codebooks']
+        self.m, self.ks = self.codebooks.shape[0], self.codebooks.shape[1]
+        self.code_shape = (self.m,)
+
+def create_codec(kind, dim, pq_m=64):
+    if kind == 'float16':
+        return Float16Codec(dim)
+    if kind == 'int8':
+        return Int8Codec(dim)
+    if kind == 'pq':
+        return PQCodec(dim, pq_m)
+    raise ValueError(f"不支持的量化方式: {kind}")
+
+class QuantizedEmbeddings:
+    """
+    人脸数据存储中特征列的量化副本，保存在 <目标目录>/face_store/quantized_<方式> 下。
+        meta.json       量化方式、参数、已编码的记录数和编码时的存储标识（标识变化后整体重建）
+        codebook.npz    码本或量化参数
+        codes.bin       按记录号顺序排列的码，只追加
+    特征先归一化再量化，码上计算的分数近似余弦相似度。
+    """
+
+    def __init__(self, store, kind='int8', pq_m=64):
+        self.store = store
+        self.directory = Path(store.directory) / f"quantized_{kind}"
+        self.meta_path = self.directory / 'meta.json'
+        dim = store.meta['dim']
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r') as file:
+                self.meta = json.load(file)
+            if self.meta.get('store_id') != store.identity or self.meta['count'] > len(store):
+                # 存储被重建或特征被改写后，码与记录号或特征不再对应，删除后重新训练和编码
+                tqdm.write(f"人脸数据存储已变化，删除过期的量化副本: {self.directory}")
+                shutil.rmtree(self.directory)
+        if self.meta_path.exists():
+            self.codec = create_codec(kind, dim, self.meta.get('pq_m', pq_m))
+            with np.load(self.directory / 'codebook.npz') as state:
+                self.codec.load_state(dict(state))
+        else:
+            self.meta = {'version': 1, 'kind': kind, 'count': 0, 'pq_m': pq_m, 'store_id': store.identity}
+            self.codec = create_codec(kind, dim, pq_m)
+        self._codes = None
+
+    def __len__(self):
+        return self.meta['count']
+
+    def nbytes(self):
+        return len(self) * self.codec.code_dtype.itemsize * int(np.prod(self.codec.code_shape))
+
+    def _save_meta(self):
+        tmp_path = self.meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(self.meta, file, indent=4)
+        os.replace(tmp_path, self.meta_path)
+
+    def sync(self, sample_size=50000, batch_size=100000, seed=0):
+        """编码存储中尚未编码的记录；首次调用时先用抽样的特征训练码本。存储为空时不训练，也不创建目录。"""
+        if len(self.store) == 0:
+            return 0
+        embeddings = self.store.column('embedding')
+        if not self.meta_path.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            rows = np.arange(len(self.store))
+            if len(rows) > sample_size:
+                rows = np.sort(np.random.default_rng(seed).choice(rows, sample_size, replace=False))
+            self.codec.train(normalize_embeddings(embeddings[rows]))
+            if self.codec.kind == 'pq':
+                self.meta['pq_ks'] = self.codec.ks  # 样本不足时实际使用的码本中心数
+            np.savez(self.directory / 'codebook.npz', **self.codec.state())
+            # 上次训练中途崩溃时可能残留码文件
+            open(self.directory / 'codes.bin', 'wb').close()
+            self._save_meta()
+        start = len(self)
+        with open(self.directory / 'codes.bin', 'r+b') as file:
+            file.truncate(start * self.codec.code_dtype.itemsize * int(np.prod(self.codec.code_shape)))
+        with open(self.directory / 'codes.bin', 'ab') as file:
+            for batch_start in tqdm(range(start, len(self.store), batch_size), desc=f"{self.codec.kind} 编码"):
+                batch = embeddings[batch_start:batch_start + batch_size]
+                file.write(self.codec.encode(normalize_embeddings(batch)).tobytes())
+                file.flush()
+                self.meta['count'] = batch_start + len(batch)
+                self._save_meta()
+        self._codes = None
+        return len(self) - start
+
+    @property
+    def codes(self):
+        if self._codes is None:
+            shape = (len(self),) + self.codec.code_shape
+            self._codes = np.memmap(self.directory / 'codes.bin', dtype=self.codec.code_dtype, mode='r', shape=shape) \
+                if len(self) else np.zeros(shape, dtype=self.codec.code_dtype)
+        return self._codes
+
+    def search(self, queries, k=10, rerank=0, mask=None, block_size=65536):
+        """
+        在码上计算近似相似度，返回每个查询的前 k 个记录号及分数。
+        参数:
+            queries: array, (查询数, 维度) 特征，不要求预先归一化。
+            rerank: int, 大于 0 时先取前 rerank * k 个候选，再用存储中的原始特征精确计算相似度并重新排序。
+            mask: array of bool, 参与检索的记录，默认为未删除的记录。
+        返回:
+            (indices, scores)，形状均为 (查询数, k)。
+        """
+        queries = normalize_embeddings(np.atleast_2d(queries))
+        mask = self.store.live_mask()[:len(self)] if mask is None else mask[:len(self)]
+        candidates = k * rerank if rerank > 0 else k
+        best_indices = np.full((len(queries), candidates), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), candidates), -np.inf, dtype=np.float32)
+        for start in range(0, len(self), block_size):
+            scores = self.codec.scores(queries, self.codes[start:start + block_size])
+            scores[:, ~mask[start:start + block_size]] = -np.inf
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_indices = np.concatenate([best_indices, np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)], axis=1)
+            top = np.argpartition(-merged_scores, min(candidates, merged_scores.shape[1] - 1), axis=1)[:, :candidates]
+            best_scores = np.take_along_axis(merged_scores, top, axis=1)
+            best_indices = np.take_along_axis(merged_indices, top, axis=1)
+        best_indices[np.isneginf(best_scores)] = -1
+        if rerank > 0:
+            embeddings = self.store.column('embedding')
+            valid = best_indices >= 0
+            exact = np.full(best_scores.shape, -np.inf, dtype=np.float32)
+            for q in range(len(queries)):
+                exact[q, valid[q]] = normalize_embeddings(embeddings[best_indices[q, valid[q]]]) @ queries[q]
+            best_scores = exact
+        order = np.argsort(-best_scores, axis=1)[:, :k]
+        return np.take_along_axis(best_indices, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+def exact_topk(store, queries, k, mask, block_size=65536):
+    """float32 精确检索，作为召回率评估的基准。"""
+    queries = normalize_embeddings(queries)
+    embeddings = store.column('embedding')
+    best_indices = np.full((len(queries), k), -1, dtype=np.int64)
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    for start in range(0, len(store), block_size):
+        scores = queries @ normalize_embeddings(embeddings[start:start + block_size]).T
+        scores[:, ~mask[start:start + block_size]] = -np.inf
+        merged_scores = np.concatenate([best_scores, scores], axis=1)
+        merged_indices = np.concatenate([best_indices, np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)], axis=1)
+        top = np.argpartition(-merged_scores, min(k, merged_scores.shape[1] - 1), axis=1)[:, :k]
+        best_scores = np.take_along_axis(merged_scores, top, axis=1)
+        best_indices = np.take_along_axis(merged_indices, top, axis=1)
+    return best_indices
+
+def recall_at_k(truth, found):
+    """每个查询的前 k 个精确结果中被找回的比例，取平均。"""
+    hits = [len(set(t[t >= 0]) & set(f[f >= 0])) / max(int(np.sum(t >= 0)), 1) for t, f in zip(truth, found)]
+    return float(np.mean(hits)) if hits else 0.0
+
+def evaluate(target_dir, kinds=('float16', 'int8', 'pq'), k=10, num_queries=500, rerank=4, pq_m=64, seed=0):
+    """
+    用目标目录自己的人脸数据评估各量化方式：存储大小、检索耗时，以及相对 float32 精确检索的 recall@k（含重排序前后）。
+    查询为随机抽取的已有人脸（最多一半，其余作为被检索的人脸），查询自身不计入结果。
+    """
+    store = open_face_store(target_dir)
+    mask = store.live_mask()
+    live_rows = np.flatnonzero(mask)
+    if len(live_rows) < 2:
+        tqdm.write("没有足够的人脸数据")
+        return []
+    query_rows = np.sort(np.random.default_rng(seed).choice(live_rows, min(num_queries, len(live_rows) // 2), replace=False))
+    queries = np.asarray(store.column('embedding')[query_rows], dtype=np.float32)
+    search_mask = mask.copy()
+    search_mask[query_rows] = False
+
+    start = time.perf_counter()
+    truth = exact_topk(store, queries, k, search_mask)
+    float32_seconds = time.perf_counter() - start
+    results = [{'kind': 'float32', 'bytes': len(store) * store.meta['dim'] * 4, 'recall': 1.0,
+                'ms_per_query': float32_seconds * 1000 / len(queries)}]
+    for kind in kinds:
+        quantized = QuantizedEmbeddings(store, kind, pq_m)
+        quantized.sync()
+        start = time.perf_counter()
+        found, _ = quantized.search(queries, k, mask=search_mask)
+        seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        reranked, _ = quantized.search(queries, k, rerank=rerank, mask=search_mask)
+        rerank_seconds = time.perf_counter() - start
+        results.append({'kind': kind, 'bytes': quantized.nbytes(), 'recall': recall_at_k(truth, found),
+                        'ms_per_query': seconds * 1000 / len(queries),
+                        'recall_rerank': recall_at_k(truth, reranked), 'ms_per_query_rerank': rerank_seconds * 1000 / len(queries)})
+    for result in results:
+        line = f"{result['kind']:<8} 大小 {result['bytes'] / 1024 ** 2:9.1f} MB  recall@{k} {result['recall']:.4f}  {result['ms_per_query']:.2f} ms/查询"
+        if 'recall_rerank' in result:
+            line += f"  重排序(x{rerank}) recall@{k} {result['recall_rerank']:.4f}  {result['ms_per_query_rerank']:.2f} ms/查询"
+        tqdm.write(line)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="量化人脸特征（float16 / int8 / PQ），并在自己的数据上评估 recall@k")
+    parser.add_argument('directory', help="目标目录（包含 face_store）")
+    parser.add_argument('--kinds', nargs='+', default=['float16', 'int8', 'pq'], choices=['float16', 'int8', 'pq'], help="量化方式")
+    parser.add_argument('--k', type=int, default=10, help="recall@k 的 k")
+    parser.add_argument('--queries', type=int, default=500, help="评估使用的查询数")
+    parser.add_argument('--rerank', type=int, default=4, help="重排序候选数为 rerank * k")
+    parser.add_argument('--pq-m', type=int, default=64, help="PQ 子空间数（每条特征的字节数）")
+    parser.add_argument('--encode-only', action='store_true', help="只编码新增的记录，不做评估")
+    args = parser.parse_args()
+    if args.encode_only:
+        store = open_face_store(args.directory)
+        for kind in args.kinds:
+            tqdm.write(f"{kind}: 新编码 {QuantizedEmbeddings(store, kind, args.pq_m).sync()} 条")
+    else:
+        evaluate(args.directory, args.kinds, args.k, args.queries, args.rerank, args.pq_m)
@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import cv2
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+from insightface.app import FaceAnalysis
+from insightface.utils import face_align
+from face_store import open_face_store, FLAG_DELETED
+
+class FaceChipArchive:
+    """
+    对齐后定长人脸图块的打包存档。
+    每张人脸按 5 个关键点对齐为 image_size x image_size 的 BGR 图块，所有图块顺序存放在一个 uint8 文件中。
+    目录结构:
+        meta.json   记录条数和图块尺寸
+        names.txt   每行一个人脸名，行号即图块序号
+        chips.u8    形状为 (条数, image_size, image_size, 3) 的 uint8 数组
+    识别模型可以直接读取内存映射后的图块重新提取特征，无需解码 JPEG，也无需再次检测和对齐。
+    """
+
+    def __init__(self, directory, image_size=112):
+        self.directory = Path(directory)
+        self.meta_path = self.directory / 'meta.json'
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r') as file:
+                self.meta = json.load(file)
+        else:
+            self.meta = {'version': 1, 'count': 0, 'image_size': image_size}
+        self._names = None
+        self._name_index = None
+        self._chips = None
+        self._writer = None
+        self._names_writer = None
+        self._pending = []
+
+    @classmethod
+    def exists(cls, directory):
+        return (Path(directory) / 'meta.json').exists()
+
+    def __len__(self):
+        return self.meta['count']
+
+    @property
+    def image_size(self):
+        return self.meta['image_size']
+
+    @property
+    def chip_path(self):
+        return self.directory / 'chips.u8'
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = []
+            names_path = self.directory / 'names.txt'
+            if names_path.exists():
+                with open(names_path, 'r') as file:
+                    for line in file:
+                        if len(self._names) >= len(self):
+                            break
+                        self._names.append(line.rstrip('\n'))
+        return self._names
+
+    @property
+    def name_index(self):
+        """人脸名 -> 最新的图块序号，同名人脸重新写入时以最后一次为准。"""
+        if self._name_index is None:
+            self._name_index = {name: idx for idx, name in enumerate(self.names)}
+        return self._name_index
+
+    @property
+    def chips(self):
+        """以只读内存映射方式返回全部图块。"""
+        if self._chips is None:
+            shape = (len(self), self.image_size, self.image_size, 3)
+            if len(self) == 0 or not self.chip_path.exists():
+                self._chips = np.zeros(shape, dtype=np.uint8)
+            else:
+                self._chips = np.memmap(self.chip_path, dtype=np.uint8, mode='r', shape=shape)
+        return self._chips
+
+    def get(self, name):
+        """按人脸名读取图块，不存在时返回 None。"""
+        idx = self.name_index.get(name)
+        return None if idx is None else np.array(self.chips[idx])
+
+    def append(self, name, chip):
+        if chip.shape != (self.image_size, self.image_size, 3):
+            raise ValueError(f"图块尺寸错误: {chip.shape}")
+        self._pending.append((name, np.ascontiguousarray(chip, dtype=np.uint8)))
+
+    def _open_writers(self):
+        if self._writer is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        chip_bytes = self.image_size * self.image_size * 3
+        # 上次写入中途崩溃时，图块文件可能比 meta.json 记录的条数长，先截断
+        if self.chip_path.exists() and self.chip_path.stat().st_size != len(self) * chip_bytes:
+            if self.chip_path.stat().st_size < len(self) * chip_bytes:
+                raise ValueError(f"图块文件 {self.chip_path} 长度不足 {len(self)} 条记录")
+            with open(self.chip_path, 'r+b') as file:
+                file.truncate(len(self) * chip_bytes)
+        names = self.names
+        with open(self.directory / 'names.txt', 'w') as file:
+            file.writelines(f"{name}\n" for name in names)
+        self._writer = open(self.chip_path, 'ab')
+        self._names_writer = open(self.directory / 'names.txt', 'a')
+
+    def flush(self):
+        if len(self._pending) == 0:
+            return
+        self._open_writers()
+        for _, chip in self._pending:
+            self._writer.write(chip.tobytes())
+        self._writer.flush()
+        self._names_writer.writelines(f"{name}\n" for name, _ in self._pending)
+        self._names_writer.flush()
+        start = len(self)
+        for offset, (name, _) in enumerate(self._pending):
+            self.names.append(name)
+            self.name_index[name] = start + offset
+        self.meta['count'] = start + len(self._pending)
+        self._pending = []
+        self._chips = None
+        tmp_path = self.meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(self.meta, file, indent=4)
+        os.replace(tmp_path, self.meta_path)
+
+    def close(self):
+        self.flush()
+        for writer in (self._writer, self._names_writer):
+            if writer is not None:
+                writer.close()
+        self._writer = None
+        self._names_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def is_grayscale(img):
+    """图像是否为灰度图（单通道，或三个通道完全相同，例如以彩色方式读入的灰度 JPEG）。"""
+    return img.ndim == 2 or (np.array_equal(img[:, :, 0], img[:, :, 1]) and np.array_equal(img[:, :, 1], img[:, :, 2]))
+
+def align_face_chip(img, kps, image_size=112, grayscale=False):
+    """
+    按 insightface 的 5 点模板对齐人脸，返回 image_size x image_size 的 BGR 图块。
+    grayscale 为 True 时先转为灰度：检测和提取特征在灰度缩略图上进行时，图块也应为灰度，特征才可比较。
+    """
+    if grayscale and img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return face_align.norm_crop(img, landmark=np.asarray(kps, dtype=np.float32), image_size=image_size)
+
+def directory_size(directory, suffix):
+    """统计目录中指定后缀文件的总大小和数量。"""
+    total_size = 0
+    count = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(suffix) and not entry.name.startswith('.'):
+            total_size += entry.stat().st_size
+            count += 1
+    return total_size, count
+
+def benchmark_reembed(target_dir, sample_size=1000, batch_size=64):
+    """
+    对比图块存档与 JPEG 人脸目录的存储大小和重新提取特征的吞吐量。
+    JPEG 路径需要解码、重新检测并对齐后再提取特征；图块路径直接对内存映射的图块批量提取特征。
+    JPEG 路径只加载检测和识别模型，不计入关键点、性别年龄等与重新提取特征无关的模型。
+    """
+    faces_dir = os.path.join(target_dir, 'faces')
+    archive = FaceChipArchive(os.path.join(target_dir, 'face_chips'))
+    if len(archive) == 0:
+        tqdm.write(f"图块存档为空: {archive.directory}")
+        return None
+
+    jpg_size, jpg_count = directory_size(faces_dir, '.jpg')
+    archive_size = archive.chip_path.stat().st_size
+    tqdm.write(f"JPEG人脸目录: {jpg_count} 个文件, {jpg_size / 1024 ** 2:.1f} MB; "
+               f"图块存档: {len(archive)} 个图块, {archive_size / 1024 ** 2:.1f} MB")
+
+    app = FaceAnalysis(allowed_modules=['detection', 'recognition'], providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+    app.prepare(ctx_id=0, det_size=(512, 512))
+    rec_model = app.models['recognition']
+    names = archive.names[:sample_size]
+
+    start = time.perf_counter()
+    for batch_start in tqdm(range(0, len(names), batch_size), desc="图块提取特征"):
+        batch = archive.chips[batch_start:batch_start + batch_size]
+        rec_model.get_feat(list(batch))
+    chip_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    jpg_done = 0
+    for name in tqdm(names, desc="JPEG提取特征"):
+        img = cv2.imread(os.path.join(faces_dir, name + '.jpg'))
+        if img is None:
+            continue
+        app.get(img)
+        jpg_done += 1
+    jpg_time = time.perf_counter() - start
+
+    report = {
+        'jpg_bytes': jpg_size,
+        'archive_bytes': archive_size,
+        'chip_faces_per_sec': len(names) / chip_time if chip_time > 0 else float('inf'),
+        'jpg_faces_per_sec': jpg_done / jpg_time if jpg_time > 0 else float('inf'),
+    }
+    tqdm.write(f"重新提取特征吞吐量: 图块 {report['chip_faces_per_sec']:.1f} 张/秒, JPEG {report['jpg_faces_per_sec']:.1f} 张/秒")
+    return report
+
+def reembed_store(target_dir, batch_size=64, new_rows_only=False):
+    """
+    用对齐图块重新提取人脸数据存储中的特征（例如换用识别模型后），不解码 JPEG，也不重新检测和对齐。
+    图块特征与缩略图上提取的特征不可直接比较，因此重新提取全部记录，没有图块的未删除记录标记为已删除；
+    存储的 meta.json 中 chip_embedded 记录前多少条记录的特征来自图块。
+    new_rows_only 为 True 时只处理 chip_embedded 之后新增的记录（裁切后调用，派生数据尚未用到这些记录，不更换存储标识），
+    存储的特征不来自图块时不做任何事。
+    返回更新的记录数。
+    """
+    archive = FaceChipArchive(os.path.join(target_dir, 'face_chips'))
+    store = open_face_store(target_dir)
+    if new_rows_only and 'chip_embedded' not in store.meta:
+        return 0
+    start = store.meta.get('chip_embedded', 0) if new_rows_only else 0
+    if start >= len(store):
+        return 0
+    rows = np.arange(start, len(store))
+    chip_rows = np.array([archive.name_index.get(store.names[row], -1) for row in rows], dtype=np.int64)
+    missing = rows[(chip_rows < 0) & store.live_mask(include_duplicates=True)[rows]]
+    if len(missing):
+        tqdm.write(f"{len(missing)} 条记录没有对齐图块，其特征无法与图块特征比较，标记为已删除")
+        store.set_flags(missing, FLAG_DELETED)
+    rows, chip_rows = rows[chip_rows >= 0], chip_rows[chip_rows >= 0]
+
+    if len(rows):
+        app = FaceAnalysis(allowed_modules=['detection', 'recognition'], providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+        app.prepare(ctx_id=0, det_size=(512, 512))
+        rec_model = app.models['recognition']
+        for batch_start in tqdm(range(0, len(rows), batch_size), desc="图块重新提取特征"):
+            batch_rows = rows[batch_start:batch_start + batch_size]
+            embeddings = rec_model.get_feat(list(archive.chips[chip_rows[batch_start:batch_start + batch_size]]))
+            store.update_embeddings(batch_rows, embeddings, renew_identity=False)
+    if not new_rows_only:
+        # 已有记录的特征被改写，索引、量化副本和聚类状态随存储标识一起失效
+        store.renew_identity()
+    store.set_meta('chip_embedded', len(store))
+    tqdm.write(f"已更新 {len(rows)} 条特征: {store.directory}")
+    return len(rows)
+
+if __name__ == "__main__":
+    # 用法:
+    #   python face_chip_archive.py <目标目录> [抽样数量]   对比图块与 JPEG 重新提取特征的吞吐量
+    #   python face_chip_archive.py <目标目录> reembed     用图块重新提取人脸数据存储中的全部特征
+    directory = sys.argv[1] if len(sys.argv) > 1 else ''
+    if not directory:
+        print("请输入目录路径")
+        exit(1)
+    if not os.path.isdir(directory):
+        print("请输入有效的目录路径")
+        exit(1)
+    if len(sys.argv) > 2 and sys.argv[2] == 'reembed':
+        reembed_store(directory)
+    else:
+        benchmark_reembed(directory, int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
@@ -1,6 +1,8 @@
 # 迭代编号：2
 import sys
 import os
+import json
+import argparse
 import errno
 import stat
 import cv2
@@ -11,7 +13,12 @@ from insightface.app import FaceAnalysis
 from tqdm import tqdm
 from pathlib import Path
 from PIL import Image
-from custom_face_data import serialize_face
+from face_store import open_face_store
+from face_chip_archive import FaceChipArchive, align_face_chip, is_grayscale, reembed_store
+from embedding_cache import EmbeddingCache, DEFAULT_CACHE_PATH, content_hash
+from face_presence_gate import create_face_gate, evaluate_face_gate
+from face_filters import create_face_filter, face_summary
+from descriptor_format import BinaryDescriptor, binary_descriptor_path, binary_is_current
 
 def handle_remove_readonly(func, path, exc):
     """移除只读文件的异常处理函数。"""
@@ -34,17 +41,45 @@ def decimal_to_custom_base(n):
         result = characters[remainder] + result
     return result
 
-def prepare_directory(directory):
-    """准备输出目录，确保目录存在且干净。"""
+def custom_base_to_decimal(s):
+    """decimal_to_custom_base 的逆运算，将基25字符串还原为十进制数字，含非法字符时抛出 ValueError。"""
+    characters = 'acdefhjkmnpqrtuvwxyz23478'
+    base = len(characters)
+    n = 0
+    for ch in s:
+        digit = characters.find(ch)
+        if digit < 0:
+            raise ValueError(f"非法字符 '{ch}'")
+        n = n * base + digit
+    return n
+
+def prepare_directory(directory, rebuild=False):
+    """
+    准备输出目录，确保目录存在。
+    rebuild 为 True 时删除已有的人脸图片目录、人脸数据、增量聚类状态、映射文件、检查点和拒绝记录，完整重建；否则保留已有结果以便断点续跑。
+    已有人脸结果但没有检查点时（旧版本的结果）同样完整重建。
+    返回人脸图片目录、映射文件路径和检查点文件路径。
+    """
     target_dir = Path(directory)
     faces_dir = target_dir / "faces"
     mapping_file_path = target_dir / "face_mapping.txt"
+    checkpoint_path = target_dir / "face_checkpoint.txt"
+    store_dir = target_dir / "face_store"
+    chips_dir = target_dir / "face_chips"
+    # 增量聚类状态按人脸数据存储的记录号保存，存储重建后随之失效
+    cluster_state_dir = target_dir / "cluster_state"
 
     if not target_dir.is_dir():
         tqdm.write(f"目录不存在: {directory}")
-        return None, None
+        return None, None, None
+
+    # 旧版本按枚举序号命名人脸文件且不写检查点，没有检查点时已有的人脸结果无法与缩略图对应，只能完整重建
+    if not rebuild and not checkpoint_path.exists() and \
+            ((faces_dir.is_dir() and any(faces_dir.iterdir())) or store_dir.exists()):
+        tqdm.write(f"已有人脸结果但没有检查点 {checkpoint_path}，完整重建")
+        rebuild = True
 
-    if faces_dir.exists():
+    if rebuild and faces_dir.exists():
         tqdm.write(f"删除已存在的人脸图片目录: {faces_dir}")
         try:
             shutil.rmtree(faces_dir, onerror=handle_remove_readonly)
@@ -59,11 +94,72 @@ def prepare_directory(directory):
                     shutil.rmtree(file_path, onerror=handle_remove_readonly)
     faces_dir.mkdir(parents=True, exist_ok=True)
 
-    if mapping_file_path.exists():
-        tqdm.write(f"删除已存在的映射文件: {mapping_file_path}")
-        mapping_file_path.unlink()
+    for data_dir in (store_dir, chips_dir, cluster_state_dir):
+        if rebuild and data_dir.exists():
+            tqdm.write(f"删除已存在的人脸数据目录: {data_dir}")
+            shutil.rmtree(data_dir, onerror=handle_remove_readonly)
+
+    if rebuild:
+        for file_path in (mapping_file_path, checkpoint_path, target_dir / "face_rejected.txt"):
+            if file_path.exists():
+                tqdm.write(f"删除已存在的文件: {file_path}")
+                file_path.unlink()
+
+    return faces_dir, mapping_file_path, checkpoint_path
+
+CHECKPOINT_CONFIG_PREFIX = '#config*'
 
-    return faces_dir, mapping_file_path
+def checkpoint_config(face_gate=None, face_filter=None):
+    """影响裁切结果的配置（预检门和人脸筛选条件），写在检查点第一行。"""
+    return json.dumps({'gate': face_gate.name if face_gate is not None else None,
+                       'filter': face_filter.settings if face_filter else {}}, sort_keys=True)
+
+def load_checkpoint(checkpoint_path):
+    """
+    读取人脸裁切检查点。
+    检查点第一行为 "#config*<配置>"，记录生成检查点时的预检门和人脸筛选条件（见 checkpoint_config），
+    之后每行记录一张已处理完成的缩略图，格式为 "缩略图文件名*原图路径*人脸文件名1|人脸文件名2"。
+    返回: (dict, str), {缩略图文件名: (原图路径, [人脸文件名])} 和配置，没有配置行时配置为 None。
+    """
+    records = {}
+    config = None
+    if checkpoint_path is None or not Path(checkpoint_path).exists():
+        return records, config
+    try:
+        with open(checkpoint_path, 'r') as file:
+            for line in file:
+                # 崩溃时可能留下写了一半的行，没有换行符的行视为未完成
+                if not line.endswith('\n'):
+                    continue
+                if line.startswith(CHECKPOINT_CONFIG_PREFIX):
+                    config = line[len(CHECKPOINT_CONFIG_PREFIX):-1]
+                    continue
+                parts = line[:-1].split('*')
+                if len(parts) != 3:
+                    continue
+                thumb_name, original, faces = parts
+                records[thumb_name] = (original, [face for face in faces.split('|') if face])
+    except Exception as e:
+        tqdm.write(f"读取检查点失败: {e}")
+    return records, config
+
+def write_checkpoint(checkpoint_path, config, records):
+    """用配置行和给定的记录整体重写检查点，先写临时文件再替换，中途崩溃不会留下残缺的检查点。"""
+    tmp_path = Path(checkpoint_path).with_suffix('.tmp')
+    with open(tmp_path, 'w') as file:
+        file.write(f"{CHECKPOINT_CONFIG_PREFIX}{config}\n")
+        for thumb_name, (original, face_filenames) in records.items():
+            file.write(f"{thumb_name}*{original}*{'|'.join(face_filenames)}\n")
+    os.replace(tmp_path, checkpoint_path)
+
+def remove_face_files(output_dir, face_filenames, face_store=None):
+    """删除指定人脸的裁切图片及其人脸数据文件，并在人脸数据存储中标记为已删除。"""
+    if face_store is not None:
+        face_store.delete([Path(face_filename).stem for face_filename in face_filenames])
+    for face_filename in face_filenames:
+        for file_path in (output_dir / face_filename, output_dir / (Path(face_filename).stem + ".pkl")):
+            if file_path.exists():
+                file_path.unlink()
 
 def get_image_mapping(file_path):
     """从映射文件中读取缩略图与原始图片的关系。"""
@@ -99,8 +195,44 @@ def calculate_original_coordinates(x, y, x2, y2, original_img, thumbnail_img, th
     original_y2 = int((y2 - offset_y) * scale)
     return original_x, original_y, original_x2, original_y2
 
-def process_images(thumbnail_paths, output_dir, mapping_dict, thumbnail_size=512):
-    """处理图像列表中的每个图像，识别人脸并保存裁剪的人脸图像。"""
+# 检测模型与参数的版本标识，作为特征缓存键的一部分，修改模型或检测参数时需要同步修改
+FACE_ANALYSIS_PROFILE = 'buffalo_l-det512-v1'
+
+def create_face_analysis():
+    """创建并初始化 insightface 人脸分析器。"""
+    app = FaceAnalysis(providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+    app.prepare(ctx_id=0, det_size=(512, 512))
+    return app
+
+def thumbnail_points_to_original(points, original_img, thumbnail_img, thumbnail_size):
+    """将缩略图中的点坐标（如人脸关键点）换算为原始图像中的坐标，与 calculate_original_coordinates 使用相同的缩放和偏移。"""
+    scale = max(original_img.shape[1] / thumbnail_img.shape[1], original_img.shape[0] / thumbnail_img.shape[0])
+    offset_x = (thumbnail_size - original_img.shape[1] / scale) / 2
+    offset_y = (thumbnail_size - original_img.shape[0] / scale) / 2
+    points = np.asarray(points, dtype=np.float32)
+    return (points - np.array([offset_x, offset_y], dtype=np.float32)) * scale
+
+def process_images(thumbnail_paths, output_dir, mapping_dict, thumbnail_size=512, face_gate=None, app=None, checkpoint_path=None, face_store=None, chip_archive=None,
+                   embedding_cache=None, write_crops=True, face_filter=None, rejected_path=None):
+    """
+    处理图像列表中的每个图像，识别人脸并保存裁剪的人脸图像。
+    face_gate 为可选的人脸预检门（见 face_presence_gate），预检未通过的图片不再运行 insightface，也不读取原图。
+    checkpoint_path 为检查点文件路径，检查点中已完成且原图未变化的缩略图会被跳过，
+    每处理完一张缩略图立即追加一行检查点，中断后重新运行只会处理新增或未完成的图片。
+    预检门跳过的图片和被筛选拒绝的人脸也记录在检查点中，因此检查点与生成时的预检门和筛选条件绑定，
+    两者变化时删除检查点中图片的已有结果并全部重新处理。
+    缩略图已不在列表中的检查点记录会被删除，其人脸图片和人脸数据一并删除，也不再出现在返回的映射中。
+    人脸文件名由缩略图编号推导（缩略图编号 * 100 + 人脸序号），因此多次运行之间保持稳定。
+    face_store 为列式人脸数据存储（见 face_store），每张缩略图的人脸数据在写检查点之前写入。
+    chip_archive 为对齐图块存档（见 face_chip_archive），按关键点从原图对齐出 112x112 图块，供之后免检测重新提取特征；
+    缩略图为灰度图时图块也转为灰度，与检测器的输入一致。
+    embedding_cache 为库级特征缓存（见 embedding_cache），命中时跳过检测和识别；
+    write_crops 为 False 时，命中缓存的图片只为还没有裁切图片的人脸读取原图生成裁切图片和对齐图块，
+    已有裁切图片的人脸不再重新生成；下游的聚类、导出和浏览都依赖 faces/ 下的裁切图片。
+    face_filter 为裁切前的人脸筛选条件（见 face_filters），推理后立即判断，被拒绝的人脸不写任何文件，
+    只在 rejected_path 中追加一行 "人脸名*原图路径*拒绝条件*检测得分*年龄*性别*宽*高*pitch*yaw*roll"；
+    一张图片的人脸全部被拒绝时不读取原图。人脸序号包含被拒绝的人脸，因此放宽条件重建后人脸文件名不变。
+    """
     if len(thumbnail_paths) == 0:
         tqdm.write("没有缩略图图片")
         return []
@@ -108,39 +240,160 @@ def process_images(thumbnail_paths, output_dir, mapping_dict, thumbnail_size=512
         tqdm.write("没有映射关系")
         return []
     expand_range = 0.2
-    app = FaceAnalysis(providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
-    app.prepare(ctx_id=0, det_size=(512, 512))
     face_mappings = []
-    for index, thumb_path in enumerate(tqdm(thumbnail_paths, desc="处理图片")):
-        thumbnail_img = cv2.imread(str(thumb_path))
+
+    # 根据检查点筛选需要处理的缩略图
+    records, recorded_config = load_checkpoint(checkpoint_path)
+    config = checkpoint_config(face_gate, face_filter)
+    reset_checkpoint = recorded_config != config
+    if reset_checkpoint and records:
+        tqdm.write(f"预检门或人脸筛选条件已变化 ({recorded_config} -> {config})，重新处理检查点中的 {len(records)} 张图片")
+        for original, face_filenames in records.values():
+            remove_face_files(output_dir, face_filenames, face_store)
+        records = {}
+    # 缩略图已不在列表中的记录（图片被去重、源文件被删除或缩略图重新编号），其人脸结果不再对应任何图片
+    current_names = {thumb_path.name for thumb_path in thumbnail_paths}
+    stale_names = [thumb_name for thumb_name in records if thumb_name not in current_names]
+    if stale_names:
+        tqdm.write(f"检查点中有 {len(stale_names)} 张图片已不在缩略图列表中，删除其人脸结果")
+        for thumb_name in stale_names:
+            remove_face_files(output_dir, records.pop(thumb_name)[1], face_store)
+        if checkpoint_path is not None:
+            write_checkpoint(checkpoint_path, config, records)
+    pending = []
+    for thumb_path in thumbnail_paths:
         original_img_path = mapping_dict.get(thumb_path.stem)
-        original_img = cv2.imread(original_img_path) if original_img_path else None
-        if original_img is None:
-            tqdm.write(f"找不到 {thumb_path.name} 的原始图片: {original_img_path}")
+        record = records.get(thumb_path.name)
+        if record is not None and record[0] == original_img_path:
+            face_mappings.extend(f"{record[0]}*{face_filename}" for face_filename in record[1])
             continue
-        faces = app.get(thumbnail_img)
-        # faces = app.get(original_img)
-        for face_id, face in enumerate(faces):
-            bbox = face.bbox.astype(int)
-            x, y, x2, y2 = bbox
-            w, h = x2 - x, y2 - y
-            x, y = max(0, x - int(expand_range * 0.5 * w)), max(0, y - int(expand_range * 0.5 * h))
-            x2, y2 = min(thumbnail_img.shape[1], x2 + int(expand_range * 0.5 * w)), min(thumbnail_img.shape[0], y2 + int(expand_range * 0.5 * h))
-            cropped_face_thumbnail = thumbnail_img[y:y2, x:x2]
-            x, y, x2, y2 = calculate_original_coordinates(x, y, x2, y2, original_img, thumbnail_img, thumbnail_size)
-            # 确保坐标在原图范围内
-            x, y, x2, y2 = max(0, x), max(0, y), min(x2, original_img.shape[1]), min(y2, original_img.shape[0])
-
-            cropped_face = original_img[y:y2, x:x2]
-            face_filename = decimal_to_custom_base(index * 100 + face_id) + ".jpg"
-            # face_file_thumbnail = decimal_to_custom_base(index * 100 + face_id) + "_thumbnail" + ".jpg"
-            # cv2.imwrite(str(output_dir / face_file_thumbnail), cropped_face_thumbnail)
-            if not os.path.exists(str(output_dir / face_filename)):
-                cv2.imwrite(str(output_dir / face_filename), cropped_face)
-            serialize_face(face, str(output_dir / (face_filename[:-4] + ".pkl")))
-            # with open(str(output_dir / (face_filename[:-4] + ".txt")), 'w') as f:
-                # f.write(str(face))
-            face_mappings.append(f"{original_img_path}*{face_filename}")
+        if record is not None:
+            # 缩略图重新生成后对应了不同的原图，旧的裁切结果已经失效
+            remove_face_files(output_dir, record[1], face_store)
+        pending.append(thumb_path)
+    tqdm.write(f"检查点中已完成 {len(thumbnail_paths) - len(pending)} 张图片, 待处理 {len(pending)} 张")
+    if len(pending) == 0:
+        return face_mappings
+
+    gate_skipped = 0
+    originals_skipped = 0
+    crops_written = 0
+    crop_bytes = 0
+    checkpoint_file = open(checkpoint_path, 'w' if reset_checkpoint else 'a') if checkpoint_path is not None else None
+    if checkpoint_file is not None and reset_checkpoint:
+        checkpoint_file.write(f"{CHECKPOINT_CONFIG_PREFIX}{config}\n")
+        checkpoint_file.flush()
+    rejected_file = open(rejected_path, 'w' if reset_checkpoint else 'a') if face_filter is not None and rejected_path is not None else None
+    if reset_checkpoint and rejected_file is None and rejected_path is not None and Path(rejected_path).exists():
+        Path(rejected_path).unlink()  # 取消筛选后旧的拒绝记录不再有效
+    try:
+        for thumb_path in tqdm(pending, desc="处理图片"):
+            try:
+                thumb_number = custom_base_to_decimal(thumb_path.stem)
+            except ValueError as e:
+                tqdm.write(f"无法从缩略图名推导人脸文件名 {thumb_path.name}: {e}")
+                continue
+            try:
+                thumb_bytes = thumb_path.read_bytes()
+            except OSError as e:
+                tqdm.write(f"读取缩略图失败: {thumb_path}: {e}")
+                continue
+            thumbnail_img = cv2.imdecode(np.frombuffer(thumb_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if thumbnail_img is None:
+                tqdm.write(f"读取缩略图失败: {thumb_path}")
+                continue
+            original_img_path = mapping_dict.get(thumb_path.stem)
+            face_filenames = []
+            if face_gate is not None and not face_gate.has_face(thumbnail_img):
+                gate_skipped += 1
+            else:
+                # 检测在缩略图上进行，缩略图内容即模型输入，以缩略图内容哈希作为缓存键
+                image_hash = content_hash(thumb_bytes) if embedding_cache is not None else None
+                faces = embedding_cache.get(image_hash) if embedding_cache is not None else None
+                cache_hit = faces is not None
+                if faces is None:
+                    if app is None:
+                        app = create_face_analysis()
+                    faces = app.get(thumbnail_img)
+                    # faces = app.get(original_img)
+                    if embedding_cache is not None:
+                        embedding_cache.put(image_hash, faces)
+                # 推理后立即筛选，被拒绝的人脸只记录一行索引，不读原图、不写文件
+                accepted = []
+                for face_id, face in enumerate(faces):
+                    face_filename = decimal_to_custom_base(thumb_number * 100 + face_id) + ".jpg"
+                    reason = face_filter.check(face) if face_filter is not None else None
+                    if reason is not None:
+                        if rejected_file is not None:
+                            rejected_file.write(f"{face_filename[:-4]}*{original_img_path}*{reason}*{face_summary(face)}\n")
+                        continue
+                    accepted.append((face_filename, face))
+                if len(faces) > 0 and len(accepted) == 0 and (not cache_hit or write_crops):
+                    originals_skipped += 1
+                if not cache_hit or write_crops:
+                    crop_names = {face_filename for face_filename, _ in accepted}
+                else:
+                    crop_names = {face_filename for face_filename, _ in accepted if not (output_dir / face_filename).exists()}
+                need_crops = len(crop_names) > 0
+                original_img = None
+                if need_crops:
+                    original_img = cv2.imread(original_img_path) if original_img_path else None
+                    if original_img is None:
+                        tqdm.write(f"找不到 {thumb_path.name} 的原始图片: {original_img_path}")
+                        continue
+                    # 图块与检测器的输入（缩略图）保持相同的颜色空间
+                    chip_grayscale = chip_archive is not None and is_grayscale(thumbnail_img)
+                for face_filename, face in accepted:
+                    if face_store is not None:
+                        face_store.append(face_filename[:-4], face)
+                    face_filenames.append(face_filename)
+                    face_mappings.append(f"{original_img_path}*{face_filename}")
+                    if face_filename not in crop_names:
+                        continue
+                    bbox = face.bbox.astype(int)
+                    x, y, x2, y2 = bbox
+                    w, h = x2 - x, y2 - y
+                    x, y = max(0, x - int(expand_range * 0.5 * w)), max(0, y - int(expand_range * 0.5 * h))
+                    x2, y2 = min(thumbnail_img.shape[1], x2 + int(expand_range * 0.5 * w)), min(thumbnail_img.shape[0], y2 + int(expand_range * 0.5 * h))
+                    cropped_face_thumbnail = thumbnail_img[y:y2, x:x2]
+                    x, y, x2, y2 = calculate_original_coordinates(x, y, x2, y2, original_img, thumbnail_img, thumbnail_size)
+                    # 确保坐标在原图范围内
+                    x, y, x2, y2 = max(0, x), max(0, y), min(x2, original_img.shape[1]), min(y2, original_img.shape[0])
+
+                    cropped_face = original_img[y:y2, x:x2]
+                    # face_file_thumbnail = decimal_to_custom_base(thumb_number * 100 + face_id) + "_thumbnail" + ".jpg"
+                    # cv2.imwrite(str(output_dir / face_file_thumbnail), cropped_face_thumbnail)
+                    # 未完成的图片可能留下了残缺的文件，重新处理时先清理再写入
+                    remove_face_files(output_dir, [face_filename])
+                    cv2.imwrite(str(output_dir / face_filename), cropped_face)
+                    if face_filter is not None and (output_dir / face_filename).exists():
+                        crops_written += 1
+                        crop_bytes += (output_dir / face_filename).stat().st_size
+                    if chip_archive is not None and face.kps is not None:
+                        kps = thumbnail_points_to_original(face.kps, original_img, thumbnail_img, thumbnail_size)
+                        chip_archive.append(face_filename[:-4], align_face_chip(original_img, kps, chip_archive.image_size, chip_grayscale))
+                    # with open(str(output_dir / (face_filename[:-4] + ".txt")), 'w') as f:
+                        # f.write(str(face))
+            if face_store is not None:
+                face_store.flush()
+            if chip_archive is not None:
+                chip_archive.flush()
+            if rejected_file is not None:
+                rejected_file.flush()
+            if checkpoint_file is not None:
+                checkpoint_file.write(f"{thumb_path.name}*{original_img_path}*{'|'.join(face_filenames)}\n")
+                checkpoint_file.flush()
+    finally:
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+        if rejected_file is not None:
+            rejected_file.close()
+    if embedding_cache is not None:
+        embedding_cache.report()
+    if face_filter is not None:
+        face_filter.report(crop_bytes / crops_written if crops_written else None, originals_skipped)
+    if face_gate is not None:
+        tqdm.write(f"预检门[{face_gate.name}] 跳过 {gate_skipped}/{len(pending)} 张图片 ({gate_skipped / len(pending):.2%})")
     return face_mappings
 
 def save_mappings(mapping_file_path, mappings):
@@ -150,7 +403,12 @@ def save_mappings(mapping_file_path, mappings):
             f.write(mapping + "\n")
 
 def parse_unique_images(file_path):
-    """解析文件以获取位于'Unique Images:'部分下的图片列表。"""
+    """
+    解析文件以获取位于'Unique Images:'部分下的图片列表。
+    存在不旧于文本文件的二进制描述文件时，只读取其中唯一图片的切片。
+    """
+    if binary_is_current(file_path):
+        return BinaryDescriptor(binary_descriptor_path(file_path)).unique_images()
     with open(file_path, 'r') as file:
         recording = False
         images = []
@@ -166,29 +424,76 @@ def parse_unique_images(file_path):
                 images.append(line)
     return images
 
-def main(image_list_file):
-    """主函数，负责整个处理流程。"""
+def main(image_list_file, face_gate=None, gate_eval_samples=200, rebuild=False, cache_path=DEFAULT_CACHE_PATH,
+         cache_max_bytes=20 * 1024 ** 3, write_crops=True, face_filter=None):
+    """
+    主函数，负责整个处理流程。
+    参数:
+        image_list_file: str, 去重描述文件路径。
+        face_gate: FaceGate 或 str, 人脸预检门或其名字（'haar' / 'yunet'），None 表示不使用。
+        gate_eval_samples: int, 使用预检门时，先抽样多少张图片与完整检测器对比，报告跳过率与召回率，0 表示不评估。
+        rebuild: bool, 为 True 时清空已有的人脸结果和检查点后完整重建，否则只处理新增或未完成的图片。
+        cache_path: str, 库级特征缓存文件路径，None 表示不使用缓存。
+        cache_max_bytes: int, 特征缓存的大小上限。
+        write_crops: bool, 命中缓存时是否重新生成已有的裁切图片，缺失的裁切图片总会生成。
+        face_filter: FaceFilter, 裁切前的人脸筛选条件（见 face_filters），None 表示保留全部人脸。
+            预检门或筛选条件与检查点记录的不同时，检查点中的图片全部重新处理。
+    """
     directory = Path(image_list_file).parent
-    output_dir, mapping_file_path = prepare_directory(directory)
+    output_dir, mapping_file_path, checkpoint_path = prepare_directory(directory, rebuild)
     if output_dir is None:
         return
 
     # 读取缩略图列表和映射文件
     thumbnail_paths = [directory / 'thumbnail' / image_name for image_name in parse_unique_images(image_list_file)]
     mapping_dict = get_image_mapping(directory / 'mapping.txt')
-    mappings = process_images(thumbnail_paths, output_dir, mapping_dict)
+    if isinstance(face_gate, str):
+        face_gate = create_face_gate(face_gate)
+    app = None
+    if face_gate is not None and gate_eval_samples > 0:
+        app = create_face_analysis()
+        evaluate_face_gate(face_gate, app, thumbnail_paths, gate_eval_samples)
+    embedding_cache = EmbeddingCache(cache_path, FACE_ANALYSIS_PROFILE, cache_max_bytes) if cache_path else None
+    try:
+        with open_face_store(directory) as face_store, FaceChipArchive(directory / 'face_chips') as chip_archive:
+            mappings = process_images(thumbnail_paths, output_dir, mapping_dict, face_gate=face_gate, app=app,
+                                      checkpoint_path=checkpoint_path, face_store=face_store, chip_archive=chip_archive,
+                                      embedding_cache=embedding_cache, write_crops=write_crops,
+                                      face_filter=face_filter, rejected_path=directory / 'face_rejected.txt')
+    finally:
+        if embedding_cache is not None:
+            embedding_cache.close()
+    # 特征已改为从图块提取的存储（见 face_chip_archive.reembed_store），新增的人脸同样从图块提取，保持可比较
+    reembed_store(directory, new_rows_only=True)
     save_mappings(mapping_file_path, mappings)
     tqdm.write(f'裁切完成，人脸数量: {len(mappings)}')
     return len(mappings)
 
 if __name__ == "__main__":
-    # sys.argv 是一个列表，包含了命令行参数
-    # main 函数调用时传入 sys.argv，这样 main 就可以接收所有命令行参数
-    filename = sys.argv[1] if len(sys.argv) > 1 else ''
+    parser = argparse.ArgumentParser(description="从去重后的缩略图中检测并裁切人脸")
+    parser.add_argument('filename', nargs='?', default='', help="去重描述文件路径（descriptor_final.txt）")
+    parser.add_argument('--face-gate', choices=['none', 'haar', 'yunet'], default='none', help="insightface 之前的人脸预检门")
+    parser.add_argument('--gate-eval-samples', type=int, default=200, help="预检门与完整检测器对比评估的抽样数量，0 表示不评估")
+    parser.add_argument('--rebuild', action='store_true', help="忽略检查点，删除已有人脸结果后完整重建")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help="库级特征缓存文件路径，传入空字符串表示不使用缓存")
+    parser.add_argument('--cache-max-gb', type=float, default=20, help="特征缓存大小上限（GB）")
+    parser.add_argument('--no-crops-on-hit', action='store_true', help="命中缓存时不重新生成裁切图片")
+    parser.add_argument('--gender', type=int, choices=[0, 1], help="只保留该性别的人脸（0 为女性，1 为男性）")
+    parser.add_argument('--min-det-score', type=float, help="检测得分下限")
+    parser.add_argument('--age-range', type=int, nargs=2, metavar=('MIN', 'MAX'), help="年龄闭区间")
+    parser.add_argument('--min-face-size', type=int, help="人脸边界框短边下限（缩略图像素）")
+    parser.add_argument('--max-yaw', type=float, help="偏航角绝对值上限（度）")
+    parser.add_argument('--max-pitch', type=float, help="俯仰角绝对值上限（度）")
+    parser.add_argument('--max-roll', type=float, help="翻滚角绝对值上限（度）")
+    args = parser.parse_args()
+    filename = args.filename
     if not filename:
         print("请输入文件路径")
         exit(1)
     if not os.path.isfile(filename):
         print("请输入有效的文件路径")
         exit(1)
-    main(filename)
\ No newline at end of file
+    face_filter = create_face_filter(args.gender, args.min_det_score, args.age_range, args.min_face_size,
+                                     args.max_yaw, args.max_pitch, args.max_roll)
+    main(filename, args.face_gate, args.gate_eval_samples, args.rebuild, args.cache,
+         int(args.cache_max_gb * 1024 ** 3), not args.no_crops_on_hit, face_filter)
\ No newline at end of file
@@ -0,0 +1,81 @@
+import numpy as np
+from tqdm import tqdm
+
+class FaceFilter:
+    """
+    裁切前的人脸筛选条件，在 insightface 推理之后、读取原图和写裁切图片之前判断。
+    被拒绝的人脸不生成裁切图片、对齐图块和人脸数据记录，只在拒绝记录文件中留下一行紧凑的索引。
+    所有条件都是可选的，未设置的条件不参与判断：
+        gender: int, 只保留该性别（0 为女性，1 为男性）。
+        min_det_score: float, 检测得分下限。
+        age_range: (int, int), 年龄闭区间。
+        min_size: int, 人脸边界框短边下限（缩略图像素，即检测器输入上的大小）。
+        max_yaw / max_pitch / max_roll: float, 头部姿态角绝对值上限（度）。
+    """
+
+    def __init__(self, gender=None, min_det_score=None, age_range=None, min_size=None, max_yaw=None, max_pitch=None, max_roll=None):
+        # 已设置的条件及其取值，写入裁切检查点，条件变化时检查点失效
+        self.settings = {name: list(value) if isinstance(value, (tuple, list)) else value
+                         for name, value in (('gender', gender), ('min_det_score', min_det_score), ('age_range', age_range),
+                                             ('min_size', min_size), ('max_yaw', max_yaw), ('max_pitch', max_pitch),
+                                             ('max_roll', max_roll)) if value is not None}
+        self.predicates = []
+        if gender is not None:
+            self.predicates.append(('gender', lambda face: getattr(face, 'gender', None) is not None and int(face.gender) == gender))
+        if min_det_score is not None:
+            self.predicates.append(('det_score', lambda face: float(face.det_score) >= min_det_score))
+        if age_range is not None:
+            self.predicates.append(('age', lambda face: getattr(face, 'age', None) is not None and age_range[0] <= face.age <= age_range[1]))
+        if min_size is not None:
+            self.predicates.append(('size', lambda face: min(face.bbox[2] - face.bbox[0], face.bbox[3] - face.bbox[1]) >= min_size))
+        # insightface 的姿态为 (pitch, yaw, roll)
+        for name, index, limit in (('pitch', 0, max_pitch), ('yaw', 1, max_yaw), ('roll', 2, max_roll)):
+            if limit is not None:
+                self.predicates.append((name, lambda face, index=index, limit=limit:
+                                        getattr(face, 'pose', None) is not None and abs(float(face.pose[index])) <= limit))
+        self.counts = {name: 0 for name, _ in self.predicates}
+        self.checked = 0
+
+    def __bool__(self):
+        return len(self.predicates) > 0
+
+    def check(self, face):
+        """返回第一个未通过的条件名，全部通过时返回 None，并累计各条件的拒绝数。"""
+        self.checked += 1
+        for name, predicate in self.predicates:
+            if not predicate(face):
+                self.counts[name] += 1
+                return name
+        return None
+
+    @property
+    def rejected(self):
+        return sum(self.counts.values())
+
+    def describe(self):
+        return ', '.join(name for name, _ in self.predicates) or '无'
+
+    def report(self, avg_crop_bytes=None, originals_skipped=0):
+        """打印各条件的拒绝数，以及据本次写入的平均裁切图片大小估算少写的数据量。"""
+        if not self:
+            return
+        details = ', '.join(f"{name} {count}" for name, count in self.counts.items())
+        tqdm.write(f"人脸筛选[{self.describe()}] 拒绝 {self.rejected}/{self.checked} 个人脸 ({self.rejected / max(self.checked, 1):.2%}): {details}")
+        saved = f"少写裁切图片 {self.rejected} 张"
+        if avg_crop_bytes:
+            saved += f" (约 {self.rejected * avg_crop_bytes / 1024 ** 2:.1f} MB)"
+        tqdm.write(f"{saved}, 所有人脸均被拒绝而未读取的原图 {originals_skipped} 张")
+
+def face_summary(face):
+    """被拒绝人脸的紧凑索引字段: 检测得分、年龄、性别、边界框宽高、姿态角。"""
+    bbox = np.asarray(face.bbox, dtype=np.float32)
+    pose = getattr(face, 'pose', None)
+    pose = [float(v) for v in pose] if pose is not None else [float('nan')] * 3
+    fields = [float(face.det_score), getattr(face, 'age', -1), getattr(face, 'gender', -1),
+              float(bbox[2] - bbox[0]), float(bbox[3] - bbox[1])] + pose
+    return '*'.join(f"{v:.3g}" if isinstance(v, float) else str(int(v)) for v in fields)
+
+def create_face_filter(gender=None, min_det_score=None, age_range=None, min_size=None, max_yaw=None, max_pitch=None, max_roll=None):
+    """根据参数创建人脸筛选条件，没有任何条件时返回 None。"""
+    face_filter = FaceFilter(gender, min_det_score, age_range, min_size, max_yaw, max_pitch, max_roll)
+    return face_filter if face_filter else None
@@ -0,0 +1,358 @@
+import os
+import sys
+import json
+import time
+import shutil
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+from face_store import FaceStore, open_face_store, FLAG_DELETED, FLAG_DUPLICATE
+from similarity_engine import normalize_embeddings
+
+# 记录号编码：高位为文件夹序号，低 40 位为该文件夹人脸数据存储中的记录号
+ROW_BITS = 40
+ROW_MASK = (1 << ROW_BITS) - 1
+
+def spherical_kmeans(x, k, iterations=10, seed=0, block_size=8192):
+    """在单位向量上做 k-means（以点积为相似度），返回归一化后的聚类中心。"""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.empty(len(x), dtype=np.int64)
+        for start in range(0, len(x), block_size):
+            assign[start:start + block_size] = np.argmax(x[start:start + block_size] @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        # 空簇重新随机选取中心
+        empty = counts == 0
+        sums[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+        centroids = normalize_embeddings(sums)
+    return centroids
+
+class FaceIndex:
+    """
+    人脸特征的倒排文件（IVF）近似最近邻索引，可覆盖单个文件夹或整个图库的多个文件夹。
+    训练时用球面 k-means 把特征空间划分为 nlist 个单元，每个单元一个倒排列表，
+    列表中按顺序存放记录号和归一化后的 float16 特征，插入新的人脸只需追加到对应列表的末尾。
+    查询时只扫描与查询向量最相近的 nprobe 个单元，百万人脸规模下单次查询只需扫描数千条特征。
+    目录结构:
+        index.json              维度、单元数、训练时的特征数、各列表已提交的条数、
+                                已收录的文件夹及各自已收录的记录数和人脸数据存储标识
+        centroids.npy           单元中心
+        lists/<单元>.ids        int64 编码后的记录号
+        lists/<单元>.vec        float16 归一化特征
+    列表文件先追加，index.json 中的条数和已收录记录数随后一起原子更新；中途崩溃时多写的部分在下次追加前截掉。
+    文件夹的人脸数据存储被重建（标识变化或记录数变少）后，该文件夹的记录号失效，查询时跳过，再次收录时先移除再重新收录。
+    索引总量超过训练时特征数的 retrain_factor 倍时重新训练单元划分并重建全部列表。
+    """
+
+    def __init__(self, directory, retrain_factor=4):
+        self.directory = Path(directory)
+        self.meta_path = self.directory / 'index.json'
+        self.retrain_factor = retrain_factor
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r') as file:
+                self.meta = json.load(file)
+            self.centroids = np.load(self.directory / 'centroids.npy')
+            if 'list_sizes' not in self.meta:
+                # 旧版索引没有记录列表条数，以文件长度为准
+                self.meta['list_sizes'] = [self._file_rows(list_id) for list_id in range(self.meta['nlist'])]
+        else:
+            self.meta = {'version': 1, 'dim': 512, 'nlist': 0, 'trained_count': 0, 'list_sizes': [], 'sources': []}
+            self.centroids = None
+        self._lists = {}
+        self._stores = {}
+        self._mappings = {}
+        self._valid = {}
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return sum(source['indexed'] for source in self.meta['sources'])
+
+    def _save_meta(self):
+        tmp_path = self.meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(self.meta, file, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+
+    def _list_path(self, list_id, suffix):
+        return self.directory / 'lists' / f"{list_id}.{suffix}"
+
+    def _file_rows(self, list_id):
+        path = self._list_path(list_id, 'ids')
+        return path.stat().st_size // 8 if path.exists() else 0
+
+    def train(self, embeddings, nlist=None, sample_size=100000, seed=0):
+        """用一批特征训练单元划分并清空全部列表，nlist 默认取 4 * sqrt(特征数)，限制在 [16, 4096]。"""
+        x = normalize_embeddings(embeddings)
+        if nlist is None:
+            nlist = int(np.clip(4 * np.sqrt(len(x)), 16, 4096))
+        nlist = min(nlist, len(x))
+        trained_count = len(x)
+        if len(x) > sample_size:
+            x = x[np.random.default_rng(seed).choice(len(x), sample_size, replace=False)]
+        tqdm.write(f"训练索引: {len(x)} 条特征, {nlist} 个单元")
+        self.centroids = spherical_kmeans(x, nlist, seed=seed).astype(np.float32)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lists_dir = self.directory / 'lists'
+        if lists_dir.exists():
+            shutil.rmtree(lists_dir)
+        lists_dir.mkdir()
+        self._lists = {}
+        np.save(self.directory / 'centroids.npy', self.centroids)
+        self.meta['dim'] = int(self.centroids.shape[1])
+        self.meta['nlist'] = int(nlist)
+        self.meta['trained_count'] = int(trained_count)
+        self.meta['list_sizes'] = [0] * int(nlist)
+        for source in self.meta['sources']:
+            source['indexed'] = 0
+        self._save_meta()
+
+    def _assign(self, x, block_size=8192):
+        assign = np.empty(len(x), dtype=np.int64)
+        for start in range(0, len(x), block_size):
+            assign[start:start + block_size] = np.argmax(x[start:start + block_size] @ self.centroids.T, axis=1)
+        return assign
+
+    def add(self, ids, embeddings):
+        """
+        插入一批特征，ids 为编码后的记录号。
+        只追加列表文件并更新内存中的列表条数，调用方随后保存 index.json 才算提交。
+        """
+        if len(ids) == 0:
+            return
+        x = normalize_embeddings(embeddings)
+        assign = self._assign(x)
+        order = np.argsort(assign, kind='stable')
+        assign, ids, x = assign[order], np.asarray(ids, dtype=np.int64)[order], x[order]
+        starts = np.flatnonzero(np.r_[True, assign[1:] != assign[:-1]])
+        ends = np.r_[starts[1:], len(assign)]
+        row_bytes = 2 * self.meta['dim']
+        for start, end in zip(starts, ends):
+            list_id = int(assign[start])
+            committed = self.meta['list_sizes'][list_id]
+            # 上次追加后未提交就崩溃时，文件中可能有多余的条目，先截断到已提交的条数
+            for suffix, size in (('ids', 8), ('vec', row_bytes)):
+                path = self._list_path(list_id, suffix)
+                if path.exists() and path.stat().st_size != committed * size:
+                    with open(path, 'r+b') as file:
+                        file.truncate(committed * size)
+            with open(self._list_path(list_id, 'ids'), 'ab') as file:
+                file.write(ids[start:end].tobytes())
+            with open(self._list_path(list_id, 'vec'), 'ab') as file:
+                file.write(x[start:end].astype(np.float16).tobytes())
+            self.meta['list_sizes'][list_id] = committed + int(end - start)
+            self._lists.pop(list_id, None)
+
+    def _source_index(self, folder):
+        folder = os.path.abspath(folder)
+        for idx, source in enumerate(self.meta['sources']):
+            if source['folder'] == folder:
+                return idx
+        self.meta['sources'].append({'folder': folder, 'indexed': 0, 'store_id': None})
+        return len(self.meta['sources']) - 1
+
+    def _remove_source(self, source_idx):
+        """从全部列表中移除一个文件夹的记录（其人脸数据存储已被重建，记录号失效）。"""
+        for list_id in range(self.meta['nlist']):
+            ids, vectors = self._load_list(list_id)
+            keep = (ids >> ROW_BITS) != source_idx
+            if keep.all():
+                continue
+            for suffix, data in (('ids', ids[keep]), ('vec', np.asarray(vectors[keep]))):
+                tmp_path = self._list_path(list_id, suffix + '.tmp')
+                data.tofile(tmp_path)
+                os.replace(tmp_path, self._list_path(list_id, suffix))
+            self.meta['list_sizes'][list_id] = int(keep.sum())
+            self._lists.pop(list_id, None)
+            self._save_meta()
+        self.meta['sources'][source_idx]['indexed'] = 0
+        self._save_meta()
+
+    def _index_rows(self, source_idx, store, batch_size):
+        source = self.meta['sources'][source_idx]
+        embeddings = store.column('embedding')
+        for batch_start in tqdm(range(source['indexed'], len(store), batch_size), desc="收录人脸"):
+            rows = np.arange(batch_start, min(batch_start + batch_size, len(store)), dtype=np.int64)
+            if not self.trained:
+                self.train(embeddings[rows])
+            self.add((source_idx << ROW_BITS) | rows, embeddings[rows])
+            # 列表条数与已收录记录数一起提交
+            source['indexed'] = int(rows[-1] + 1)
+            self._save_meta()
+
+    def add_folder(self, folder, batch_size=100000):
+        """增量收录一个文件夹的人脸数据存储中尚未收录的记录（存储只追加，因此只需收录新增的记录）。"""
+        source_idx = self._source_index(folder)
+        source = self.meta['sources'][source_idx]
+        store = open_face_store(folder)
+        if source['indexed'] > 0 and (source.get('store_id') != store.identity or source['indexed'] > len(store)):
+            tqdm.write(f"人脸数据存储已重建，重新收录: {folder}")
+            self._remove_source(source_idx)
+        source['store_id'] = store.identity
+        self._stores[source_idx] = store
+        self._valid.pop(source_idx, None)
+        start = source['indexed']
+        if start >= len(store):
+            self._save_meta()
+            tqdm.write(f"没有新增人脸: {folder}")
+            return 0
+        self._index_rows(source_idx, store, batch_size)
+        tqdm.write(f"已收录 {len(store) - start} 条人脸: {folder}, 索引总量 {len(self)}")
+        if len(self) > self.retrain_factor * max(self.meta['trained_count'], 1):
+            self.retrain(batch_size)
+        return len(store) - start
+
+    def retrain(self, batch_size=100000, sample_size=100000, seed=0):
+        """用全部已收录文件夹的抽样特征重新训练单元划分，并重新收录全部文件夹。"""
+        rng = np.random.default_rng(seed)
+        total = len(self)
+        samples = []
+        for source_idx, source in enumerate(self.meta['sources']):
+            if source['indexed'] == 0 or not self._source_valid(source_idx):
+                continue
+            count = max(1, int(sample_size * source['indexed'] / total))
+            rows = np.sort(rng.choice(source['indexed'], min(count, source['indexed']), replace=False))
+            samples.append(np.asarray(self._store(source_idx).column('embedding')[rows], dtype=np.float32))
+        if not samples:
+            return
+        nlist = int(np.clip(4 * np.sqrt(total), 16, 4096))
+        self.train(np.concatenate(samples), nlist=nlist, sample_size=sample_size, seed=seed)
+        self.meta['trained_count'] = int(total)
+        self._save_meta()
+        for source_idx in range(len(self.meta['sources'])):
+            if self._source_valid(source_idx):
+                self._index_rows(source_idx, self._store(source_idx), batch_size)
+        tqdm.write(f"索引已重新训练: {self.meta['nlist']} 个单元, 索引总量 {len(self)}")
+
+    def _load_list(self, list_id):
+        if list_id not in self._lists:
+            count = self.meta['list_sizes'][list_id]
+            if count == 0:
+                self._lists[list_id] = (np.zeros(0, dtype=np.int64), np.zeros((0, self.meta['dim']), dtype=np.float16))
+            else:
+                # 只读取已提交的条目
+                ids = np.fromfile(self._list_path(list_id, 'ids'), dtype=np.int64, count=count)
+                vectors = np.memmap(self._list_path(list_id, 'vec'), dtype=np.float16, mode='r', shape=(count, self.meta['dim']))
+                self._lists[list_id] = (ids, vectors)
+        return self._lists[list_id]
+
+    def _source_valid(self, source_idx):
+        """文件夹的人脸数据存储仍是收录时的那一个，记录号有效。"""
+        if source_idx not in self._valid:
+            source = self.meta['sources'][source_idx]
+            store_dir = os.path.join(source['folder'], 'face_store')
+            valid = FaceStore.exists(store_dir) and source.get('store_id') == self._store(source_idx).identity \
+                and source['indexed'] <= len(self._store(source_idx))
+            if not valid:
+                tqdm.write(f"人脸数据存储已重建或不存在，查询时跳过，请重新收录: {source['folder']}")
+            self._valid[source_idx] = valid
+        return self._valid[source_idx]
+
+    def _store(self, source_idx):
+        if source_idx not in self._stores:
+            self._stores[source_idx] = FaceStore(os.path.join(self.meta['sources'][source_idx]['folder'], 'face_store'))
+        return self._stores[source_idx]
+
+    def _mapping(self, source_idx):
+        """读取文件夹的 face_mapping.txt，返回 {人脸名: 原图路径}。"""
+        if source_idx not in self._mappings:
+            mapping = {}
+            mapping_path = os.path.join(self.meta['sources'][source_idx]['folder'], 'face_mapping.txt')
+            try:
+                with open(mapping_path, 'r') as file:
+                    for line in file:
+                        original, _, face_filename = line.rstrip('\n').rpartition('*')
+                        mapping[Path(face_filename).stem] = original
+            except FileNotFoundError:
+                tqdm.write(f"映射文件不存在: {mapping_path}")
+            self._mappings[source_idx] = mapping
+        return self._mappings[source_idx]
+
+    def search(self, embedding, k=10, radius=None, nprobe=8):
+        """
+        返回与查询特征最相近的至多 k 个编码后的记录号及其余弦相似度。
+        radius 为余弦距离（1 - 余弦相似度）上限，None 表示不限制。已删除或被标记为重复的人脸会被过滤掉。
+        """
+        if not self.trained:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        q = normalize_embeddings(np.asarray(embedding).reshape(1, -1))[0]
+        probes = np.argsort(-(self.centroids @ q))[:nprobe]
+        ids_list, sims_list = [], []
+        for list_id in probes:
+            ids, vectors = self._load_list(int(list_id))
+            if len(ids) == 0:
+                continue
+            ids_list.append(ids)
+            sims_list.append(np.asarray(vectors, dtype=np.float32) @ q)
+        if not ids_list:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids, sims = np.concatenate(ids_list), np.concatenate(sims_list)
+        if radius is not None:
+            keep = sims >= 1 - radius
+            ids, sims = ids[keep], sims[keep]
+        # 过滤已删除和被标记为重复的人脸，只读取候选记录的标记；存储已重建的文件夹整体跳过
+        sources = ids >> ROW_BITS
+        live = np.zeros(len(ids), dtype=bool)
+        for source_idx in np.unique(sources):
+            if not self._source_valid(int(source_idx)):
+                continue
+            in_source = np.flatnonzero(sources == source_idx)
+            flags = self._store(int(source_idx)).column('flags')
+            live[in_source] = (flags[ids[in_source] & ROW_MASK] & (FLAG_DELETED | FLAG_DUPLICATE)) == 0
+        ids, sims = ids[live], sims[live]
+        if len(ids) > k:
+            top = np.argpartition(-sims, k)[:k]
+            ids, sims = ids[top], sims[top]
+        order = np.argsort(-sims)
+        return ids[order], sims[order]
+
+    def query(self, embedding, k=10, radius=None, nprobe=8):
+        """
+        查询与给定人脸特征最相近的人脸。
+        返回: list of dict, 每项包含人脸名、原图路径、所在文件夹和余弦相似度，按相似度降序排列。
+        """
+        ids, sims = self.search(embedding, k, radius, nprobe)
+        results = []
+        for encoded, similarity in zip(ids, sims):
+            source_idx, row = int(encoded >> ROW_BITS), int(encoded & ROW_MASK)
+            name = self._store(source_idx).names[row]
+            results.append({
+                'name': name,
+                'original_path': self._mapping(source_idx).get(name),
+                'folder': self.meta['sources'][source_idx]['folder'],
+                'similarity': float(similarity),
+            })
+        return results
+
+if __name__ == "__main__":
+    # 用法:
+    #   python face_index.py add <索引目录> <文件夹>...          增量收录文件夹中的人脸
+    #   python face_index.py query <索引目录> <文件夹> <人脸名> [k]  查询与某张已有人脸最相近的人脸
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'add' and len(sys.argv) > 3:
+        index = FaceIndex(sys.argv[2])
+        for folder in sys.argv[3:]:
+            if not os.path.isdir(folder):
+                print(f"请输入有效的目录路径: {folder}")
+                continue
+            index.add_folder(folder)
+    elif command == 'query' and len(sys.argv) > 4:
+        index = FaceIndex(sys.argv[2])
+        store = FaceStore(os.path.join(sys.argv[3], 'face_store'))
+        row = store.name_index.get(sys.argv[4])
+        if row is None:
+            print(f"人脸不存在: {sys.argv[4]}")
+            exit(1)
+        start = time.perf_counter()
+        results = index.query(store.column('embedding')[row], int(sys.argv[5]) if len(sys.argv) > 5 else 10)
+        print(f"查询耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+        for result in results:
+            print(f"{result['similarity']:.3f}  {result['name']}  {result['original_path']}")
+    else:
+        print("用法: python face_index.py add <索引目录> <文件夹>... | query <索引目录> <文件夹> <人脸名> [k]")
+        exit(1)
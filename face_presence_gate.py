@@ -0,0 +1,157 @@
+import os
+import time
+import random
+import cv2
+from tqdm import tqdm
+
+class FaceGate:
+    """
+    人脸预检门基类。
+    预检门在 insightface 之前运行，用很低的代价判断图片中是否可能存在人脸，
+    返回 False 的图片会被直接跳过。因此预检门应当以高召回率为目标：宁可放过没有人脸的图片，也不要漏掉有人脸的图片。
+    """
+    name = 'none'
+
+    def has_face(self, img):
+        """判断图像中是否可能存在人脸，img 为 cv2 读取的 BGR 或灰度图像。"""
+        return True
+
+def _to_small_gray(img, detect_size):
+    """转换为灰度图并等比缩小到长边不超过 detect_size，返回缩小后的图像。"""
+    if img.ndim == 3:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = img
+    scale = detect_size / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv2.resize(gray, (int(gray.shape[1] * scale), int(gray.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    return gray
+
+class HaarFaceGate(FaceGate):
+    """
+    基于 OpenCV Haar 级联的预检门。
+    在低分辨率灰度图上依次运行正脸和侧脸级联，任意一个命中即认为有人脸。
+    min_neighbors 取较小值以提高召回率。
+    """
+    name = 'haar'
+
+    def __init__(self, cascade_names=('haarcascade_frontalface_alt2.xml', 'haarcascade_profileface.xml'),
+                 detect_size=256, scale_factor=1.1, min_neighbors=2, min_size=12):
+        self.detect_size = detect_size
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.cascades = []
+        for cascade_name in cascade_names:
+            cascade_path = cascade_name if os.path.isfile(cascade_name) else os.path.join(cv2.data.haarcascades, cascade_name)
+            cascade = cv2.CascadeClassifier(cascade_path)
+            if cascade.empty():
+                tqdm.write(f"加载Haar级联文件失败: {cascade_path}")
+                continue
+            # 侧脸级联只能检测一个朝向，需要额外检测一次水平翻转后的图像
+            self.cascades.append((cascade, 'profile' in cascade_name))
+        if len(self.cascades) == 0:
+            raise ValueError("没有可用的Haar级联文件")
+
+    def has_face(self, img):
+        gray = cv2.equalizeHist(_to_small_gray(img, self.detect_size))
+        flipped = None
+        for cascade, is_profile in self.cascades:
+            candidates = [gray]
+            if is_profile:
+                if flipped is None:
+                    flipped = cv2.flip(gray, 1)
+                candidates.append(flipped)
+            for candidate in candidates:
+                faces = cascade.detectMultiScale(candidate, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors,
+                                                 minSize=(self.min_size, self.min_size))
+                if len(faces) > 0:
+                    return True
+        return False
+
+class YuNetFaceGate(FaceGate):
+    """
+    基于 OpenCV YuNet 小模型（cv2.FaceDetectorYN）的预检门，需要 OpenCV >= 4.5.4。
+    模型文件: https://github.com/opencv/opencv_zoo/tree/main/models/face_detection_yunet
+    """
+    name = 'yunet'
+
+    def __init__(self, model_path='face_detection_yunet_2023mar.onnx', detect_size=160, score_threshold=0.3):
+        if not os.path.isfile(model_path):
+            raise ValueError(f"YuNet模型文件不存在: {model_path}")
+        self.detect_size = detect_size
+        self.detector = cv2.FaceDetectorYN.create(model_path, "", (detect_size, detect_size), score_threshold)
+
+    def has_face(self, img):
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        scale = self.detect_size / max(img.shape[:2])
+        if scale < 1:
+            img = cv2.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+        self.detector.setInputSize((img.shape[1], img.shape[0]))
+        _, faces = self.detector.detect(img)
+        return faces is not None and len(faces) > 0
+
+def create_face_gate(name, **kwargs):
+    """根据名字创建预检门，name 为 None 或 'none' 时返回 None，表示不使用预检门。"""
+    if name is None or name == 'none':
+        return None
+    if name == 'haar':
+        return HaarFaceGate(**kwargs)
+    if name == 'yunet':
+        return YuNetFaceGate(**kwargs)
+    raise ValueError(f"未知的人脸预检门: {name}")
+
+def evaluate_face_gate(face_gate, app, thumbnail_paths, sample_size=200, seed=0):
+    """
+    在随机抽样的缩略图上，以完整检测器（insightface）的结果为基准评估预检门。
+    参数:
+        face_gate: FaceGate, 待评估的预检门。
+        app: FaceAnalysis, 已经 prepare 过的完整检测器。
+        thumbnail_paths: list, 缩略图路径列表。
+        sample_size: int, 抽样数量。
+    返回:
+        dict, 包含跳过率、召回率以及两种检测器的平均耗时。
+    """
+    if face_gate is None or len(thumbnail_paths) == 0:
+        return None
+    samples = random.Random(seed).sample(list(thumbnail_paths), min(sample_size, len(thumbnail_paths)))
+    evaluated = 0
+    skipped = 0
+    with_face = 0
+    with_face_passed = 0
+    gate_time = 0.0
+    detector_time = 0.0
+    for thumb_path in tqdm(samples, desc=f"评估预检门[{face_gate.name}]"):
+        img = cv2.imread(str(thumb_path))
+        if img is None:
+            continue
+        evaluated += 1
+        start = time.perf_counter()
+        passed = face_gate.has_face(img)
+        gate_time += time.perf_counter() - start
+        start = time.perf_counter()
+        faces = app.get(img)
+        detector_time += time.perf_counter() - start
+        if not passed:
+            skipped += 1
+        if len(faces) > 0:
+            with_face += 1
+            if passed:
+                with_face_passed += 1
+    if evaluated == 0:
+        tqdm.write("没有可用于评估预检门的图片")
+        return None
+    report = {
+        'gate': face_gate.name,
+        'samples': evaluated,
+        'skip_rate': skipped / evaluated,
+        'recall': with_face_passed / with_face if with_face > 0 else 1.0,
+        'images_with_face': with_face,
+        'gate_ms': gate_time / evaluated * 1000,
+        'detector_ms': detector_time / evaluated * 1000,
+    }
+    tqdm.write(f"预检门[{report['gate']}] 抽样 {evaluated} 张, 跳过率: {report['skip_rate']:.2%}, "
+               f"召回率: {report['recall']:.2%} ({with_face_passed}/{with_face}), "
+               f"平均耗时: 预检 {report['gate_ms']:.1f}ms / 完整检测 {report['detector_ms']:.1f}ms")
+    return report
@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import uuid
+import shutil
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+from custom_face_data import CustomFace, serialize_face, deserialize_face
+
+# 列定义：列名 -> (数据类型, 每行形状)。embedding 的数据类型由 meta.json 决定（float32 或 float16）。
+COLUMNS = {
+    'embedding': (None, (512,)),
+    'bbox': ('float32', (4,)),
+    'kps': ('float32', (5, 2)),
+    'det_score': ('float32', ()),
+    'landmark_3d_68': ('float32', (68, 3)),
+    'pose': ('float32', (3,)),
+    'landmark_2d_106': ('float32', (106, 2)),
+    'gender': ('int8', ()),
+    'age': ('int16', ()),
+    'flags': ('uint8', ()),
+}
+
+# flags 列的标记位
+FLAG_DELETED = 1  # 记录已被同名的新记录取代，或对应的人脸已被删除
+FLAG_DUPLICATE = 2  # 与另一张质量更好的人脸几乎相同（见 人脸去重.py），聚类和导出默认跳过
+
+class FaceStore:
+    """
+    列式人脸数据存储，替代每张人脸一个 pkl 文件的方式。
+    目录结构:
+        meta.json       记录条数、特征维度、特征数据类型、存储标识
+        names.txt       每行一个人脸名（人脸图片文件名去掉扩展名），行号即记录号
+        <列名>.bin      每列一个定长二进制文件，按记录号顺序排列
+    写入只在文件末尾追加，meta.json 中的条数在所有列写完后才更新，因此写入中途崩溃不会破坏已有数据。
+    读取时各列以只读内存映射方式打开，按条件筛选人脸是对整列的向量化操作。
+    """
+
+    def __init__(self, directory, embedding_dtype='float32'):
+        self.directory = Path(directory)
+        self.meta_path = self.directory / 'meta.json'
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r') as file:
+                self.meta = json.load(file)
+        else:
+            if embedding_dtype not in ('float32', 'float16'):
+                raise ValueError(f"不支持的特征数据类型: {embedding_dtype}")
+            self.meta = {'version': 1, 'count': 0, 'dim': COLUMNS['embedding'][1][0], 'embedding_dtype': embedding_dtype,
+                         'uuid': uuid.uuid4().hex}
+        self._names = None
+        self._name_index = None
+        self._columns = {}
+        self._writers = None
+        self._pending = []
+
+    @classmethod
+    def exists(cls, directory):
+        return (Path(directory) / 'meta.json').exists()
+
+    def __len__(self):
+        return self.meta['count']
+
+    @property
+    def identity(self):
+        """
+        存储标识，创建存储时生成，重建存储后改变。
+        聚类状态、索引等派生数据记录构建时的标识，不一致时说明记录号已失效，需要重建。
+        旧版存储没有标识时补写一个。
+        """
+        if 'uuid' not in self.meta:
+            self.meta['uuid'] = uuid.uuid4().hex
+            if self.meta_path.exists():
+                self._save_meta()
+        return self.meta['uuid']
+
+    def column_spec(self, name):
+        """返回列的数据类型和每行形状。"""
+        dtype, shape = COLUMNS[name]
+        if name == 'embedding':
+            return np.dtype(self.meta['embedding_dtype']), (self.meta['dim'],)
+        return np.dtype(dtype), shape
+
+    def column_path(self, name):
+        return self.directory / f"{name}.bin"
+
+    @property
+    def names(self):
+        """按记录号排列的人脸名列表。"""
+        if self._names is None:
+            self._names = []
+            names_path = self.directory / 'names.txt'
+            if names_path.exists():
+                with open(names_path, 'r') as file:
+                    for line in file:
+                        if len(self._names) >= len(self):
+                            break
+                        self._names.append(line.rstrip('\n'))
+        return self._names
+
+    @property
+    def name_index(self):
+        """人脸名 -> 最新记录号。"""
+        if self._name_index is None:
+            self._name_index = {name: row for row, name in enumerate(self.names)}
+        return self._name_index
+
+    def column(self, name):
+        """以只读内存映射方式返回整列数据，形状为 (条数, *每行形状)。"""
+        if name not in self._columns:
+            dtype, shape = self.column_spec(name)
+            count = len(self)
+            path = self.column_path(name)
+            if count == 0 or not path.exists():
+                self._columns[name] = np.zeros((count,) + shape, dtype=dtype)
+            else:
+                self._columns[name] = np.memmap(path, dtype=dtype, mode='r', shape=(count,) + shape)
+        return self._columns[name]
+
+    def live_mask(self, include_duplicates=False):
+        """未被删除或取代的记录，默认同时排除被标记为重复的记录。"""
+        excluded = FLAG_DELETED if include_duplicates else FLAG_DELETED | FLAG_DUPLICATE
+        return (self.column('flags') & excluded) == 0
+
+    def filter_mask(self, gender=None, min_det_score=None, age_range=None, include_deleted=False, include_duplicates=False):
+        """
+        按属性筛选人脸，返回布尔数组。
+        参数:
+            gender: int, 只保留该性别（0 为女性，1 为男性），None 表示不筛选。
+            min_det_score: float, 检测得分下限。
+            age_range: (int, int), 年龄闭区间。
+        """
+        mask = np.ones(len(self), dtype=bool) if include_deleted else self.live_mask(include_duplicates)
+        if gender is not None:
+            mask &= self.column('gender') == gender
+        if min_det_score is not None:
+            mask &= self.column('det_score') >= min_det_score
+        if age_range is not None:
+            age = self.column('age')
+            mask &= (age >= age_range[0]) & (age <= age_range[1])
+        return mask
+
+    def get_face(self, row):
+        """读取一条记录并还原为 CustomFace 对象。"""
+        return CustomFace({name: np.array(self.column(name)[row]) for name in COLUMNS if name != 'flags'})
+
+    def _row_values(self, face):
+        """将人脸对象转换为各列的一行数据，缺失的属性以 NaN 或 -1 填充。"""
+        values = {}
+        for name in COLUMNS:
+            dtype, shape = self.column_spec(name)
+            value = getattr(face, name, None) if name != 'flags' else 0
+            if value is None:
+                value = np.full(shape, np.nan if dtype.kind == 'f' else -1, dtype=dtype)
+            values[name] = np.asarray(value, dtype=dtype).reshape(shape)
+        return values
+
+    def append(self, name, face):
+        """追加一条人脸记录，调用 flush 后才会写入磁盘。同名的旧记录会在 flush 时标记为已取代。"""
+        self._pending.append((name, self._row_values(face)))
+
+    def _open_writers(self):
+        if self._writers is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        count = len(self)
+        self._writers = {}
+        # 上次写入中途崩溃时，列文件可能比 meta.json 记录的条数长，先截断到一致的长度
+        for name in COLUMNS:
+            dtype, shape = self.column_spec(name)
+            path = self.column_path(name)
+            row_size = dtype.itemsize * int(np.prod(shape))
+            if path.exists() and path.stat().st_size != count * row_size:
+                if path.stat().st_size < count * row_size:
+                    raise ValueError(f"列文件 {path} 长度不足 {count} 条记录")
+                with open(path, 'r+b') as file:
+                    file.truncate(count * row_size)
+            self._writers[name] = open(path, 'ab')
+        names = self.names
+        with open(self.directory / 'names.txt', 'w') as file:
+            file.writelines(f"{name}\n" for name in names)
+        self._writers['names'] = open(self.directory / 'names.txt', 'a')
+
+    def flush(self):
+        """将缓冲的记录追加到各列文件，并更新 meta.json 中的条数。"""
+        if len(self._pending) == 0:
+            return
+        self._open_writers()
+        for name in COLUMNS:
+            rows = np.stack([values[name] for _, values in self._pending])
+            self._writers[name].write(rows.tobytes())
+            self._writers[name].flush()
+        self._writers['names'].writelines(f"{name}\n" for name, _ in self._pending)
+        self._writers['names'].flush()
+        start = len(self)
+        superseded = []
+        for offset, (name, _) in enumerate(self._pending):
+            if name in self.name_index:
+                superseded.append(self.name_index[name])
+            self.names.append(name)
+            self.name_index[name] = start + offset
+        self.meta['count'] = start + len(self._pending)
+        self._pending = []
+        self._save_meta()
+        self._columns = {}
+        if superseded:
+            self.set_flags(superseded, FLAG_DELETED)
+
+    def _save_meta(self):
+        if 'uuid' not in self.meta and self.meta_path.exists():
+            # 打开后其他进程可能已为旧版存储补写了标识，保留该标识
+            with open(self.meta_path, 'r') as file:
+                existing = json.load(file).get('uuid')
+            if existing:
+                self.meta['uuid'] = existing
+        tmp_path = self.meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(self.meta, file, indent=4)
+        os.replace(tmp_path, self.meta_path)
+
+    def set_meta(self, key, value):
+        """写入 meta.json 中的附加字段（例如记录特征来源的 chip_embedded），立即保存。"""
+        self.meta[key] = value
+        self._save_meta()
+
+    def set_flags(self, rows, flag, value=True):
+        """原地设置或清除指定记录的标记位。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        self._columns.pop('flags', None)
+        flags = np.memmap(self.column_path('flags'), dtype=np.uint8, mode='r+', shape=(len(self),))
+        if value:
+            flags[rows] |= flag
+        else:
+            flags[rows] &= np.uint8(~flag & 0xFF)
+        flags.flush()
+        del flags
+
+    def renew_identity(self):
+        """更换存储标识，使按标识记录的派生数据（索引、量化副本、聚类状态）在下次使用时重建。"""
+        self.meta['uuid'] = uuid.uuid4().hex
+        self._save_meta()
+
+    def update_embeddings(self, rows, embeddings, renew_identity=True):
+        """
+        原地覆盖指定记录的特征，例如换用识别模型后从对齐图块重新提取的特征。
+        已有的派生数据按旧特征计算，默认随之更换存储标识；分批更新时可以传入 False，全部写完后再调用 renew_identity。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        dtype, shape = self.column_spec('embedding')
+        self._columns.pop('embedding', None)
+        column = np.memmap(self.column_path('embedding'), dtype=dtype, mode='r+', shape=(len(self),) + shape)
+        column[rows] = np.asarray(embeddings, dtype=dtype)
+        column.flush()
+        del column
+        if renew_identity:
+            self.renew_identity()
+
+    def delete(self, names):
+        """标记指定名字的人脸为已删除。"""
+        rows = [self.name_index[name] for name in names if name in self.name_index]
+        self.set_flags(rows, FLAG_DELETED)
+
+    def close(self):
+        self.flush()
+        if self._writers is not None:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def import_pkl_dir(faces_dir, store_dir, embedding_dtype='float32', batch_size=1000):
+    """
+    将旧版的 pkl 人脸数据目录导入列式存储，每个 pkl 文件只反序列化一次。
+    参数:
+        faces_dir: str, 包含 .pkl 人脸数据文件的目录。
+        store_dir: str, 列式存储目录。
+    返回:
+        int, 导入的记录数。
+    """
+    pkl_files = sorted(f for f in os.listdir(faces_dir) if f.endswith('.pkl') and not f.startswith('.'))
+    imported = 0
+    with FaceStore(store_dir, embedding_dtype) as store:
+        for filename in tqdm(pkl_files, desc="导入人脸数据"):
+            try:
+                face = deserialize_face(os.path.join(faces_dir, filename))
+            except Exception as e:
+                tqdm.write(f"读取人脸数据失败 {filename}: {e}")
+                continue
+            store.append(Path(filename).stem, face)
+            imported += 1
+            if imported % batch_size == 0:
+                store.flush()
+    tqdm.write(f"已导入 {imported} 条人脸数据到 {store_dir}")
+    return imported
+
+def export_pkl_dir(store_dir, faces_dir):
+    """将列式存储中的有效记录导出为旧版的 pkl 文件，便于旧工具读取。"""
+    store = FaceStore(store_dir)
+    rows = np.flatnonzero(store.live_mask())
+    for row in tqdm(rows, desc="导出人脸数据"):
+        serialize_face(store.get_face(row), os.path.join(faces_dir, f"{store.names[row]}.pkl"))
+    return len(rows)
+
+def open_face_store(target_dir, embedding_dtype='float32'):
+    """
+    打开目标目录下的人脸数据存储（<目标目录>/face_store）。
+    存储不存在但 <目标目录>/faces 下有旧版 pkl 文件时，先自动导入。
+    """
+    store_dir = os.path.join(target_dir, 'face_store')
+    faces_dir = os.path.join(target_dir, 'faces')
+    if not FaceStore.exists(store_dir) and os.path.isdir(faces_dir) \
+            and any(f.endswith('.pkl') for f in os.listdir(faces_dir)):
+        tqdm.write(f"未找到人脸数据存储，从旧版 pkl 文件导入: {faces_dir}")
+        import_pkl_dir(faces_dir, store_dir, embedding_dtype)
+    return FaceStore(store_dir, embedding_dtype)
+
+if __name__ == "__main__":
+    # 用法: python face_store.py <目标目录> [--float16] [--rebuild]
+    # 将 <目标目录>/faces 下的 pkl 文件导入 <目标目录>/face_store
+    directory = sys.argv[1] if len(sys.argv) > 1 else ''
+    if not directory:
+        print("请输入目录路径")
+        exit(1)
+    if not os.path.isdir(directory):
+        print("请输入有效的目录路径")
+        exit(1)
+    store_dir = os.path.join(directory, 'face_store')
+    if '--rebuild' in sys.argv and os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    import_pkl_dir(os.path.join(directory, 'faces'), store_dir, 'float16' if '--float16' in sys.argv else 'float32')
@@ -0,0 +1,388 @@
+import os
+import json
+import time
+import fnmatch
+import hashlib
+import queue
+import logging
+import traceback
+import multiprocessing
+from contextlib import contextmanager, nullcontext
+from tqdm import tqdm
+
+STATE_FILE = 'pipeline_state.json'
+
+def _digest(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+class TreeInput:
+    """
+    目标目录中的源文件（递归，忽略隐藏文件和各阶段生成的文件），可按扩展名筛选。
+    图库动辄数十 GB，不读取文件内容，以相对路径、大小和修改时间作为内容签名。
+    """
+
+    def __init__(self, extensions=None):
+        self.extensions = tuple(ext.lower() for ext in extensions) if extensions else None
+
+    def describe(self):
+        return f"源文件({', '.join(self.extensions)})" if self.extensions else "全部源文件"
+
+    def signature(self, context):
+        files = context.source_files()
+        if self.extensions:
+            files = [entry for entry in files if entry[0].lower().endswith(self.extensions)]
+        return _digest(files)
+
+class FileInput:
+    """目标目录中的单个文件，按内容计算签名，文件不存在时签名为 None。"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def describe(self):
+        return self.path
+
+    def signature(self, context):
+        path = os.path.join(context.target_dir, self.path)
+        if not os.path.isfile(path):
+            return None
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+class Stage:
+    """
+    流水线中的一个阶段。
+    参数:
+        name: str, 阶段名。
+        func: 可调用对象 func(target_dir, results)，results 为各上游阶段的返回值（跳过的阶段取上次记录的返回值）。
+        deps: 上游阶段名，上游的输出变化时本阶段重新执行。
+        inputs: TreeInput / FileInput 列表，不属于任何上游阶段输出的输入。
+        outputs: 目标目录下的输出文件或目录名，可以使用通配符；用于判断输出是否缺失或被修改，并从源文件签名中排除。
+        params: dict, 影响输出的参数，变化时重新执行。
+        resource: 'cpu' 或 'io'，多个文件夹并发处理时按此占用 CPU 核心额度或 I/O 并发额度。
+        cores: int, CPU 阶段占用的核心数（不超过总额度），内部多线程的阶段（如模型推理）应占用全部核心。
+        modifies: 本阶段会原地修改其输出的上游阶段名（须在 deps 中）。本阶段完成后重新记录这些上游的输出签名，
+            上游不会因此被视为输出已被修改，下游也不会因此重新执行。
+    """
+
+    def __init__(self, name, func, deps=(), inputs=(), outputs=(), params=None, resource='cpu', cores=1, modifies=()):
+        if resource not in ('cpu', 'io'):
+            raise ValueError(f"阶段 {name} 的资源类型 {resource} 无效，应为 'cpu' 或 'io'")
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.resource = resource
+        self.cores = cores
+        self.modifies = list(modifies)
+        if any(dep not in self.deps for dep in self.modifies):
+            raise ValueError(f"阶段 {name} 修改的上游 {self.modifies} 必须在 deps 中")
+
+class _Context:
+    """一次运行中对目标目录的扫描结果缓存，多个阶段共用一次源文件遍历。"""
+
+    def __init__(self, target_dir, generated):
+        self.target_dir = target_dir
+        self.generated = generated
+        self._source_files = None
+
+    def is_generated(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.generated)
+
+    def source_files(self):
+        if self._source_files is None:
+            files = []
+            for root, dirs, names in os.walk(self.target_dir):
+                top_level = root == self.target_dir
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.') and not (top_level and self.is_generated(d)))
+                for name in names:
+                    if name.startswith('.') or (top_level and self.is_generated(name)):
+                        continue
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((os.path.relpath(os.path.join(root, name), self.target_dir), stat.st_size, stat.st_mtime_ns))
+            self._source_files = sorted(files)
+        return self._source_files
+
+    def output_signature(self, patterns):
+        """输出的签名：匹配的文件取大小和修改时间，目录取第一层内容的大小和修改时间；没有任何匹配时返回 None。"""
+        entries = []
+        for pattern in patterns:
+            for name in sorted(fnmatch.filter(os.listdir(self.target_dir), pattern)):
+                path = os.path.join(self.target_dir, name)
+                if os.path.isdir(path):
+                    with os.scandir(path) as children:
+                        listing = sorted((child.name, child.stat().st_size, child.stat().st_mtime_ns) for child in children)
+                    entries.append((name, _digest(listing)))
+                else:
+                    stat = os.stat(path)
+                    entries.append((name, stat.st_size, stat.st_mtime_ns))
+        return _digest(entries) if entries else None
+
+class Pipeline:
+    """
+    按依赖关系执行的阶段图。
+    每个阶段的指纹由参数、输入签名和各上游阶段最近一次执行后的输出签名组成，与 <目标目录>/pipeline_state.json
+    中记录的指纹相同且输出未被修改时跳过，因此只有变化之后的阶段会重新执行。
+    是否执行在每个阶段开始前才判断，上游重新执行后输出不变时下游仍然跳过。
+    """
+
+    def __init__(self, stages, generated=()):
+        self.stages = stages
+        self.stage_by_name = {stage.name: stage for stage in stages}
+        names = set()
+        for stage in stages:
+            missing = [dep for dep in stage.deps if dep not in names]
+            if missing:
+                raise ValueError(f"阶段 {stage.name} 的上游 {missing} 不存在或排在其后")
+            names.add(stage.name)
+        # 源文件签名排除所有阶段的输出和额外声明的生成文件
+        self.generated = [STATE_FILE] + [pattern for stage in stages for pattern in stage.outputs] + list(generated)
+
+    def load_state(self, target_dir):
+        path = os.path.join(target_dir, STATE_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def save_state(self, target_dir, state):
+        path = os.path.join(target_dir, STATE_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(state, file, indent=4, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def components(self, stage, context, state):
+        """计算阶段指纹的各组成部分。"""
+        return {
+            'params': _digest(stage.params),
+            'inputs': {inp.describe(): inp.signature(context) for inp in stage.inputs},
+            'deps': {dep: state.get(dep, {}).get('outputs') for dep in stage.deps},
+        }
+
+    def decide(self, stage, context, state, force=(), pending=()):
+        """
+        判断阶段是否需要执行，返回 (是否执行, 原因, 指纹组成)。
+        pending 为本次将要执行的上游阶段，用于 explain 模式下上游输出尚未产生时的判断。
+        """
+        parts = self.components(stage, context, state)
+        record = state.get(stage.name)
+        if stage.name in force:
+            return True, "指定强制执行", parts
+        rerun_deps = [dep for dep in stage.deps if dep in pending]
+        if rerun_deps:
+            return True, f"上游 {', '.join(rerun_deps)} 将重新执行", parts
+        if record is None:
+            return True, "没有执行记录", parts
+        old = record.get('components', {})
+        if old.get('params') != parts['params']:
+            return True, f"参数变化: {stage.params}", parts
+        changed = [name for name, value in parts['inputs'].items() if old.get('inputs', {}).get(name) != value]
+        if changed:
+            return True, f"输入变化: {', '.join(changed)}", parts
+        changed = [dep for dep, value in parts['deps'].items() if old.get('deps', {}).get(dep) != value]
+        if changed:
+            return True, f"上游 {', '.join(changed)} 的输出已变化", parts
+        if stage.outputs and context.output_signature(stage.outputs) != record.get('outputs'):
+            return True, "输出缺失或已被修改", parts
+        return False, "已是最新", parts
+
+    def explain(self, target_dir, force=()):
+        """返回每个阶段是否会执行及原因: [(阶段名, 是否执行, 原因)]。"""
+        context = _Context(target_dir, self.generated)
+        state = self.load_state(target_dir)
+        pending = set()
+        plan = []
+        for stage in self.stages:
+            run, reason, _ = self.decide(stage, context, state, force, pending)
+            if run:
+                pending.add(stage.name)
+            plan.append((stage.name, run, reason))
+        return plan
+
+    def run(self, target_dir, force=(), explain=False, slots=None, report=None, label=''):
+        """
+        执行流水线，返回各阶段的返回值。explain 为 True 时只打印每个阶段是否会执行及原因。
+        slots 为 ResourceSlots 时，每个阶段执行前先取得对应的资源额度；report(事件, **字段) 接收进度事件；
+        label 加在输出前，用于并发处理多个文件夹时区分来源。
+        """
+        prefix = f"{label} " if label else ''
+        if explain:
+            for name, run, reason in self.explain(target_dir, force):
+                tqdm.write(f"{prefix}[{'执行' if run else '跳过'}] {name}: {reason}")
+            return None
+        report = report or (lambda event, **fields: None)
+        context = _Context(target_dir, self.generated)
+        state = self.load_state(target_dir)
+        results = {}
+        for stage in self.stages:
+            run, reason, parts = self.decide(stage, context, state, force)
+            if not run:
+                tqdm.write(f"{prefix}[跳过] {stage.name}: {reason}")
+                results[stage.name] = state[stage.name].get('result')
+                report('skipped', stage=stage.name)
+                continue
+            tqdm.write(f"{prefix}[执行] {stage.name}: {reason}")
+            wait_start = time.perf_counter()
+            with slots.hold(stage) if slots is not None else nullcontext():
+                start = time.perf_counter()
+                report('started', stage=stage.name, resource=stage.resource, waited=start - wait_start)
+                result = stage.func(target_dir, results)
+            report('finished', stage=stage.name, resource=stage.resource, seconds=time.perf_counter() - start)
+            results[stage.name] = result
+            try:
+                json.dumps(result)
+            except (TypeError, ValueError):
+                result = None  # 只记录可序列化的返回值
+            state[stage.name] = {
+                'components': parts,
+                'outputs': context.output_signature(stage.outputs) if stage.outputs else _digest(parts),
+                'result': result,
+                'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'duration_s': round(time.perf_counter() - start, 3),
+            }
+            for dep in stage.modifies:
+                # 上游的输出被本阶段原地修改，本阶段的指纹也按修改后的签名记录
+                signature = context.output_signature(self.stage_by_name[dep].outputs)
+                state[dep]['outputs'] = signature
+                parts['deps'][dep] = signature
+            # 每个阶段完成后立即保存，中途失败时已完成的阶段不会重复执行
+            self.save_state(target_dir, state)
+        files = context.source_files()
+        report('scanned', files=len(files), bytes=sum(entry[1] for entry in files))
+        return results
+
+class ResourceSlots:
+    """
+    进程间共享的资源额度。CPU 阶段按 cores 占用 cpu_budget 个核心中的若干个，I/O 阶段各占用 io_slots 个并发额度之一，
+    不同文件夹的 I/O 阶段与 CPU 阶段可以重叠执行。
+    """
+
+    def __init__(self, cpu_budget=None, io_slots=2):
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.io_slots = io_slots
+        self.cpu = multiprocessing.Semaphore(self.cpu_budget)
+        # 一次只允许一个阶段逐个申请核心，避免多个阶段各持有部分核心互相等待
+        self.cpu_lock = multiprocessing.Lock()
+        self.io = multiprocessing.Semaphore(io_slots)
+
+    @contextmanager
+    def hold(self, stage):
+        if stage.resource == 'io':
+            with self.io:
+                yield
+            return
+        units = max(1, min(stage.cores, self.cpu_budget))
+        with self.cpu_lock:
+            for _ in range(units):
+                self.cpu.acquire()
+        try:
+            yield
+        finally:
+            for _ in range(units):
+                self.cpu.release()
+
+_worker_slots = None
+_worker_events = None
+
+def _init_worker(slots, events):
+    global _worker_slots, _worker_events
+    _worker_slots = slots
+    _worker_events = events
+
+def _run_folder(pipeline_factory, folder, force):
+    """在工作进程中处理一个文件夹，返回 (文件夹, 耗时秒数, 错误信息, 源文件数, 源文件字节数)。"""
+    scanned = {'files': 0, 'bytes': 0}
+    def report(event, **fields):
+        if event == 'scanned':
+            scanned.update(fields)
+        else:
+            _worker_events.put((folder, event, fields))
+    start = time.perf_counter()
+    try:
+        pipeline_factory().run(folder, force=force, slots=_worker_slots, report=report, label=f"[{os.path.basename(folder)}]")
+        error = None
+    except Exception as e:
+        logging.error(f"处理文件夹失败 {folder}:\n{traceback.format_exc()}")
+        error = repr(e)
+    return folder, time.perf_counter() - start, error, scanned['files'], scanned['bytes']
+
+class _ProgressMonitor:
+    """汇总工作进程发来的事件，输出每个文件夹的阶段进度和整个图库的吞吐量。"""
+
+    def __init__(self, folders, stage_count):
+        self.stage_count = stage_count
+        self.done_stages = {folder: 0 for folder in folders}
+        self.finished_folders = 0
+        self.files = 0
+        self.bytes = 0
+        self.busy = {'cpu': 0.0, 'io': 0.0}
+        self.start = time.perf_counter()
+        self.progress = tqdm(total=len(folders) * stage_count, desc="流水线阶段")
+
+    def handle(self, folder, event, fields):
+        name = os.path.basename(folder)
+        if event in ('skipped', 'finished') and self.done_stages[folder] < self.stage_count:
+            self.done_stages[folder] += 1
+            self.progress.update(1)
+        if event == 'started' and fields['waited'] >= 1:
+            tqdm.write(f"[{name}] {fields['stage']} 等待{fields['resource']}额度 {fields['waited']:.1f}s")
+        elif event == 'finished':
+            self.busy[fields['resource']] += fields['seconds']
+            tqdm.write(f"[{name}] {self.done_stages[folder]}/{self.stage_count} {fields['stage']} 完成，用时 {fields['seconds']:.1f}s")
+
+    def folder_finished(self, folder, seconds, error, files, size):
+        name = os.path.basename(folder)
+        self.progress.update(self.stage_count - self.done_stages[folder])  # 失败时剩余阶段不再执行
+        self.done_stages[folder] = self.stage_count
+        if error:
+            tqdm.write(f"[{name}] 处理失败 ({seconds:.1f}s): {error}")
+            return
+        self.finished_folders += 1
+        self.files += files
+        self.bytes += size
+        elapsed = time.perf_counter() - self.start
+        tqdm.write(f"[{name}] 处理完成，用时 {seconds:.1f}s；已完成 {self.finished_folders} 个文件夹，{self.files} 个源文件 "
+                   f"{self.bytes / 1024 ** 3:.2f} GB，吞吐 {self.files / elapsed:.1f} 文件/秒 {self.bytes / 1024 ** 3 / elapsed * 3600:.2f} GB/小时")
+
+    def close(self, slots):
+        self.progress.close()
+        elapsed = time.perf_counter() - self.start
+        tqdm.write(f"全部完成，总用时 {elapsed:.1f}s；CPU 阶段累计 {self.busy['cpu']:.1f}s（额度 {slots.cpu_budget} 核），"
+                   f"I/O 阶段累计 {self.busy['io']:.1f}s（并发 {slots.io_slots}）")
+
+def run_folders(pipeline_factory, folders, jobs=2, cpu_budget=None, io_slots=2, force=()):
+    """
+    并发处理多个文件夹，每个文件夹在独立进程中按顺序执行各阶段，各阶段执行前在进程间共享的 ResourceSlots 中取得额度。
+    pipeline_factory 为可在子进程中调用的模块级函数，返回 Pipeline。
+    返回 [(文件夹, 耗时秒数, 错误信息, 源文件数, 源文件字节数)]。
+    """
+    slots = ResourceSlots(cpu_budget, io_slots)
+    events = multiprocessing.Queue()
+    monitor = _ProgressMonitor(folders, len(pipeline_factory().stages))
+    outcomes = []
+
+    def drain():
+        while True:
+            try:
+                monitor.handle(*events.get_nowait())
+            except queue.Empty:
+                return
+
+    with multiprocessing.Pool(min(jobs, len(folders)) or 1, initializer=_init_worker, initargs=(slots, events)) as pool:
+        pending = [pool.apply_async(_run_folder, (pipeline_factory, folder, list(force))) for folder in folders]
+        while pending:
+            drain()
+            for result in [result for result in pending if result.ready()]:
+                pending.remove(result)
+                outcome = result.get()
+                monitor.folder_finished(*outcome)
+                outcomes.append(outcome)
+            time.sleep(0.2)
+    drain()
+    monitor.close(slots)
+    return outcomes
@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import math
+from PIL import Image
+from tqdm import tqdm
+
+ATLAS_DIR = 'preview_atlas'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def scan_thumbnails(thumbnail_dir):
+    """缩略图文件名 -> (修改时间 ns, 文件大小)，只做一次目录遍历。"""
+    signatures = {}
+    for entry in os.scandir(thumbnail_dir):
+        if entry.is_file() and not entry.name.startswith('.') and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            stat = entry.stat()
+            signatures[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return signatures
+
+class PreviewAtlas:
+    """
+    缩略图预览图集：把 thumbnail 目录中每张缩略图缩放到 tile_size 以内，按 columns 列排进若干张大 JPEG 页面，
+    查看工具一次顺序读取整页后在内存中切出预览，不必为每张图片单独读取一个小文件。
+    目录结构 (<目录>/preview_atlas):
+        meta.json       图块大小、每页行列数、下一个页面编号、页面中的图块总数、构建时 thumbnail 目录的修改时间
+        index.txt       每行 文件名*页面*x*y*宽*高*修改时间ns*文件大小
+        page_<n>.jpg    页面图片
+    页面写入后不再修改，增量构建只为新增或变化的缩略图追加新页面，失效图块过多时整体重建。
+    缩略图在图集构建之后被重新生成（文件名重新编号）时，图集中的预览与文件名不再对应，用 is_current 判断。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.atlas_dir = os.path.join(directory, ATLAS_DIR)
+        self.thumbnail_dir = os.path.join(directory, 'thumbnail')
+        self.meta = None
+        self.entries = {}  # 文件名 -> (页面, x, y, 宽, 高, 修改时间ns, 文件大小)
+        self._page_tiles = None
+        meta_path = os.path.join(self.atlas_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as file:
+                self.meta = json.load(file)
+            self._load_index()
+
+    @classmethod
+    def exists(cls, directory):
+        return os.path.exists(os.path.join(directory, ATLAS_DIR, 'meta.json'))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_current(self):
+        """thumbnail 目录自构建图集以来没有增删或重命名文件（目录修改时间与构建时记录的一致）。"""
+        try:
+            return self.meta is not None and self.meta.get('thumbnail_mtime_ns') == os.stat(self.thumbnail_dir).st_mtime_ns
+        except OSError:
+            return False
+
+    def _load_index(self):
+        index_path = os.path.join(self.atlas_dir, 'index.txt')
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, 'r') as file:
+            for line in file:
+                parts = line.rstrip('\n').split('*')
+                if len(parts) == 8:
+                    self.entries[parts[0]] = tuple(int(v) for v in parts[1:])
+
+    def page_path(self, page):
+        return os.path.join(self.atlas_dir, f"page_{page}.jpg")
+
+    def locate(self, filename):
+        """缩略图所在的页面编号，不在图集中时返回 None。"""
+        entry = self.entries.get(filename)
+        return None if entry is None else entry[0]
+
+    def page_tiles(self, page):
+        """某一页面包含的全部预览: [(缩略图路径, (x, y, 宽, 高))]。"""
+        if self._page_tiles is None:
+            self._page_tiles = {}
+            for name, (entry_page, x, y, width, height, _, _) in self.entries.items():
+                self._page_tiles.setdefault(entry_page, []).append((os.path.join(self.thumbnail_dir, name), (x, y, width, height)))
+        return self._page_tiles.get(page, [])
+
+    def pages(self):
+        return sorted({entry[0] for entry in self.entries.values()})
+
+def write_pages(atlas, names, signatures, first_page, tile_size, columns, rows, quality):
+    """把 names 中的缩略图依次排进从 first_page 开始编号的新页面，返回新的索引项和页面数。"""
+    per_page = columns * rows
+    entries = {}
+    page_count = 0
+    for page_start in tqdm(range(0, len(names), per_page), desc="写入预览图集页面"):
+        page_names = names[page_start:page_start + per_page]
+        page = first_page + page_count
+        page_image = Image.new('RGB', (columns * tile_size, math.ceil(len(page_names) / columns) * tile_size))
+        for slot, name in enumerate(page_names):
+            try:
+                with Image.open(os.path.join(atlas.thumbnail_dir, name)) as img:
+                    img.draft('RGB', (tile_size, tile_size))  # JPEG 解码时直接降采样
+                    preview = img.convert('RGB')
+                    preview.thumbnail((tile_size, tile_size))
+            except Exception as e:
+                tqdm.write(f"读取缩略图失败 {name}: {e}")
+                continue
+            x, y = (slot % columns) * tile_size, (slot // columns) * tile_size
+            page_image.paste(preview, (x, y))
+            entries[name] = (page, x, y, preview.width, preview.height) + signatures[name]
+        tmp_path = atlas.page_path(page) + '.tmp'
+        page_image.save(tmp_path, format='JPEG', quality=quality)
+        os.replace(tmp_path, atlas.page_path(page))
+        page_count += 1
+    return entries, page_count
+
+def build_atlas(directory, tile_size=128, columns=16, rows=16, quality=90, rebuild=False, compact_ratio=0.3):
+    """
+    为目录的 thumbnail 子目录构建或增量更新预览图集。
+    已在图集中且修改时间、大小均未变化的缩略图保持不动，新增和变化的缩略图写入新页面，已删除的缩略图只从索引中移除；
+    失效图块占比超过 compact_ratio、页面碎片过多或图块参数变化时整体重建。
+    返回: PreviewAtlas
+    """
+    atlas = PreviewAtlas(directory)
+    if not os.path.isdir(atlas.thumbnail_dir):
+        tqdm.write(f"缩略图目录不存在: {atlas.thumbnail_dir}")
+        return atlas
+    os.makedirs(atlas.atlas_dir, exist_ok=True)
+    # 先记录目录修改时间再遍历，遍历期间目录的变化会让图集被判为过期而不是被遗漏
+    thumbnail_mtime_ns = os.stat(atlas.thumbnail_dir).st_mtime_ns
+    signatures = scan_thumbnails(atlas.thumbnail_dir)
+    layout = {'tile_size': tile_size, 'columns': columns, 'rows': rows}
+    meta = atlas.meta
+    if meta is None or any(meta.get(key) != value for key, value in layout.items()):
+        rebuild = True
+        meta = dict(layout, version=1, next_page=0, tiles=0)
+
+    kept = {} if rebuild else {name: entry for name, entry in atlas.entries.items() if signatures.get(name) == entry[5:]}
+    added = sorted(name for name in signatures if name not in kept)
+    if not rebuild and len(added) == 0 and len(kept) == len(atlas.entries) and meta.get('thumbnail_mtime_ns') == thumbnail_mtime_ns:
+        tqdm.write(f"预览图集已是最新: {len(kept)} 张预览, {len(atlas.pages())} 页")
+        return atlas
+
+    per_page = columns * rows
+    stale = meta['tiles'] - len(kept)
+    live_pages = len({entry[0] for entry in kept.values()}) + math.ceil(len(added) / per_page)
+    if not rebuild and (stale > compact_ratio * max(meta['tiles'], 1) or live_pages > 2 * math.ceil(len(signatures) / per_page) + 1):
+        tqdm.write(f"预览图集失效图块 {stale}/{meta['tiles']}，整体重建")
+        kept = {}
+        added = sorted(signatures)
+    if len(kept) == 0:
+        meta['tiles'] = 0
+
+    new_entries, page_count = write_pages(atlas, added, signatures, meta['next_page'], tile_size, columns, rows, quality)
+    kept.update(new_entries)
+    meta['next_page'] += page_count
+    meta['tiles'] += len(new_entries)
+    meta['thumbnail_mtime_ns'] = thumbnail_mtime_ns
+
+    # 先写入新页面，再原子替换索引，最后删除不再被引用的页面，中途中断不会留下指向缺失页面的索引
+    index_path = os.path.join(atlas.atlas_dir, 'index.txt')
+    with open(index_path + '.tmp', 'w') as file:
+        file.writelines(f"{name}*{'*'.join(str(v) for v in entry)}\n" for name, entry in kept.items())
+    os.replace(index_path + '.tmp', index_path)
+    meta_path = os.path.join(atlas.atlas_dir, 'meta.json')
+    with open(meta_path + '.tmp', 'w') as file:
+        json.dump(meta, file, indent=4)
+    os.replace(meta_path + '.tmp', meta_path)
+
+    atlas = PreviewAtlas(directory)
+    referenced = {os.path.basename(atlas.page_path(page)) for page in atlas.pages()}
+    for file_name in os.listdir(atlas.atlas_dir):
+        if file_name.startswith('page_') and file_name not in referenced:
+            os.remove(os.path.join(atlas.atlas_dir, file_name))
+    tqdm.write(f"预览图集: 新写入 {len(new_entries)} 张预览, 共 {len(atlas)} 张, {len(referenced)} 页")
+    return atlas
+
+if __name__ == "__main__":
+    # 用法: python preview_atlas.py <目录> [--rebuild]
+    directory = sys.argv[1] if len(sys.argv) > 1 else ''
+    if not directory:
+        print("请输入目录路径")
+        exit(1)
+    if not os.path.isdir(directory):
+        print("请输入有效的目录路径")
+        exit(1)
+    build_atlas(directory, rebuild='--rebuild' in sys.argv)
@@ -1,37 +1,109 @@
 import os
+import argparse
 from tools.统计文件扩展名 import main as 统计文件扩展名
 from tools.生成均匀缩放缩略图 import resize as 生成均匀缩放缩略图
 from tools.图像格式转换 import main as 图像格式转换
 from 图片去重 import main as 图片去重
 from face_cropping_2 import main as 人脸剪切
+from 人脸去重 import main as 人脸去重
 from 人脸聚类_dlib_chinese_whispers import main as 人脸聚类
 from tools.copy_video_files import copy_files_with_extensions
+from preview_atlas import build_atlas as 生成预览图集
+from pipeline import Stage, Pipeline, TreeInput, run_folders
 target_dir = '/Volumes/Data512/pic/杨幂_3597[21_GB]'
 # target_dir = '/Volumes/Data512/pic/张靓颖 7.4G_1419[7_GB]'
+LIBRARY_DIR = '/Volumes/Data512/pic/'
 
-def process(target_dir):
+video_format = ['.mp4', '.mov', '.ova', '.wmv', '.3gp', '.flv', '.avi', '.rmvb', '.mkv']
+support_format = ['.arw', '.cr2', '.orf', '.tif', '.tiff']
+image_format = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
+cluster_distance = 0.4
+# 人脸检测和特征提取的推理内部使用全部核心
+inference_cores = os.cpu_count() or 1
+
+def convert_images(directory, results):
+    if any(i in results['extensions'] for i in support_format):
+        图像格式转换(directory)
+
+def crop_faces(directory, results):
+    # 裁切未能开始时（例如目录无法准备）main 返回 None，让阶段失败，不把它记为已完成
+    face_count = 人脸剪切(directory + '/descriptor_final.txt')
+    if face_count is None:
+        raise RuntimeError(f"人脸裁切未完成: {directory}")
+    return face_count
+
+def dedup_faces(directory, results):
+    # 重复标记写在 face_store 的标记列中，只把重复人脸数记入流水线状态
+    return len(人脸去重(directory))
+
+def cluster_faces(directory, results):
+    if results.get('crop') is None:
+        raise RuntimeError(f"没有人脸裁切结果，无法聚类: {directory}")
+    # 只把簇数记入流水线状态，完整的标签已导出到 clutered/ 和 face_classify_*.txt
+    return len(set(人脸聚类(directory, results['crop'], cluster_distance)))
+
+def build_pipeline():
+    """
+    处理一个图库文件夹的各个阶段。
+    缩略图等后续阶段依赖上游的输出，上游输出不变时跳过；源文件只对读取它们的阶段计入签名。
+    扫描、复制视频和读取原图生成缩略图以磁盘读写为主，标记为 I/O 阶段；格式转换、哈希去重、推理和聚类标记为 CPU 阶段。
+    生成缩略图时排除流水线自己生成的文件和目录（格式转换得到的图片除外），与签名中的源文件保持一致。
+    """
+    pipeline = Pipeline([
+        Stage('extensions', lambda d, r: 统计文件扩展名(d), inputs=[TreeInput()], outputs=['extension_summary.txt'],
+              resource='io'),
+        Stage('videos', lambda d, r: copy_files_with_extensions(d, 'videos', video_format),
+              inputs=[TreeInput(video_format)], outputs=['videos'], params={'extensions': video_format},
+              resource='io'),
+        # 是否有需要转换的格式取自 extensions 的返回值，源文件变化已由本阶段的输入覆盖
+        Stage('convert', convert_images, inputs=[TreeInput(support_format)], outputs=['converted_images'],
+              params={'formats': support_format}),
+        # converted_images 是格式转换的输出，也是缩略图的源图片，不能排除
+        Stage('thumbnails', lambda d, r: 生成均匀缩放缩略图(d, exclude=[p for p in pipeline.generated if p != 'converted_images']),
+              deps=['convert'], inputs=[TreeInput(image_format)], outputs=['thumbnail', 'mapping.txt'], resource='io'),
+        Stage('atlas', lambda d, r: 生成预览图集(d), deps=['thumbnails'], outputs=['preview_atlas']),
+        Stage('dedup', lambda d, r: 图片去重(d), deps=['thumbnails'], outputs=['descriptor_*.txt', 'descriptor_*.imgdesc']),
+        Stage('crop', crop_faces, deps=['dedup'],
+              outputs=['faces', 'face_mapping.txt', 'face_checkpoint.txt', 'face_rejected.txt', 'face_store', 'face_chips'],
+              cores=inference_cores),
+        # 人脸级去重在聚类前把重复的人脸标记在 face_store 中，聚类默认跳过它们
+        Stage('face_dedup', dedup_faces, deps=['crop'], outputs=['face_duplicates.txt'], modifies=['crop']),
+        Stage('cluster', cluster_faces, deps=['crop', 'face_dedup'],
+              outputs=['clutered', 'face_classify_dlib_*'], params={'distance': cluster_distance}),
+    ], generated=['face_classify_*', 'cluster_state', 'projection_cache', 'dbscan_sweep_*', 'embedding_*.png'])
+    return pipeline
+
+def process(target_dir, explain=False, force=()):
     if not target_dir:
         print("请输入目录路径")
         exit(1)
     if not os.path.isdir(target_dir):
         print("请输入有效的目录路径")
         exit(1)
+    return build_pipeline().run(target_dir, force=force, explain=explain)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="图库处理流水线，只重新执行输入或参数变化后的阶段")
+    parser.add_argument('folders', nargs='*', help="要处理的文件夹，默认处理图库目录下所有不以 . 或 _ 开头的文件夹")
+    parser.add_argument('--library', default=LIBRARY_DIR, help="图库目录")
+    parser.add_argument('--explain', action='store_true', help="只显示每个阶段是否会执行及原因，不执行")
+    parser.add_argument('--force', action='append', default=[], metavar='STAGE', help="强制执行指定阶段（可重复），其下游随之执行")
+    parser.add_argument('--jobs', type=int, default=2, help="同时处理的文件夹数，为 1 时逐个处理")
+    parser.add_argument('--cpu-budget', type=int, default=None, help="CPU 阶段可占用的核心总数，默认为全部核心")
+    parser.add_argument('--io-slots', type=int, default=2, help="同时执行的 I/O 阶段数")
+    args = parser.parse_args()
 
-    exts = 统计文件扩展名(target_dir)
-    copy_files_with_extensions(target_dir, 'videos', ['.mp4', '.mov', '.ova', '.wmv', '.3gp', '.flv', '.avi', '.rmvb', '.mkv'])
-    support_format = ['.arw', '.cr2', '.orf', '.tif', '.tiff']
-    if any(i in exts for i in support_format):
-        图像格式转换(target_dir)
-    生成均匀缩放缩略图(target_dir)
-    图片去重(target_dir)
-    face_cnt = 人脸剪切(target_dir + '/descriptor_final.txt')
-    # face_cnt=100000
-    人脸聚类(target_dir, face_cnt, 0.4)
-
-for item in os.listdir('/Volumes/Data512/pic/'):
-    if item.startswith('.'): continue
-    if item.startswith('_'): continue
-    path = '/Volumes/Data512/pic/' + item
-    if os.path.isdir(path):
-        print(f'处理文件夹 \'{path}\'')
-        process(path)
\ No newline at end of file
+    folders = args.folders
+    if not folders:
+        folders = [os.path.join(args.library, item) for item in sorted(os.listdir(args.library))
+                   if not item.startswith(('.', '_')) and os.path.isdir(os.path.join(args.library, item))]
+    if args.explain or args.jobs <= 1 or len(folders) <= 1:
+        for path in folders:
+            print(f'处理文件夹 \'{path}\'')
+            process(path, explain=args.explain, force=args.force)
+    else:
+        missing = [path for path in folders if not os.path.isdir(path)]
+        if missing:
+            print(f"请输入有效的目录路径: {missing}")
+            exit(1)
+        run_folders(build_pipeline, folders, jobs=args.jobs, cpu_budget=args.cpu_budget, io_slots=args.io_slots, force=args.force)
@@ -0,0 +1,91 @@
+import numpy as np
+from tqdm import tqdm
+
+def normalize_embeddings(embeddings):
+    """将特征向量归一化为单位长度，归一化后的点积即余弦相似度。"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return embeddings / norms
+
+def tile_size(n, memory_budget_mb):
+    """根据内存预算计算方形分块的边长，单个 float32 相似度分块不超过预算的一半（另一半留给筛选时的临时数组）。"""
+    budget_elements = memory_budget_mb * 1024 ** 2 / 4 / 2
+    return int(max(1, min(n, np.sqrt(budget_elements))))
+
+def iter_similarity_tiles(x, memory_budget_mb, desc=None):
+    """
+    按分块遍历归一化特征两两之间的余弦相似度。
+    每次产出 (行起点, 列起点, 相似度分块)，分块由矩阵乘法计算，大小受内存预算约束。
+    """
+    n = len(x)
+    size = tile_size(n, memory_budget_mb)
+    row_starts = range(0, n, size)
+    for row_start in (tqdm(row_starts, desc=desc) if desc else row_starts):
+        rows = x[row_start:row_start + size]
+        for col_start in range(0, n, size):
+            yield row_start, col_start, rows @ x[col_start:col_start + size].T
+
+def radius_neighbors(embeddings, min_similarity, memory_budget_mb=512, include_self=False):
+    """
+    找出余弦相似度不低于 min_similarity 的全部人脸对，结果为稀疏的邻居列表。
+    参数:
+        embeddings: array, (n, d) 特征，不要求预先归一化，可以是 float16 的内存映射列。
+        min_similarity: float, 相似度阈值（余弦距离阈值 eps 对应 1 - eps）。
+        memory_budget_mb: int, 计算相似度分块使用的内存上限。
+        include_self: bool, 是否包含自身。
+    返回:
+        CSR 形式的 (indptr, indices, similarities)，每行的邻居按列号升序排列。
+    """
+    x = normalize_embeddings(embeddings)
+    n = len(x)
+    rows_list, cols_list, sims_list = [], [], []
+    for row_start, col_start, sims in iter_similarity_tiles(x, memory_budget_mb, desc="计算相似度"):
+        rows, cols = np.nonzero(sims >= min_similarity)
+        if not include_self:
+            keep = rows + row_start != cols + col_start
+            rows, cols = rows[keep], cols[keep]
+        rows_list.append(rows + row_start)
+        cols_list.append(cols + col_start)
+        sims_list.append(sims[rows, cols])
+    if rows_list:
+        rows = np.concatenate(rows_list)
+        indices = np.concatenate(cols_list)
+        similarities = np.concatenate(sims_list).astype(np.float32)
+    else:
+        rows = indices = np.zeros(0, dtype=np.int64)
+        similarities = np.zeros(0, dtype=np.float32)
+    order = np.lexsort((indices, rows))
+    rows, indices, similarities = rows[order], indices[order].astype(np.int64), similarities[order]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, indices, similarities
+
+def topk_neighbors(embeddings, k, memory_budget_mb=512, include_self=False):
+    """
+    求每个人脸余弦相似度最高的 k 个邻居。
+    返回:
+        indices: (n, k) int64 数组，按相似度降序排列，不足 k 个时以 -1 填充。
+        similarities: (n, k) float32 数组，填充位置为 -inf。
+    """
+    x = normalize_embeddings(embeddings)
+    n = len(x)
+    best_indices = np.full((n, k), -1, dtype=np.int64)
+    best_sims = np.full((n, k), -np.inf, dtype=np.float32)
+    for row_start, col_start, sims in iter_similarity_tiles(x, memory_budget_mb, desc="计算近邻"):
+        row_end = row_start + len(sims)
+        if not include_self:
+            overlap = np.arange(max(row_start, col_start), min(row_end, col_start + sims.shape[1]))
+            sims[overlap - row_start, overlap - col_start] = -np.inf
+        cols = np.broadcast_to(np.arange(col_start, col_start + sims.shape[1]), sims.shape)
+        # 把当前分块与已有的 top-k 合并后重新取 top-k
+        merged_sims = np.concatenate([best_sims[row_start:row_end], sims], axis=1)
+        merged_indices = np.concatenate([best_indices[row_start:row_end], cols], axis=1)
+        top = np.argpartition(-merged_sims, min(k, merged_sims.shape[1] - 1), axis=1)[:, :k]
+        best_sims[row_start:row_end] = np.take_along_axis(merged_sims, top, axis=1)
+        best_indices[row_start:row_end] = np.take_along_axis(merged_indices, top, axis=1)
+    order = np.argsort(-best_sims, axis=1)
+    best_sims = np.take_along_axis(best_sims, order, axis=1)
+    best_indices = np.take_along_axis(best_indices, order, axis=1)
+    best_indices[np.isneginf(best_sims)] = -1
+    return best_indices, best_sims
@@ -32,20 +32,17 @@ def copy_files_with_extensions(source_dir, target_subdir, extensions):
     print(f"Copied {cnt} files")
 
 
-target_subdirectory = 'videos'
-allowed_extensions = ['.mp4', '.mov']  # 允许复制的文件扩展名
-copy_files_with_extensions('/Volumes/Data512/pic/_柳岩_2928[14_GB]', target_subdirectory, allowed_extensions)
-
-# if __name__ == "__main__":
-#     # sys.argv 是一个列表，包含了命令行参数
-#     # main 函数调用时传入 sys.argv，这样 main 就可以接收所有命令行参数
-#     directory = sys.argv[1] if len(sys.argv) > 1 else ''
-#     if not directory:
-#         print("请输入目录路径")
-#         exit(1)
-#     if not os.path.isdir(directory):
-#         print("请输入有效的目录路径")
-#         exit(1)
-#     target_subdirectory = 'videos'
-#     allowed_extensions = ['.mp4', '.mov']  # 允许复制的文件扩展名
-#     copy_files_with_extensions(directory, target_subdirectory, allowed_extensions)
+# 只在直接运行时执行，被 run.py 的各个工作进程导入时不会触发复制
+if __name__ == "__main__":
+    # sys.argv 是一个列表，包含了命令行参数
+    # 用法: python copy_video_files.py <目录>
+    directory = sys.argv[1] if len(sys.argv) > 1 else ''
+    if not directory:
+        print("请输入目录路径")
+        exit(1)
+    if not os.path.isdir(directory):
+        print("请输入有效的目录路径")
+        exit(1)
+    target_subdirectory = 'videos'
+    allowed_extensions = ['.mp4', '.mov']  # 允许复制的文件扩展名
+    copy_files_with_extensions(directory, target_subdirectory, allowed_extensions)
@@ -2,6 +2,7 @@
 import sys
 import os
 import shutil
+import fnmatch
 from pathlib import Path
 from PIL import Image, ExifTags
 from tqdm import tqdm
@@ -67,8 +68,11 @@ def rotate_image_according_to_exif(image):
         pass
     return image
 
-def resize(directory, thumbnail_size=512, grayscale=True):
-    """调整目录中所有图像的大小，保持宽高比不变，并转换为灰度（可选），使用基25编码重命名。"""
+def resize(directory, thumbnail_size=512, grayscale=True, exclude=('preview_atlas',)):
+    """
+    调整目录中所有图像的大小，保持宽高比不变，并转换为灰度（可选），使用基25编码重命名。
+    exclude 为目录第一层中不作为源图片的生成文件和目录名（可使用通配符），默认排除预览图集的页面。
+    """
     image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
     successful_files = set()
     failed_counter = 0
@@ -89,8 +93,11 @@ def resize(directory, thumbnail_size=512, grayscale=True):
     total_size = 0
     image_paths = []
     for root, dirs, files in os.walk(directory):
-        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        dirs[:] = [d for d in dirs if not d.startswith('.')
+                   and not (Path(root) == target_dir and any(fnmatch.fnmatch(d, pattern) for pattern in exclude))]
         for name in files:
+            if Path(root) == target_dir and any(fnmatch.fnmatch(name, pattern) for pattern in exclude):
+                continue
             if not name.startswith('.') and any(name.lower().endswith(ext) for ext in image_extensions):
                 path = Path(root) / name
                 image_paths.append(path)
@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import logging
+import numpy as np
+from PIL import Image
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from face_store import open_face_store, FLAG_DUPLICATE
+from face_index import spherical_kmeans
+from similarity_engine import normalize_embeddings
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def bbox_iou(boxes_a, boxes_b):
+    """逐对计算两组边界框 (x1, y1, x2, y2) 的交并比。"""
+    x1 = np.maximum(boxes_a[:, 0], boxes_b[:, 0])
+    y1 = np.maximum(boxes_a[:, 1], boxes_b[:, 1])
+    x2 = np.minimum(boxes_a[:, 2], boxes_b[:, 2])
+    y2 = np.minimum(boxes_a[:, 3], boxes_b[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-6)
+
+def candidate_pairs(x, min_similarity, nlist=None, cells_per_face=2, seed=0, block_size=4096):
+    """
+    用倒排单元找出特征相似度不低于 min_similarity 的人脸对，避免计算全部人脸对。
+    先用球面 k-means 把特征划分为 nlist 个单元，每张人脸放入最近的 cells_per_face 个单元，
+    只在单元内部两两比较；几乎相同的特征必然落入相同的最近单元，因此漏检极少。
+    返回: (i, j, 相似度)，i < j 且不重复。
+    """
+    n = len(x)
+    if nlist is None:
+        nlist = int(np.clip(np.sqrt(n), 1, 4096))
+    nlist = min(nlist, n)
+    rng = np.random.default_rng(seed)
+    sample = x[rng.choice(n, min(n, 100000), replace=False)]
+    centroids = spherical_kmeans(sample, nlist, seed=seed)
+    cells_per_face = min(cells_per_face, nlist)
+    cells = np.empty((n, cells_per_face), dtype=np.int64)
+    for start in range(0, n, 8192):
+        sims = x[start:start + 8192] @ centroids.T
+        cells[start:start + 8192] = np.argpartition(-sims, cells_per_face - 1, axis=1)[:, :cells_per_face]
+    members = np.repeat(np.arange(n), cells_per_face)
+    cell_ids = cells.ravel()
+    order = np.argsort(cell_ids, kind='stable')
+    members, cell_ids = members[order], cell_ids[order]
+    starts = np.flatnonzero(np.r_[True, cell_ids[1:] != cell_ids[:-1]])
+    ends = np.r_[starts[1:], len(cell_ids)]
+    rows_list, cols_list, sims_list = [], [], []
+    for start, end in zip(starts, ends):
+        cell = members[start:end]
+        if len(cell) < 2:
+            continue
+        # 单元大小不均匀时按行分块，避免超大单元的相似度矩阵占用过多内存
+        for block_start in range(0, len(cell), block_size):
+            sims = x[cell[block_start:block_start + block_size]] @ x[cell].T
+            rows, cols = np.nonzero(sims >= min_similarity)
+            upper = cols > rows + block_start
+            rows, cols = rows[upper], cols[upper]
+            rows_list.append(cell[rows + block_start])
+            cols_list.append(cell[cols])
+            sims_list.append(sims[rows, cols])
+    if not rows_list:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    i, j, sims = np.concatenate(rows_list), np.concatenate(cols_list), np.concatenate(sims_list)
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    # 同一对人脸可能在多个单元中出现
+    _, unique = np.unique(i * n + j, return_index=True)
+    return i[unique], j[unique], sims[unique]
+
+def load_face_originals(directory_path):
+    """读取 face_mapping.txt，返回 {人脸名: 原图路径}。"""
+    originals = {}
+    mapping_path = os.path.join(directory_path, 'face_mapping.txt')
+    if not os.path.exists(mapping_path):
+        return originals
+    with open(mapping_path, 'r') as file:
+        for line in file:
+            original, _, face_filename = line.rstrip('\n').rpartition('*')
+            if original:
+                originals[os.path.splitext(face_filename)[0]] = original
+    return originals
+
+def original_scales(names, originals, thumbnail_size=512):
+    """
+    各人脸所在原图相对缩略图的缩放比例（原图长边 / 缩略图尺寸，与 face_cropping_2.calculate_original_coordinates 一致），
+    只读取原图文件头。找不到原图时比例为 NaN。
+    """
+    scales = np.full(len(names), np.nan)
+    sizes = {}
+    for idx, name in enumerate(names):
+        original = originals.get(name)
+        if original is None:
+            continue
+        if original not in sizes:
+            try:
+                with Image.open(original) as image:
+                    sizes[original] = image.size
+            except OSError:
+                sizes[original] = None
+        if sizes[original] is not None:
+            scales[idx] = max(sizes[original]) / thumbnail_size
+    return scales
+
+def save_duplicate_names(directory_path, names):
+    """
+    把被标记为重复的人脸名写入 <目录>/face_duplicates.txt，每行一个。
+    内容不变时不改写文件，流水线据此判断下游的聚类是否需要重新执行。
+    """
+    file_path = os.path.join(directory_path, 'face_duplicates.txt')
+    content = ''.join(f"{name}\n" for name in sorted(names))
+    if os.path.exists(file_path):
+        with open(file_path, 'r') as file:
+            if file.read() == content:
+                return
+    with open(file_path, 'w') as file:
+        file.write(content)
+
+def main(directory_path, min_similarity=0.9, min_iou=0.6, thumbnail_size=512):
+    """
+    人脸级去重：特征几乎相同且边界框位置几乎重合的人脸视为同一张人脸的重复裁切（来自漏过图片去重的近似原图）。
+    每组重复中保留检测得分与原图中人脸分辨率（裁切区域面积）乘积最高的一张，其余在人脸数据存储中标记为 FLAG_DUPLICATE，
+    聚类和导出默认跳过这些人脸。标记不删除任何文件，每次运行都会根据当前数据重新计算，重复人脸名另存于 face_duplicates.txt。
+    参数:
+        min_similarity: float, 特征余弦相似度下限。
+        min_iou: float, 边界框交并比下限。存储中的边界框是缩略图坐标，缩略图都缩放到同一尺寸，
+            因此同一画面不同分辨率的版本边界框位置一致，会被判为重复，再按原图分辨率保留清晰的一张。
+        thumbnail_size: int, 缩略图尺寸，用于把缩略图中的边界框面积换算为原图中的面积。
+    """
+    start_time = time.perf_counter()
+    store = open_face_store(directory_path)
+    rows = np.flatnonzero(store.live_mask(include_duplicates=True))
+    if len(rows) < 2:
+        logging.info("人脸数量不足，无需去重")
+        save_duplicate_names(directory_path, [])
+        return []
+    x = normalize_embeddings(store.column('embedding')[rows])
+    bboxes = np.asarray(store.column('bbox')[rows], dtype=np.float32)
+    i, j, _ = candidate_pairs(x, min_similarity)
+    keep = bbox_iou(bboxes[i], bboxes[j]) >= min_iou
+    i, j = i[keep], j[keep]
+    logging.info(f"人脸 {len(rows)} 个, 重复人脸对 {len(i)} 个")
+
+    # 重复关系的连通分量即一组重复人脸，组内保留质量最高的一张
+    _, components = connected_components(coo_matrix((np.ones(len(i)), (i, j)), shape=(len(rows), len(rows))), directed=False)
+    areas = np.clip(bboxes[:, 2] - bboxes[:, 0], 0, None) * np.clip(bboxes[:, 3] - bboxes[:, 1], 0, None)
+    # 只为有重复的人脸读取原图尺寸，把缩略图中的面积换算为原图中的面积
+    grouped = np.flatnonzero(np.bincount(components)[components] > 1)
+    scales = np.ones(len(rows))
+    if len(grouped):
+        scales[grouped] = original_scales([store.names[row] for row in rows[grouped]], load_face_originals(directory_path), thumbnail_size)
+        missing = np.isnan(scales[grouped])
+        if missing.any():
+            logging.warning(f"{int(missing.sum())} 个重复人脸找不到原图，按缩略图中的面积比较")
+            scales[grouped[missing]] = 1
+    quality = np.nan_to_num(np.asarray(store.column('det_score')[rows], dtype=np.float64)) * areas * scales ** 2
+    order = np.lexsort((-quality, components))
+    best = order[np.r_[True, components[order][1:] != components[order][:-1]]]
+    duplicate = np.ones(len(rows), dtype=bool)
+    duplicate[best] = False
+    duplicate_rows = rows[duplicate]
+
+    # 只改写标记有变化的记录，结果不变时不修改存储文件
+    flagged = (store.column('flags')[rows] & FLAG_DUPLICATE) != 0
+    store.set_flags(rows[flagged & ~duplicate], FLAG_DUPLICATE, False)
+    store.set_flags(rows[~flagged & duplicate], FLAG_DUPLICATE)
+    duplicate_names = [store.names[row] for row in duplicate_rows]
+    save_duplicate_names(directory_path, duplicate_names)
+    logging.info(f"标记重复人脸 {len(duplicate_names)} 个, 耗时 {time.perf_counter() - start_time:.2f}s")
+    return duplicate_names
+
+if __name__ == "__main__":
+    # 用法: python 人脸去重.py <目录>
+    directory = sys.argv[1] if len(sys.argv) > 1 else ''
+    if not directory:
+        print("请输入目录路径")
+        exit(1)
+    if not os.path.isdir(directory):
+        print("请输入有效的目录路径")
+        exit(1)
+    main(directory)
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import logging
+import argparse
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.cluster import DBSCAN
+from similarity_engine import radius_neighbors
+from cluster_io import load_face_data, save_cluster_results
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def build_radius_graph(embeddings, max_eps, memory_budget_mb=512):
+    """
+    在归一化特征上构建余弦距离不超过 max_eps 的稀疏邻域图（包含自身，距离为 0）。
+    该图只需构建一次，所有 eps <= max_eps 的 DBSCAN 都可以直接在图上运行。
+    """
+    start = time.perf_counter()
+    indptr, indices, similarities = radius_neighbors(embeddings, 1 - max_eps, memory_budget_mb, include_self=True)
+    # 余弦距离可能因浮点误差略小于 0，截断为 0；显式存储的 0 在稀疏矩阵中会被保留，表示距离为 0 的邻居
+    distances = np.clip(1 - similarities, 0, None).astype(np.float64)
+    graph = csr_matrix((distances, indices, indptr), shape=(len(embeddings), len(embeddings)))
+    logging.info(f"邻域图构建完成, max_eps: {max_eps}, 边数: {graph.nnz}, 平均邻居数: {graph.nnz / max(len(embeddings), 1):.1f}, "
+                 f"耗时 {time.perf_counter() - start:.2f}s")
+    return graph
+
+def sweep_dbscan(graph, eps_values, min_samples_values, n_jobs=-1):
+    """
+    在预先计算好的稀疏邻域图上，对 eps / min_samples 的所有组合运行 DBSCAN。
+    图中不含距离超过构建半径的边，因此 eps_values 不能超过构建邻域图时的 max_eps。
+    返回:
+        results: list of dict, 每个组合的簇数、噪声比例和耗时。
+        fitted: dict, (eps, min_samples) -> (簇标签, 核心样本序号)，只保留这两个数组，不保留 DBSCAN 对象。
+    """
+    results = []
+    fitted = {}
+    for eps in sorted(eps_values):
+        for min_samples in sorted(min_samples_values):
+            start = time.perf_counter()
+            clt = DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed', n_jobs=n_jobs)
+            clt.fit(graph)
+            elapsed = time.perf_counter() - start
+            labels = clt.labels_
+            result = {
+                'eps': eps,
+                'min_samples': min_samples,
+                'clusters': int(len(set(labels)) - (1 if -1 in labels else 0)),
+                'noise_ratio': float(np.mean(labels == -1)) if len(labels) else 0.0,
+                'core_samples': int(len(clt.core_sample_indices_)),
+                'seconds': elapsed,
+            }
+            results.append(result)
+            fitted[(eps, min_samples)] = (labels, clt.core_sample_indices_)
+            logging.info(f"eps: {eps:<6} min_samples: {min_samples:<5} 簇数: {result['clusters']:<5} "
+                         f"噪声比例: {result['noise_ratio']:.2%} 耗时: {elapsed:.2f}s")
+    return results, fitted
+
+def main(directory_path, eps_values, min_samples_values, limit=1000000, memory_budget_mb=512, save=False):
+    """加载人脸特征，构建一次邻域图，然后对参数网格逐一运行 DBSCAN 并保存汇总结果。"""
+    if not os.path.exists(directory_path):
+        logging.error(f"目录不存在: {directory_path}")
+        return None
+    embeddings, face_files = load_face_data(directory_path, limit)
+    if len(face_files) == 0:
+        logging.error("没有可用的人脸数据")
+        return None
+    graph = build_radius_graph(embeddings, max(eps_values), memory_budget_mb)
+    results, fitted = sweep_dbscan(graph, eps_values, min_samples_values)
+
+    report_path = os.path.join(directory_path, f"dbscan_sweep_{len(face_files)}.json")
+    with open(report_path, 'w', encoding='utf-8') as file:
+        json.dump({'faces': len(face_files), 'graph_edges': int(graph.nnz), 'results': results}, file, indent=4, ensure_ascii=False)
+    logging.info(f"参数扫描结果已保存到: {report_path}")
+
+    if save:
+        for (eps, min_samples), (labels, core_sample_indices) in fitted.items():
+            output_file_path = os.path.join(directory_path, f"face_classify_cos{eps}_{min_samples}_{len(face_files)}.txt")
+            save_cluster_results(labels, core_sample_indices, face_files, output_file_path)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在共享的稀疏邻域图上批量扫描 DBSCAN 参数（余弦距离）")
+    parser.add_argument('directory', help="目标目录（包含 face_store）")
+    parser.add_argument('--eps', type=float, nargs='+', default=[0.3, 0.4, 0.5], help="余弦距离 eps 列表")
+    parser.add_argument('--min-samples', type=int, nargs='+', default=[2, 5, 10, 20], help="min_samples 列表")
+    parser.add_argument('--limit', type=int, default=1000000, help="最多加载的人脸数量")
+    parser.add_argument('--memory-mb', type=int, default=512, help="构建邻域图时相似度分块的内存上限")
+    parser.add_argument('--save', action='store_true', help="保存每个参数组合的聚类结果")
+    args = parser.parse_args()
+    main(args.directory, args.eps, args.min_samples, args.limit, args.memory_mb, args.save)
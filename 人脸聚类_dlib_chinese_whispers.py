@@ -4,10 +4,61 @@
 import sys
 import os
 import dlib
+import numpy as np
 from tqdm import tqdm
-import imageio  # 导入imageio库
+from face_store import FaceStore, open_face_store
+from chinese_whispers import chinese_whispers
+from similarity_engine import radius_neighbors
+from cluster_export import export_clusters, save_cluster_dict
 
-def main(img_folder_path, limit, distance=0.4):
+def cluster_stored_embeddings(img_folder_path, limit, similarity=0.5, memory_budget_mb=512, export_mode='hardlink', include_duplicates=False):
+    """
+    直接使用 face_cropping_2 保存的 insightface 512 维特征聚类，不再重新检测人脸和计算 dlib 特征。
+    以余弦相似度不低于 similarity 的人脸对为边构建图（分块计算，内存占用不超过 memory_budget_mb），在图上运行 chinese whispers。
+    结果同时保存为 face_classify_insightface_<limit>_<similarity>.txt，供图片浏览工具按簇浏览。
+    """
+    faces_folder_path = img_folder_path + '/faces'
+    output_folder_path = img_folder_path + f'/clutered/insightface_{limit}_{similarity}'
+    min_cluster_size = 2  # Minimum number of images in a cluster to be saved
+
+    store = open_face_store(img_folder_path)
+    rows = np.flatnonzero(store.live_mask(include_duplicates))[:limit]
+    embeddings = np.asarray(store.column('embedding')[rows], dtype=np.float32)
+    face_names = [store.names[row] for row in rows]
+    print(f"Loaded {len(face_names)} stored embeddings")
+
+    # Cluster the faces
+    labels = chinese_whispers(*radius_neighbors(embeddings, similarity, memory_budget_mb))
+    num_classes = len(set(labels))
+    print("Number of clusters: {}".format(num_classes))
+
+    # Save faces from each cluster, skipping small clusters
+    print("Saving faces by cluster to output folder...")
+    export_clusters(labels, [os.path.join(faces_folder_path, name + '.jpg') for name in face_names],
+                    output_folder_path, min_cluster_size, export_mode)
+    save_cluster_dict(labels, face_names, embeddings,
+                      os.path.join(img_folder_path, f"face_classify_insightface_{limit}_{similarity}.txt"), min_cluster_size)
+    return labels
+
+def duplicate_face_names(img_folder_path):
+    """人脸数据存储中被标记为重复的人脸名（见 人脸去重.py），存储不存在时为空。"""
+    if not FaceStore.exists(os.path.join(img_folder_path, 'face_store')):
+        return set()
+    store = open_face_store(img_folder_path)
+    rows = np.flatnonzero(store.live_mask(include_duplicates=True) & ~store.live_mask())
+    return {store.names[row] for row in rows}
+
+def main(img_folder_path, limit, distance=0.4, mode='dlib', similarity=0.5, export_mode='hardlink', include_duplicates=False):
+    """
+    对人脸裁切结果聚类。
+    mode 为 'dlib' 时重新检测每张人脸图片并计算 dlib 128 维特征，以欧氏距离 distance 为阈值聚类；
+    mode 为 'embedding' 时直接使用已保存的 insightface 特征，以余弦相似度 similarity 为阈值聚类。
+    聚类结果以 export_mode（'hardlink'、'symlink' 或 'copy'）方式导出已有的人脸图片，不重新编码。
+    被标记为重复的人脸默认跳过，include_duplicates 为 True 时保留。
+    除 clutered/ 下的文件夹外，结果还保存为 face_classify_*.txt，供图片浏览工具按簇浏览。
+    """
+    if mode == 'embedding':
+        return cluster_stored_embeddings(img_folder_path, limit, similarity, export_mode=export_mode, include_duplicates=include_duplicates)
     predictor_path = 'shape_predictor_5_face_landmarks.dat'
     face_rec_model_path = 'dlib_face_recognition_resnet_model_v1.dat'
     faces_folder_path = img_folder_path + '/faces'
@@ -19,16 +70,19 @@ def main(img_folder_path, limit, distance=0.4):
     facerec = dlib.face_recognition_model_v1(face_rec_model_path)
 
     descriptors = []
-    images = []
+    face_paths = []  # 只记录每个特征对应的人脸图片路径，导出时直接链接原文件
     # limit = 100000
     min_cluster_size = 2  # Minimum number of images in a cluster to be saved
     progress = tqdm(desc="load faces", total=limit)
     cnt = 0
+    skipped_names = set() if include_duplicates else duplicate_face_names(img_folder_path)
 
     # Process each face and compute 128D face descriptors
     for filename in os.listdir(faces_folder_path):
         if not filename.endswith(".jpg") or filename.startswith('.'):
             continue
+        if os.path.splitext(filename)[0] in skipped_names:
+            continue
         cnt += 1
         if cnt > limit:
             break
@@ -41,7 +95,7 @@ def main(img_folder_path, limit, distance=0.4):
             shape = sp(img, d)
             face_descriptor = facerec.compute_face_descriptor(img, shape)
             descriptors.append(face_descriptor)
-            images.append((img, shape, f))
+            face_paths.append(f)
 
     progress.close()
     # Cluster the faces
@@ -49,36 +103,20 @@ def main(img_folder_path, limit, distance=0.4):
     num_classes = len(set(labels))
     print("Number of clusters: {}".format(num_classes))
 
-    # Prepare to save faces by cluster
-    output_folder_path += f'/dlib_{limit}_{distance}'
-    cluster_info = {}
-
-    # Gather cluster information
-    for label in set(labels):
-        cluster_size = sum(1 for l in labels if l == label)
-        if cluster_size >= min_cluster_size:
-            cluster_info[label] = cluster_size
-
-    # Sort clusters by size in descending order
-    sorted_clusters = sorted(cluster_info.items(), key=lambda x: x[1], reverse=True)
-
     # Save faces from each cluster, skipping small clusters
     print("Saving faces by cluster to output folder...")
-    for id, (label, size) in enumerate(sorted_clusters):
-        cluster_dir = os.path.join(output_folder_path, f"cluster_{id}({size})")
-        os.makedirs(cluster_dir, exist_ok=True)
-
-        indices = [i for i, lbl in enumerate(labels) if lbl == label]
-        print(f"Cluster ID {label}: {size} faces")
-
-        for count, index in enumerate(indices):
-            img, shape, original_path = images[index]
-            file_path = os.path.join(cluster_dir, os.path.basename(original_path))
-            imageio.imwrite(file_path, img)  # 使用imageio保存原始图像
+    export_clusters(labels, face_paths, output_folder_path + f'/dlib_{limit}_{distance}', min_cluster_size, export_mode)
+    # 一张人脸图片可能检测出多个 dlib 人脸，浏览时按图片名显示，每张图片只保留第一次出现
+    face_names = [os.path.splitext(os.path.basename(f))[0] for f in face_paths]
+    first = sorted({name: i for i, name in reversed(list(enumerate(face_names)))}.values())
+    save_cluster_dict(np.asarray(labels)[first], [face_names[i] for i in first], np.asarray(descriptors)[first],
+                      os.path.join(img_folder_path, f"face_classify_dlib_{limit}_{distance}.txt"), min_cluster_size)
+    return labels
 
 if __name__ == "__main__":
     # sys.argv 是一个列表，包含了命令行参数
     # main 函数调用时传入 sys.argv，这样 main 就可以接收所有命令行参数
+    # 用法: python 人脸聚类_dlib_chinese_whispers.py <目录> [dlib|embedding] [hardlink|symlink|copy]
     directory = sys.argv[1] if len(sys.argv) > 1 else ''
     if not directory:
         print("请输入目录路径")
@@ -86,4 +124,5 @@ if __name__ == "__main__":
     if not os.path.isdir(directory):
         print("请输入有效的目录路径")
         exit(1)
-    main(directory)
\ No newline at end of file
+    main(directory, 100000, mode=sys.argv[2] if len(sys.argv) > 2 else 'dlib',
+         export_mode=sys.argv[3] if len(sys.argv) > 3 else 'hardlink')
\ No newline at end of file
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import logging
+import numpy as np
+from pathlib import Path
+from face_store import open_face_store, FLAG_DELETED
+from similarity_engine import normalize_embeddings, radius_neighbors
+from chinese_whispers import chinese_whispers
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+UNASSIGNED = -1  # 尚未归入任何簇（噪声，或暂时被标记为重复），之后的运行会再次尝试分配
+REMOVED = -2     # 对应的人脸已被删除或取代（FLAG_DELETED），不再参与聚类
+
+class ClusterState:
+    """
+    增量聚类的持久化状态，保存在 <目标目录>/cluster_state 下。
+        state.json          下一个可用的簇编号、已处理的记录数、构建时人脸数据存储的标识等
+        assignments.i8      与人脸数据存储记录号一一对应的簇编号（int64），只追加
+        clusters.npz        各簇的编号、成员数、归一化特征之和（归一化后即为簇中心）和代表人脸（离簇中心最近的成员记录号）
+    记录的存储标识与当前存储不同（存储被重建）或记录数多于当前存储时，记录号已失效，状态从头开始。
+    """
+
+    def __init__(self, directory, dim=512, store_id=None, store_count=None):
+        self.directory = Path(directory)
+        self.state_path = self.directory / 'state.json'
+        self.touched = set()  # 本次运行中成员有变化的簇编号，只为这些簇重新计算代表人脸
+        state = None
+        if self.state_path.exists():
+            with open(self.state_path, 'r') as file:
+                state = json.load(file)
+            if state.get('store_id') != store_id or (store_count is not None and state['seen'] > store_count):
+                logging.info(f"人脸数据存储已重建（标识 {state.get('store_id')} -> {store_id}），重新开始增量聚类")
+                state = None
+        if state is not None:
+            self.state = state
+            self.assignments = np.fromfile(self.directory / 'assignments.i8', dtype=np.int64)[:self.state['seen']]
+            clusters = np.load(self.directory / 'clusters.npz')
+            self.cluster_ids = clusters['ids']
+            self.counts = clusters['counts']
+            self.sums = clusters['sums']
+            self.medoids = clusters['medoids']
+        else:
+            self.state = {'version': 1, 'next_id': 0, 'seen': 0, 'store_id': store_id}
+            self.assignments = np.zeros(0, dtype=np.int64)
+            self.cluster_ids = np.zeros(0, dtype=np.int64)
+            self.counts = np.zeros(0, dtype=np.int64)
+            self.sums = np.zeros((0, dim), dtype=np.float32)
+            self.medoids = np.zeros(0, dtype=np.int64)
+
+    def centroids(self):
+        return normalize_embeddings(self.sums)
+
+    def extend(self, total):
+        """为新增的记录分配 UNASSIGNED 占位。"""
+        if total > len(self.assignments):
+            self.assignments = np.concatenate([self.assignments, np.full(total - len(self.assignments), UNASSIGNED, dtype=np.int64)])
+        self.state['seen'] = int(len(self.assignments))
+
+    def add_members(self, rows, cluster_positions, vectors):
+        """把记录加入已有的簇（cluster_positions 为簇在数组中的位置），并更新簇中心。"""
+        np.add.at(self.sums, cluster_positions, vectors)
+        np.add.at(self.counts, cluster_positions, 1)
+        self.assignments[rows] = self.cluster_ids[cluster_positions]
+        self.touched.update(self.cluster_ids[cluster_positions].tolist())
+
+    def remove_members(self, rows, vectors, mark=REMOVED):
+        """把记录从所在的簇中移除并更新簇中心，记录标记为 mark（删除为 REMOVED，暂时移出为 UNASSIGNED）。"""
+        positions = np.searchsorted(self.cluster_ids, self.assignments[rows])
+        np.subtract.at(self.sums, positions, vectors)
+        np.subtract.at(self.counts, positions, 1)
+        self.touched.update(self.cluster_ids[positions].tolist())
+        self.assignments[rows] = mark
+
+    def new_clusters(self, groups, vectors):
+        """为每组记录创建一个新的簇，簇编号从 next_id 开始递增，返回新的簇编号。"""
+        new_ids = np.arange(self.state['next_id'], self.state['next_id'] + len(groups), dtype=np.int64)
+        self.state['next_id'] += len(groups)
+        new_sums = np.stack([vectors[group].sum(axis=0) for group in groups]) if groups else np.zeros((0, self.sums.shape[1]), dtype=np.float32)
+        self.cluster_ids = np.concatenate([self.cluster_ids, new_ids])
+        self.counts = np.concatenate([self.counts, np.array([len(group) for group in groups], dtype=np.int64)])
+        self.sums = np.concatenate([self.sums, new_sums.astype(np.float32)])
+        self.medoids = np.concatenate([self.medoids, np.full(len(groups), -1, dtype=np.int64)])
+        self.touched.update(new_ids.tolist())
+        return new_ids
+
+    def drop_empty(self):
+        keep = self.counts > 0
+        self.cluster_ids, self.counts, self.sums, self.medoids = \
+            self.cluster_ids[keep], self.counts[keep], self.sums[keep], self.medoids[keep]
+
+    def update_medoids(self, embeddings, block_size=100000):
+        """
+        为成员有变化的簇（以及还没有代表人脸的簇）重新计算代表人脸：分块计算这些簇的成员与簇中心的相似度，
+        每个簇取相似度最高的成员。其余簇的簇中心不变，代表人脸保持不变，只读取变化簇成员的特征。
+        """
+        stale = np.isin(self.cluster_ids, np.fromiter(self.touched, dtype=np.int64, count=len(self.touched))) | (self.medoids < 0)
+        if not stale.any():
+            return
+        centroids = self.centroids()
+        rows = np.flatnonzero(np.isin(self.assignments, self.cluster_ids[stale]))
+        best_sims = np.full(len(self.cluster_ids), -np.inf, dtype=np.float32)
+        self.medoids[stale] = -1
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            positions = np.searchsorted(self.cluster_ids, self.assignments[block])
+            sims = np.einsum('ij,ij->i', normalize_embeddings(embeddings[block]), centroids[positions])
+            # 块内按 (簇, 相似度) 排序，每个簇取相似度最高的一个成员
+            order = np.lexsort((-sims, positions))
+            first = order[np.r_[True, positions[order][1:] != positions[order][:-1]]]
+            better = sims[first] > best_sims[positions[first]]
+            best_sims[positions[first][better]] = sims[first][better]
+            self.medoids[positions[first][better]] = block[first][better]
+        self.touched = set()
+
+    def save(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.assignments.tofile(self.directory / 'assignments.i8')
+        np.savez(self.directory / 'clusters.npz', ids=self.cluster_ids, counts=self.counts, sums=self.sums, medoids=self.medoids)
+        tmp_path = self.state_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(self.state, file, indent=4)
+        os.replace(tmp_path, self.state_path)
+
+def save_cluster_dict(state, names, output_file_path, live):
+    """
+    按 face_classify_*.txt 的格式保存聚类结果，簇编号在多次运行之间保持稳定，-1 为未归类的人脸，另附各簇的代表人脸。
+    live 为存储中未删除且未标记为重复的记录，暂时被标记为重复的人脸不出现在结果中。
+    """
+    rows = np.flatnonzero((state.assignments != REMOVED) & live)
+    labels = state.assignments[rows]
+    order = np.argsort(labels, kind='stable')
+    rows, labels = rows[order], labels[order]
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]]) if len(labels) else np.zeros(0, dtype=np.int64)
+    ends = np.r_[starts[1:], len(labels)]
+    cluster_dict = {int(labels[start]): [names[row] for row in rows[start:end]] for start, end in zip(starts, ends)}
+    with open(output_file_path, 'w', encoding='utf-8') as file:
+        medoids = {int(cluster_id): names[row] for cluster_id, row in zip(state.cluster_ids, state.medoids) if row >= 0}
+        json.dump({'cluster_dict': cluster_dict, 'core_sample_indices': [], 'medoids': medoids}, file, indent=4, ensure_ascii=False)
+    logging.info(f"聚类结果已保存到: {output_file_path}")
+
+def main(directory_path, similarity=0.5, min_cluster_size=2, memory_budget_mb=512, max_noise=20000):
+    """
+    增量聚类：已有的簇保持不变，新增的人脸和之前未归类的人脸先按最近簇中心分配，
+    相似度不足的新增人脸与最近的 max_noise 个之前未归类的人脸一起重新聚类，更早的未归类人脸只参与按簇中心分配，
+    避免未归类的人脸越积越多时每次运行的两两比较随之增长。
+    参数:
+        directory_path: str, 目标目录（包含 face_store）。
+        similarity: float, 分配到簇中心以及剩余人脸之间建边所需的最小余弦相似度。
+        min_cluster_size: int, 剩余人脸聚出的簇至少包含多少人脸才会创建为新簇。
+        max_noise: int, 每次运行带入重新聚类的之前未归类人脸的最大数量。
+    """
+    start_time = time.perf_counter()
+    store = open_face_store(directory_path)
+    state = ClusterState(os.path.join(directory_path, 'cluster_state'), store.meta['dim'], store.identity, len(store))
+    previous_seen = state.state['seen']
+    state.extend(len(store))
+    live = store.live_mask()
+    deleted = (np.asarray(store.column('flags')) & FLAG_DELETED) != 0
+    embeddings = store.column('embedding')
+
+    # 已删除或被取代的人脸从原来的簇中永久移除；被标记为重复的人脸暂时移出，去重标记取消后重新参与分配
+    stale = np.flatnonzero(deleted & (state.assignments >= 0))
+    if len(stale):
+        state.remove_members(stale, normalize_embeddings(embeddings[stale]))
+    state.assignments[deleted & (state.assignments == UNASSIGNED)] = REMOVED
+    duplicates = np.flatnonzero(~live & ~deleted & (state.assignments >= 0))
+    if len(duplicates):
+        state.remove_members(duplicates, normalize_embeddings(embeddings[duplicates]), UNASSIGNED)
+
+    # 新增的人脸和之前未归类的人脸参与本次分配
+    candidates = np.flatnonzero((state.assignments == UNASSIGNED) & live)
+    logging.info(f"新增人脸 {len(store) - previous_seen} 个, 待分配 {len(candidates)} 个, 已有簇 {len(state.cluster_ids)} 个")
+    vectors = normalize_embeddings(embeddings[candidates]) if len(candidates) else np.zeros((0, store.meta['dim']), dtype=np.float32)
+
+    assigned = np.zeros(len(candidates), dtype=bool)
+    if len(state.cluster_ids) and len(candidates):
+        centroids = state.centroids()
+        best_positions = np.empty(len(candidates), dtype=np.int64)
+        best_sims = np.empty(len(candidates), dtype=np.float32)
+        block_size = max(1, int(memory_budget_mb * 1024 ** 2 / 4 / max(len(centroids), 1)))
+        for block_start in range(0, len(candidates), block_size):
+            sims = vectors[block_start:block_start + block_size] @ centroids.T
+            best_positions[block_start:block_start + block_size] = np.argmax(sims, axis=1)
+            best_sims[block_start:block_start + block_size] = sims[np.arange(len(sims)), best_positions[block_start:block_start + block_size]]
+        assigned = best_sims >= similarity
+        state.add_members(candidates[assigned], best_positions[assigned], vectors[assigned])
+    logging.info(f"按簇中心分配 {int(assigned.sum())} 个人脸")
+
+    # 剩余的新增人脸和最近的 max_noise 个之前未归类的人脸重新聚类，足够大的簇创建为新簇
+    leftover = np.flatnonzero(~assigned)
+    old_noise = leftover[candidates[leftover] < previous_seen]
+    if len(old_noise) > max_noise:
+        leftover = np.concatenate([old_noise[-max_noise:], leftover[candidates[leftover] >= previous_seen]]) if max_noise > 0 \
+            else leftover[candidates[leftover] >= previous_seen]
+    if len(leftover) >= min_cluster_size:
+        labels = chinese_whispers(*radius_neighbors(vectors[leftover], similarity, memory_budget_mb))
+        order = np.argsort(labels, kind='stable')
+        starts = np.flatnonzero(np.r_[True, labels[order][1:] != labels[order][:-1]])
+        groups = [group for group in np.split(order, starts[1:]) if len(group) >= min_cluster_size]
+        new_ids = state.new_clusters([leftover[group] for group in groups], vectors)
+        for cluster_id, group in zip(new_ids, groups):
+            state.assignments[candidates[leftover[group]]] = cluster_id
+        logging.info(f"剩余 {len(leftover)} 个人脸聚出新簇 {len(groups)} 个")
+
+    state.drop_empty()
+    state.update_medoids(embeddings)
+    state.save()
+    save_cluster_dict(state, store.names, os.path.join(directory_path, "face_classify_incremental.txt"), live)
+    logging.info(f"增量聚类完成, 簇数 {len(state.cluster_ids)}, 未归类 {int(np.sum((state.assignments == UNASSIGNED) & live))}, "
+                 f"耗时 {time.perf_counter() - start_time:.2f}s")
+    return state
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else ''
+    if not directory:
+        print("请输入目录路径")
+        exit(1)
+    if not os.path.isdir(directory):
+        print("请输入有效的目录路径")
+        exit(1)
+    main(directory, float(sys.argv[2]) if len(sys.argv) > 2 else 0.5)
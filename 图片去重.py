@@ -12,6 +12,7 @@ from typing import List, Set, Tuple
 from termcolor import colored
 import datetime
 from tqdm import tqdm
+from descriptor_format import write_binary_descriptor, binary_descriptor_path
 
 class ImageDescriptor:
     def __init__(self, unique_images: Set[Path], similar_groups: List[List[Path]]):
@@ -37,6 +38,13 @@ class ImageDescriptor:
             file.write("New unique Images by next detector:\n")
             for image in self.new_unique_images_by_next_detector:
                 file.write(f"{image.name}\n")
+        # 同时写出可内存映射、按组随机读取的二进制描述文件
+        groups = list(zip(self.similar_groups, self.group_removed_by_next_detector))
+        write_binary_descriptor(binary_descriptor_path(filepath),
+                                [image.name for image in self.unique_images],
+                                [[image.name for image in group] for group, _ in groups],
+                                [is_removed for _, is_removed in groups],
+                                [image.name for image in self.new_unique_images_by_next_detector])
 
 class HashDetector:
     def __init__(self, precision: int):
@@ -0,0 +1,93 @@
+import os
+import json
+import logging
+import numpy as np
+from bisect import bisect_right
+from face_store import FaceStore
+
+class ClusterResult:
+    """
+    人脸聚类结果（face_classify_*.txt 中的 JSON）的浏览数据。
+    各簇按人数从大到小排列，未归类的人脸 (-1) 放在最后。每个簇开始时只显示一行代表人脸，
+    按需逐页展开更多成员；只有被显示的簇才会读取人脸数据存储并排序成员（代表人脸在前，其余按检测得分从高到低），
+    因此打开的代价只是读取 JSON 和按簇大小排序。
+    提供与图像描述器相同的查看接口：img_num、file_by_idx、group_of_idx。
+    """
+
+    def __init__(self, filepath, directory, strip_size=8, page_size=200):
+        with open(filepath, 'r', encoding='utf-8') as file:
+            content = json.load(file)
+        cluster_dict = content['cluster_dict']
+        self.medoids = {str(label): name for label, name in content.get('medoids', {}).items()}
+        # 按人数从大到小，未归类放最后
+        self.labels = sorted(cluster_dict, key=lambda label: (label == '-1', -len(cluster_dict[label])))
+        self.members = [cluster_dict[label] for label in self.labels]
+        self.face_count = sum(len(members) for members in self.members)
+        self.directory = directory
+        self.strip_size = strip_size
+        self.page_size = page_size
+        self.shown = [min(len(members), strip_size) for members in self.members]
+        self.ordered = {}  # 簇序号 -> 排序后的成员
+        self._store = None
+        self._rebuild_starts()
+
+    def _rebuild_starts(self):
+        self.img_num = list(self.shown)
+        self.group_starts = [0]
+        for num in self.img_num:
+            self.group_starts.append(self.group_starts[-1] + num)
+
+    @property
+    def store(self):
+        if self._store is None:
+            store_dir = os.path.join(self.directory, 'face_store')
+            self._store = FaceStore(store_dir) if FaceStore.exists(store_dir) else False
+        return self._store
+
+    def group_titles(self):
+        titles = []
+        for label, members, shown in zip(self.labels, self.members, self.shown):
+            title = f"未归类 [{len(members)}]" if label == '-1' else f"簇 {label} [{len(members)}]"
+            if shown < len(members):
+                title += f"  已显示 {shown}，点击标题加载更多"
+            titles.append(title)
+        return titles
+
+    def ordered_members(self, group_idx):
+        """簇成员的显示顺序：代表人脸（medoid）在前，其余按检测得分从高到低。"""
+        ordered = self.ordered.get(group_idx)
+        if ordered is not None:
+            return ordered
+        members = self.members[group_idx]
+        store = self.store
+        if store and len(members) > 1:
+            rows = np.array([store.name_index.get(name, -1) for name in members])
+            scores = np.where(rows >= 0, np.asarray(store.column('det_score'))[np.maximum(rows, 0)], -np.inf)
+            ordered = [members[i] for i in np.argsort(-scores, kind='stable')]
+        else:
+            ordered = list(members)
+        medoid = self.medoids.get(self.labels[group_idx])
+        if medoid is not None and medoid in ordered:
+            ordered.remove(medoid)
+            ordered.insert(0, medoid)
+        self.ordered[group_idx] = ordered
+        return ordered
+
+    def expand(self, group_idx):
+        """再显示一页成员，返回是否有变化。"""
+        total = len(self.members[group_idx])
+        if self.shown[group_idx] >= total:
+            return False
+        self.shown[group_idx] = min(total, self.shown[group_idx] + self.page_size)
+        self._rebuild_starts()
+        return True
+
+    def group_of_idx(self, idx):
+        return bisect_right(self.group_starts, idx) - 1
+
+    def file_by_idx(self, idx):
+        if 0 <= idx < self.group_starts[-1]:
+            group_idx = self.group_of_idx(idx)
+            return self.ordered_members(group_idx)[idx - self.group_starts[group_idx]] + '.jpg'
+        logging.error("Invalid index")
+        return None
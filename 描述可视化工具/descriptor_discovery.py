@@ -0,0 +1,114 @@
+import os
+import logging
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, QFileSystemWatcher, pyqtSignal
+from utils import file_kind
+
+class DescriptorScanner:
+    """
+    描述文件扫描器，按 (路径, 修改时间, 大小) 缓存每个 txt 文件的类型（去重描述文件或聚类结果文件），
+    目录变化时只对新增或变化的文件重新打开判断。
+    """
+
+    def __init__(self):
+        self.cache = {}  # 路径 -> (修改时间ns, 大小, 文件类型)
+        self.probed = 0
+
+    def scan(self, directory):
+        """返回目录中按修改时间排序的 [(文件名, 文件类型)]。"""
+        found = []
+        seen = set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.txt') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                seen.add(entry.path)
+                cached = self.cache.get(entry.path)
+                if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+                    cached = (stat.st_mtime_ns, stat.st_size, file_kind(entry.path))
+                    self.cache[entry.path] = cached
+                    self.probed += 1
+                if cached[2] is not None:
+                    found.append((stat.st_mtime_ns, entry.name, cached[2]))
+        # 清理该目录中已删除文件的缓存
+        for path in [path for path in self.cache if os.path.dirname(path) == directory and path not in seen]:
+            del self.cache[path]
+        return [(name, kind) for _, name, kind in sorted(found)]
+
+class _ScanSignals(QObject):
+    finished = pyqtSignal(str, object)
+
+class DescriptorScanTask(QRunnable):
+    def __init__(self, scanner, directory, signals):
+        super().__init__()
+        self.scanner = scanner
+        self.directory = directory
+        self.signals = signals
+
+    def run(self):
+        try:
+            files = self.scanner.scan(self.directory)
+        except Exception as e:
+            logging.error(f"扫描描述文件失败 {self.directory}: {e}")
+            files = None
+        self.signals.finished.emit(self.directory, files)
+
+class DescriptorDiscovery(QObject):
+    """
+    监听目录并在后台线程中发现描述文件。
+    目录变化信号经 debounce_ms 毫秒防抖，流水线连续写入大量文件只触发一次扫描；
+    扫描进行中又发生变化时，在本次扫描结束后再补扫一次。结果通过 files_changed(目录, [(文件名, 文件类型)]) 发出。
+    """
+    files_changed = pyqtSignal(str, list)
+
+    def __init__(self, debounce_ms=500, parent=None):
+        super().__init__(parent)
+        self.directory = ''
+        self.scanner = DescriptorScanner()
+        # 单线程执行，扫描之间不会并发访问缓存
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.signals = _ScanSignals()
+        self.signals.finished.connect(self._on_scanned, Qt.QueuedConnection)
+        self.task = None
+        self.dirty = False
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(debounce_ms)
+        self.debounce_timer.timeout.connect(self._start_scan)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self._directory_changed)
+
+    def set_directory(self, directory):
+        if self.directory:
+            self.watcher.removePath(self.directory)
+        self.directory = directory
+        self.watcher.addPath(directory)
+        self.debounce_timer.stop()
+        self._start_scan()
+
+    def _directory_changed(self, path):
+        if path == self.directory:
+            self.debounce_timer.start()
+
+    def _start_scan(self):
+        if self.task is not None:
+            self.dirty = True
+            return
+        self.dirty = False
+        self.task = DescriptorScanTask(self.scanner, self.directory, self.signals)
+        self.task.setAutoDelete(False)
+        self.pool.start(self.task)
+
+    def _on_scanned(self, directory, files):
+        self.task = None
+        if self.dirty or directory != self.directory:
+            self._start_scan()
+            return
+        if files is not None:
+            logging.debug(f"描述文件扫描完成: {len(files)} 个, 累计打开判断 {self.scanner.probed} 次")
+            self.files_changed.emit(directory, files)
+
+    def shutdown(self):
+        self.debounce_timer.stop()
+        self.pool.waitForDone()
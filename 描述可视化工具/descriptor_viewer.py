@@ -1,18 +1,25 @@
 import os
-from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QFileDialog, QScrollArea, QLabel, QGridLayout, QListWidget, QListWidgetItem, QWidget
-from PyQt5.QtCore import Qt, QFileSystemWatcher, QTimer, QUrl
+import time
+from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QFileDialog, QLabel, QListWidget, QListWidgetItem, QWidget, QAbstractItemView
+from PyQt5.QtCore import Qt, QTimer, QUrl
 from PyQt5 import QtWidgets
-from PyQt5.QtGui import QPixmap, QFont, QDesktopServices
-from image_descriptor import ImageDescriptor
-from ui_components import ClickableLabel
+from PyQt5.QtGui import QPixmap, QDesktopServices
+from image_descriptor import load_descriptor
+from cluster_result import ClusterResult
+from image_grid import ImageGridModel, ImageGridDelegate, ImageGridView
+from thumbnail_loader import ThumbnailLoader
+from preview_atlas import PreviewAtlas
 from termcolor import colored
-from collections import deque
-from utils import is_descriptor_file
+from bisect import bisect_left, bisect_right
+from descriptor_discovery import DescriptorDiscovery
+from perf_recorder import PerfRecorder
 import logging
 
 class DescripterViewer(QMainWindow):
-    def __init__(self, default_directory=None):
+    def __init__(self, default_directory=None, instrument=False):
         super().__init__()
+        # 性能记录模式：记录各操作耗时，在状态栏显示滚动分位数，退出时写出 JSON 追踪文件
+        self.perf = PerfRecorder(instrument)
         self.title = '查看去重结果'
         self.left = 128
         self.top = 128
@@ -26,9 +33,12 @@ class DescripterViewer(QMainWindow):
         self.descriptor = None
         self.loaded_descripter_path = {}
         self.mapping_file_lines = {}
-        # 待载入队列
-        self.load_queue = deque()
-        self.reset_runtime_status()
+        self.face_mapping_lines = None
+        # 当前显示的是去重描述文件（缩略图）还是聚类结果（人脸图片）
+        self.cluster_mode = False
+        self.loaded_file_kind = {}
+        # 当前目录的预览图集，不存在时逐个读取缩略图文件
+        self.preview_atlas = None
 
         # 图片显示宽度
         self.img_width = 128
@@ -40,27 +50,29 @@ class DescripterViewer(QMainWindow):
         self.widgets_vertical_spacing = 5
         # 图片名字高度
         self.label_height = 24
-        # 组标题高度
-        self.title_height = 50
         # 每行图片数
         self.num_columns = 1
-        
+        # 可视区域上下预取的行数
+        self.prefetch_rows = 2
+
+        # 后台线程池读取和缩放缩略图，GUI 线程只负责把结果转为 QPixmap 并绘制
+        self.thumbnail_loader = ThumbnailLoader(self.img_width, self.img_height, perf=self.perf if instrument else None, parent=self)
+        self.perf.cache_stats = lambda: {'hits': self.thumbnail_loader.cache.hits, 'misses': self.thumbnail_loader.cache.misses}
+        self.thumbnail_loader.image_ready.connect(self.on_thumbnail_ready)
+        self.reset_runtime_status()
+
         # 刷新图像视图的定时器
         self.view_refresh_timer = QTimer(self)
         self.view_refresh_timer.timeout.connect(self.img_viewport_change_delay_action)  # 连接超时信号到处理函数
-        # 非阻塞加载图片的定时器
-        self.load_timer = QTimer(self)
-        self.load_timer.timeout.connect(self.handle_load_timer)  # 连接超时信号到处理函数
-        self.load_timer.setSingleShot(True)  # 设置为单次触发
-        self.load_timer.start(100)
 
         # self.status_bar_timer = QTimer(self)
         # self.status_bar_timer.timeout.connect(lambda: self.status_label.setText(
-            # f"当前已载入图片数: {self.loaded_img_cnt} 每行图片数: {self.num_columns} 滚动条位置: {self.scroll_area.verticalScrollBar().value()}"))
+            # f"当前已载入图片数: {self.loaded_img_cnt} 每行图片数: {self.num_columns} 滚动条位置: {self.image_view.verticalScrollBar().value()}"))
         # self.status_bar_timer.start(10)
 
-        # 监听文件夹的变化
-        self.watcher = QFileSystemWatcher()
+        # 监听文件夹的变化，在后台线程中防抖扫描描述文件
+        self.discovery = DescriptorDiscovery(parent=self)
+        self.discovery.files_changed.connect(self.populate_files_list)
         self.init_ui()
 
         if default_directory and os.path.exists(default_directory) and os.path.isdir(default_directory):
@@ -86,22 +98,22 @@ class DescripterViewer(QMainWindow):
         self.file_list = QListWidget()
         self.file_list.itemClicked.connect(self.display_file_content)
 
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.image_container = QWidget()
-        self.scroll_area.setWidget(self.image_container)
+        # 虚拟化的图片网格：模型按行组织图片，委托只绘制可见的行
+        self.image_model = ImageGridModel(self)
+        self.image_delegate = ImageGridDelegate(self.img_width, self.img_height, self.label_height,
+                                                self.img_horizontal_spacing, self.widgets_vertical_spacing, self)
+        self.image_view = ImageGridView(self.image_delegate)
+        self.image_view.setModel(self.image_model)
+        self.image_view.image_clicked.connect(self.image_clicked)
+        self.image_view.header_clicked.connect(self.header_clicked)
+        self.image_model.set_placeholder("当前未选择文件")
 
-        self.image_layout = QVBoxLayout()
-        self.image_layout.setSpacing(self.widgets_vertical_spacing)
-        self.image_layout.setAlignment(Qt.AlignTop | Qt.AlignLeft)
-        self.image_container.setLayout(self.image_layout)
-
-        self.scroll_area.verticalScrollBar().valueChanged.connect(self.scrollbar_value_changed)
-        self.scroll_area.horizontalScrollBar().valueChanged.connect(self.scrollbar_value_changed)
+        self.image_view.verticalScrollBar().valueChanged.connect(self.scrollbar_value_changed)
+        self.image_view.horizontalScrollBar().valueChanged.connect(self.scrollbar_value_changed)
 
         splitter = QtWidgets.QSplitter(Qt.Horizontal)
         splitter.addWidget(self.file_list)
-        splitter.addWidget(self.scroll_area)
+        splitter.addWidget(self.image_view)
         splitter.setSizes([150, self.width - 150])
         splitter.splitterMoved.connect(self.on_image_container_size_changed)
 
@@ -119,6 +131,12 @@ class DescripterViewer(QMainWindow):
         self.btn_status_1.clicked.connect(self.show_prev_group)
         self.btn_status_2.clicked.connect(self.show_next_group)
         status_layout.addWidget(self.status_label, stretch=1)
+        if self.perf.enabled:
+            self.perf_label = QLabel(self.perf.summary_text())
+            status_layout.addWidget(self.perf_label)
+            self.perf_timer = QTimer(self)
+            self.perf_timer.timeout.connect(lambda: self.perf_label.setText(self.perf.summary_text()))
+            self.perf_timer.start(1000)
         status_layout.addWidget(self.btn_status_1)
         status_layout.addWidget(self.btn_status_2)
 
@@ -139,12 +157,9 @@ class DescripterViewer(QMainWindow):
         if directory and os.path.exists(directory) and os.path.isdir(directory):
             self.status_label.setText("未打开文件夹")
             self.entry_directory.setText(directory)
-            if self.current_directory:
-                self.watcher.removePath(self.current_directory)
             self.current_directory = directory
-            self.watcher.addPath(directory)
-            self.watcher.directoryChanged.connect(self.directory_changed)
-            self.populate_files_list(directory)
+            self.face_mapping_lines = None
+            self.discovery.set_directory(directory)
             self.load_mappings()
         else:
             logging.error(f"Invalid directory: {directory}")
@@ -167,17 +182,36 @@ class DescripterViewer(QMainWindow):
             except Exception as e:
                 logging.error(f"Failed to read mapping file: {e}")
 
-    def populate_files_list(self, directory):
+    def load_face_mappings(self):
+        # 人脸图片名 -> 原图路径，只在聚类模式下第一次点击人脸时读取
+        self.face_mapping_lines = {}
+        mapping_file_path = os.path.join(self.current_directory, "face_mapping.txt")
+        try:
+            with open(mapping_file_path, 'r') as file:
+                for line in file:
+                    parts = line.strip().split('*')
+                    if len(parts) >= 2:
+                        self.face_mapping_lines[parts[1].split('.')[0]] = parts[0]
+        except FileNotFoundError:
+            logging.error(f"Mapping file {mapping_file_path} not found.")
+        except Exception as e:
+            logging.error(f"Failed to read mapping file: {e}")
+
+    def populate_files_list(self, directory, descriptor_files):
+        # descriptor_files 由后台扫描得到: [(文件名, 文件类型)]，已按修改时间排序
         logging.debug(f"Populating files list: {directory}")
-        files = sorted([f for f in os.listdir(directory) if f.endswith('.txt')], key=lambda f: os.path.getmtime(os.path.join(directory, f)))
-        fileshash = hash(tuple(files))
+        if directory != self.current_directory:
+            return
+        fileshash = hash((directory, tuple(descriptor_files)))
         if fileshash == self.txt_fileslist_hash:
             logging.debug("Files list is unchanged, skipping update.")
             return
         self.txt_fileslist_hash = fileshash
 
-        def human_readable_name(file_name):
+        def human_readable_name(file_name, kind):
             """将字节转换为更易读的格式。"""
+            if kind == 'cluster':
+                return f"[聚类]{file_name[len('face_classify'):-len('.txt')].strip('_')}"
             try:
                 # 分割字符串，获取中间的部分（somestr）和时间部分
                 parts = file_name.split("_")
@@ -194,11 +228,12 @@ class DescripterViewer(QMainWindow):
         # 填充文件列表
         self.file_list.clear()
         self.loaded_descripter_path = {}
-        descriptor_files = [f for f in files if is_descriptor_file(os.path.join(directory, f))]
+        self.loaded_file_kind = {}
         current_select_found = False
-        for file in descriptor_files:
-            display_name = human_readable_name(file)
+        for file, kind in descriptor_files:
+            display_name = human_readable_name(file, kind)
             self.loaded_descripter_path[display_name] = file
+            self.loaded_file_kind[display_name] = kind
             item = QListWidgetItem(display_name)
             self.file_list.addItem(item)
             if display_name == self.current_selected_file:
@@ -212,18 +247,25 @@ class DescripterViewer(QMainWindow):
     def display_file_content(self, item):
         logging.debug(f"Displaying file content: {item}")
         if item is None:
-            self.clear_layout(self.image_layout)  # 清理布局
-            placeholder = QLabel("当前未选择文件")
-            self.image_layout.addWidget(placeholder)  # 显示提示信息
             self.reset_runtime_status()
+            self.image_model.set_placeholder("当前未选择文件")  # 显示提示信息
             self.view_refresh_timer.stop()
             return
         # 显示文件内容和相关图像
         filepath = os.path.join(self.current_directory, self.loaded_descripter_path.get(item.text()))
         try:
-            self.descriptor = ImageDescriptor.deserialize(filepath)
+            self.cluster_mode = self.loaded_file_kind.get(item.text()) == 'cluster'
+            if self.cluster_mode:
+                with self.perf.measure('descriptor_parse', kind='cluster'):
+                    self.descriptor = ClusterResult(filepath, self.current_directory)
+                self.preview_atlas = None  # 图集只包含缩略图，人脸图片逐个读取
+                self.status_label.setText(f"簇: {len(self.descriptor.labels)} | 人脸: {self.descriptor.face_count} | 点击簇标题加载更多成员")
+            else:
+                with self.perf.measure('descriptor_parse', kind='descriptor'):
+                    self.descriptor = load_descriptor(filepath)
+                self.load_preview_atlas()
+                self.status_label.setText(f"唯一图片: {self.descriptor.img_num[0]} | 相似组: {len(self.descriptor.img_num) - 1} | 后一判断器新增唯一图片: {len(self.descriptor.new_unique_images)}")
             self.current_selected_file = item.text()
-            self.status_label.setText(f"唯一图片: {len(self.descriptor.unique_images)} | 相似组: {len(self.descriptor.similar_groups)} | 后一判断器新增唯一图片: {len(self.descriptor.new_unique_images)}")
             self.construct_img_layout_structure()
         except Exception as e:
             self.status_label.setText(f"解析描述文件出错: {e}")
@@ -231,115 +273,64 @@ class DescripterViewer(QMainWindow):
             raise
 
     def img_viewport_width(self):
-        # return (self.scroll_area.viewport().width() -
-            # self.image_layout.contentsMargins().left() -
-            # self.image_layout.contentsMargins().right())
-        return self.scroll_area.viewport().width() - self.image_layout.contentsMargins().left()
-    def img_display_vertical_pos(self, img_idx):
-        """
-        计算图像在显示区域中的垂直位置
-        :param img_idx: 图像索引
-        :return: 垂直位置
-        """
-        if self.descriptor is None:
-            logging.error("No descriptor to calculate image display vertical position")
-            return float('inf')
-        # num_columns = max(1, self.img_viewport_width() // (self.img_width + self.img_horizontal_spacing))
-        # logging.debug(colored(f"Number of columns: {num_columns}", "yellow"))
-        v_pos = 0
-        count = 0
-        row_height = self.img_height + self.widgets_vertical_spacing * 2 + self.label_height
-        for group_img_num in self.descriptor.img_num:
-            v_pos += self.title_height + self.image_layout.spacing()
-            if count + group_img_num > img_idx:
-                return v_pos + ((img_idx - count) // self.num_columns) * row_height
-            count += group_img_num
-            v_pos += ((group_img_num - 1) // self.num_columns + 1) * row_height - self.widgets_vertical_spacing + self.image_layout.spacing()
-            
-        # 传入的img_idx超过当前描述文件记录的图片数量
-        return float('inf')
-    
+        return self.image_view.viewport().width()
+
+    def load_preview_atlas(self):
+        # 每次打开描述文件时重新读取图集索引，图集在查看期间被重建也能用上
+        self.preview_atlas = PreviewAtlas(self.current_directory) if PreviewAtlas.exists(self.current_directory) else None
+        if self.preview_atlas is not None and not self.preview_atlas.is_current():
+            # 缩略图在图集构建后被重新生成，图集中的预览可能对应其他文件，改为逐个读取缩略图
+            logging.warning(f"预览图集已过期，请重新生成: {self.preview_atlas.atlas_dir}")
+            self.preview_atlas = None
+        if self.preview_atlas is not None:
+            logging.debug(f"预览图集: {len(self.preview_atlas)} 张预览, {len(self.preview_atlas.pages())} 页")
+
     def reset_runtime_status(self):
         self.loaded_img_cnt = 0
-        self.load_queue.clear()
-        self.image_labels = {}
-        self.group_scroll_vpos = []
+        self.thumbnail_loader.reset(self.preview_atlas)
 
     def construct_img_layout_structure(self):
-        # 构建图像显示区域结构
+        # 构建图像显示区域结构：只把分组信息交给模型，不为每张图片创建控件
         logging.debug("Updating image display")
         if self.descriptor is None:
             logging.error("No descriptor to update image display")
             return
 
-        self.clear_layout(self.image_layout)
+        start = time.perf_counter()
         self.reset_runtime_status()
         self.num_columns = max(1, self.img_viewport_width() // (self.img_width + self.img_horizontal_spacing))
-
-        def display_image_group(title, images, start_image_idx, new_unique_images = [], removed=False):
-            title_label = QLabel(title)
-            title_label.setFixedHeight(self.title_height)
-            title_label.setFont(QFont("Arial", 20, QFont.Bold))
-            if removed: title_label.setStyleSheet("QLabel { color : yellow; }")
-            self.image_layout.addWidget(title_label)
-            vertical_size = self.title_height + self.widgets_vertical_spacing
-
-            grid_layout = QGridLayout()
-            grid_layout.setAlignment(Qt.AlignTop | Qt.AlignLeft)
-            grid_layout.setContentsMargins(0, 0, 0, 0)
-            grid_layout.setHorizontalSpacing(self.img_horizontal_spacing)
-            grid_layout.setVerticalSpacing(self.widgets_vertical_spacing)
-            row = 0
-            col = 0
-            vertical_size += self.img_height + self.label_height + self.widgets_vertical_spacing * 2
-            for idx, filename in enumerate(images):
-                img_label = ClickableLabel()
-                img_label.setFixedSize(self.img_width, self.img_height)
-                img_label.setStyleSheet("background-color: gray")  # 灰色占位图
-                txt_label = QLabel(f"[{start_image_idx + idx}] {filename.split('.')[0]}")
-                txt_label.setAlignment(Qt.AlignTop | Qt.AlignHCenter)
-                txt_label.setFixedHeight(self.label_height)
-                txt_label.setFixedWidth(self.img_width)
-                if filename in new_unique_images: txt_label.setStyleSheet("QLabel { color : yellow; }")
-                grid_layout.addWidget(img_label, row, col)
-                grid_layout.addWidget(txt_label, row + 1, col)
-                self.image_labels[start_image_idx + idx] = img_label
-
-                col += 1
-                if col >= self.num_columns and idx != len(images) - 1:
-                    row += 2  # 为文件名标签留出空间
-                    vertical_size += self.img_height + self.label_height + self.widgets_vertical_spacing * 2
-                    col = 0
-
-            for column in range(col, self.num_columns):
-                grid_layout.setColumnStretch(column, 0)
-                
-            widget = QWidget()
-            widget.setLayout(grid_layout)
-            self.image_layout.addWidget(widget)
-            return start_image_idx + len(images), vertical_size
-
-        self.group_scroll_vpos.append(0)
-        vertical_pos = 0
-        image_idx, vertical_pos = display_image_group("唯一图片", list(self.descriptor.unique_images), 0)
-        self.group_scroll_vpos.append(vertical_pos)
-        for group_idx, images in enumerate(self.descriptor.similar_groups):
-            image_idx, vertical_size = display_image_group(
-                f"重复图片组 {group_idx + 1} [{len(images)}]",
-                images, image_idx, self.descriptor.new_unique_images,
-                self.descriptor.similar_groups_flg[group_idx] != ""
-                )
-            vertical_pos += vertical_size
-            self.group_scroll_vpos.append(vertical_pos)
-
-        logging.debug("图片标签准备完成")
-
-        # self.view_refresh_timer.start(self.view_refresh_throttling)  # 启动定时器重新调整布局
+        if self.cluster_mode:
+            groups = [(title, size, False) for title, size in zip(self.descriptor.group_titles(), self.descriptor.img_num)]
+            highlighted = ()
+        else:
+            groups = [("唯一图片", self.descriptor.img_num[0], False)]
+            for group_idx, size in enumerate(self.descriptor.img_num[1:]):
+                groups.append((f"重复图片组 {group_idx + 1} [{size}]", size, self.descriptor.similar_groups_flg[group_idx] != ""))
+            highlighted = self.descriptor.new_unique_images
+        # 聚类结果可能有上万个小簇，簇标题内嵌在每簇第一行的第一格，不单独占行
+        self.image_model.set_groups(groups, self.descriptor.file_by_idx, highlighted, self.num_columns,
+                                    inline_headers=self.cluster_mode)
+        self.perf.record('layout_construct', (time.perf_counter() - start) * 1000, groups=len(groups))
+        logging.debug("图片模型准备完成")
         self.img_viewport_change_delay_action()
 
+    def visible_image_indices(self):
+        """可见行中所有图片的全局序号。"""
+        first, last = self.image_view.visible_rows()
+        return set(self.image_model.images_in_rows(first, last))
+
+    def thumbnail_path(self, img_idx):
+        filename = self.image_model.file_by_idx(img_idx)
+        if filename is None:
+            return None
+        return os.path.join(self.current_directory, 'faces' if self.cluster_mode else 'thumbnail', filename)
+
     def lazy_load_and_unload_imgs(self):
         """
-        加载可见图片，卸载不可见图片
+        加载可见图片，卸载不可见图片。
+        可见行和上下 prefetch_rows 行的图片按与可视区域中心的行距提交给后台加载器，越近越先加载；
+        已离开该范围的排队任务被撤回。缓存命中的可见图片立即显示，预取的图片只进入缓存。
+        有预览图集时同一页面的图片合并为一次整页读取。
         """
         logging.debug("加载可见图片")
 
@@ -347,64 +338,85 @@ class DescripterViewer(QMainWindow):
             logging.error("No descriptor to load visible images")
             return
 
-        for img_idx, label in self.image_labels.items():
-            pos = self.img_display_vertical_pos(img_idx)
-            visible = pos + self.img_height > self.scroll_area.verticalScrollBar().value() \
-                and pos < self.scroll_area.verticalScrollBar().value() + self.scroll_area.viewport().height()
-
-            pixmap = label.pixmap()
-            loaded = pixmap is not None and not pixmap.isNull()
-            if visible and not loaded:
-                # logging.debug(colored(f"{self.descriptor.file_by_idx(img_idx)} 进入加载队列", "blue"))
-                if img_idx not in self.load_queue:
-                    self.load_queue.append(img_idx)
-            if not visible:
-                if loaded:
-                    # logging.debug(colored(f"{self.descriptor.file_by_idx(img_idx)} 已卸载", "yellow"))
-                    label.setPixmap(QPixmap())
-                    label.disconnect()
-                    self.loaded_img_cnt -= 1
-                else:
-                    try:
-                        self.load_queue.remove(img_idx)
-                        # logging.debug(colored(f"{self.descriptor.file_by_idx(img_idx)} 已取消加载", "yellow"))
-                    except ValueError:
-                        pass
-    
+        start = time.perf_counter()
+        first, last = self.image_view.visible_rows()
+        if last < first:
+            return
+        visible = set(self.image_model.images_in_rows(first, last))
+        self.image_model.drop_pixmaps(visible)
+        center = (first + last) // 2
+        wanted = {}
+        for row in range(max(0, first - self.prefetch_rows), min(self.image_model.rowCount() - 1, last + self.prefetch_rows) + 1):
+            for img_idx in self.image_model.image_range(row):
+                wanted[img_idx] = abs(row - center)
+        requests = []
+        for img_idx, distance in wanted.items():
+            if img_idx in self.image_model.pixmaps:
+                continue
+            img_path = self.thumbnail_path(img_idx)
+            if img_path is None:
+                logging.error(f"No image found for index {img_idx}")
+                continue
+            requests.append((img_idx, img_path, -distance))
+        for img_idx, image in self.thumbnail_loader.schedule(requests).items():
+            if img_idx in visible:
+                self.image_model.set_pixmap(img_idx, QPixmap.fromImage(image))
+        self.loaded_img_cnt = len(self.image_model.pixmaps)
+        self.perf.record('visible_scan', (time.perf_counter() - start) * 1000, requests=len(requests))
+
+    def on_thumbnail_ready(self, img_idx, image):
+        # 只有仍在可视区域内的图片才转换为 QPixmap 显示，预取的图片留在缓存中
+        first, last = self.image_view.visible_rows()
+        if first <= self.image_model.row_of_image(img_idx) <= last:
+            self.image_model.set_pixmap(img_idx, QPixmap.fromImage(image))
+            self.loaded_img_cnt = len(self.image_model.pixmaps)
+
     def show_next_group(self):
         # 按钮1点击时执行的操作
         logging.debug("下一组")
-        current_vertical_scroll_pos = self.scroll_area.verticalScrollBar().value()
-        for vpos in self.group_scroll_vpos:
-            if vpos > current_vertical_scroll_pos:
-                self.scroll_area.verticalScrollBar().setValue(vpos)
-                break
+        first, _ = self.image_view.visible_rows()
+        group_idx = bisect_right(self.image_model.group_rows, first)
+        if group_idx < len(self.image_model.group_rows):
+            self.image_view.scrollTo(self.image_model.index(self.image_model.group_rows[group_idx]), QAbstractItemView.PositionAtTop)
 
     def show_prev_group(self):
         # 按钮2点击时执行的操作
         logging.debug("上一组")
-        current_vertical_scroll_pos = self.scroll_area.verticalScrollBar().value()
-        for vpos in reversed(self.group_scroll_vpos):
-            if vpos < current_vertical_scroll_pos:
-                self.scroll_area.verticalScrollBar().setValue(vpos)
-                break
+        first, _ = self.image_view.visible_rows()
+        group_idx = bisect_left(self.image_model.group_rows, first) - 1
+        if group_idx >= 0:
+            self.image_view.scrollTo(self.image_model.index(self.image_model.group_rows[group_idx]), QAbstractItemView.PositionAtTop)
+
+    def image_clicked(self, img_idx):
+        if img_idx in self.image_model.pixmaps:
+            self.open_original_image(self.image_model.file_by_idx(img_idx).split('.')[0])
+
+    def header_clicked(self, group_idx):
+        # 聚类模式下点击簇标题再显示一页成员，只重新分行，保持滚动位置
+        if not self.cluster_mode or not self.descriptor.expand(group_idx):
+            return
+        scroll_value = self.image_view.verticalScrollBar().value()
+        self.construct_img_layout_structure()
+        self.image_view.verticalScrollBar().setValue(scroll_value)
+        self.img_viewport_change_delay_action()
 
     def open_original_image(self, thumbnail_name):
-        if self.mapping_file_lines is None:
-            self.load_mappings()
-        
-        orig_file_path = self.mapping_file_lines.get(thumbnail_name)
+        if self.cluster_mode:
+            if self.face_mapping_lines is None:
+                self.load_face_mappings()
+            mapping = self.face_mapping_lines
+        else:
+            if self.mapping_file_lines is None:
+                self.load_mappings()
+            mapping = self.mapping_file_lines
+
+        orig_file_path = mapping.get(thumbnail_name)
         if orig_file_path:
             logging.debug(f"打开: {thumbnail_name} 源文件: {orig_file_path}")
             QDesktopServices.openUrl(QUrl.fromLocalFile(orig_file_path))
         else:
             logging.info(f"No mapping found for {thumbnail_name}")
 
-    def directory_changed(self, path):
-        # 目录变更处理
-        if path == self.current_directory:
-            self.populate_files_list(path)
-
     def scrollbar_value_changed(self):
         self.view_refresh_timer.start(self.view_refresh_throttling)  # 启动定时器重新调整布局
 
@@ -424,43 +436,18 @@ class DescripterViewer(QMainWindow):
         # logging.debug(colored(f"img_viewport_change_delay_action", "green"))
         num_columns = max(1, self.img_viewport_width() // (self.img_width + self.img_horizontal_spacing))
         if num_columns != self.num_columns:
-            self.construct_img_layout_structure()
-        else:
+            # 列数变化只需要模型重新分行，不重建任何控件
+            self.num_columns = num_columns
+            self.image_model.set_num_columns(num_columns)
+        if self.descriptor is not None:
             self.lazy_load_and_unload_imgs()  # 重新加载可见图片
         self.view_refresh_timer.stop()
 
         # self.num_columns = max(1, self.img_viewport_width() // (self.img_width + self.img_horizontal_spacing))
         # logging.debug(colored(f"Number of columns: {self.num_columns}", "yellow"))
 
-    def handle_load_timer(self):
-        if len(self.load_queue) == 0:
-            # 一直没有任务时，以较低的频率检测
-            QTimer.singleShot(100, self.load_timer.start)
-            return
-        
-        img_idx = self.load_queue.popleft()
-        img_label = self.image_labels.get(img_idx)
-        if img_label is None:
-            logging.error(f"No label found for image index {img_idx}")
-        else:
-            img_path = os.path.join(self.current_directory, 'thumbnail', self.descriptor.file_by_idx(img_idx))
-            # logging.debug(colored(f"{self.descriptor.file_by_idx(img_idx)} 已加载", "green"))
-            pixmap = QPixmap(img_path).scaled(self.img_width, self.img_height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            pos = self.img_display_vertical_pos(img_idx)
-            visible = pos + self.img_height > self.scroll_area.verticalScrollBar().value() \
-                    and pos < self.scroll_area.verticalScrollBar().value() + self.scroll_area.viewport().height()
-            if not visible:
-                logging.debug(colored(f"图片 {self.descriptor.file_by_idx(img_idx)} 未在可视区域内", "red"))
-            else:
-                img_label.setPixmap(pixmap)
-                img_label.clicked.connect(lambda: self.open_original_image(self.descriptor.file_by_idx(img_idx).split('.')[0]))
-                self.loaded_img_cnt += 1
-        # 有任务时，以较高的频率检测
-        QTimer.singleShot(1, self.load_timer.start)
-
-    def clear_layout(self, layout):
-        # 清空布局中的所有控件
-        while layout.count():
-            child = layout.takeAt(0)
-            if child.widget():
-                child.widget().deleteLater()
\ No newline at end of file
+    def closeEvent(self, event):
+        self.discovery.shutdown()
+        self.thumbnail_loader.shutdown()
+        self.perf.dump()
+        super().closeEvent(event)
@@ -1,15 +1,24 @@
 import logging
+from bisect import bisect_right
+from descriptor_format import BinaryDescriptor, binary_descriptor_path, binary_is_current
 
 class ImageDescriptor:
     # 初始化图像描述器
     def __init__(self, unique_images, similar_groups, similar_groups_flg, new_unique_images):
         if len(similar_groups) != len(similar_groups_flg):
             raise ValueError(f"Similar groups and flags must have the same length, len of similar_groups: {len(similar_groups)}, len of similar_groups_flg: {len(similar_groups_flg)}")
-        self.unique_images = set(unique_images)
+        # 保持描述文件中的顺序去重，唯一图片的显示顺序在多次打开之间保持一致
+        self.unique_list = list(dict.fromkeys(unique_images))
+        self.unique_images = set(self.unique_list)
         self.similar_groups = similar_groups
         self.similar_groups_flg = similar_groups_flg
         self.new_unique_images = new_unique_images
-        self.img_num = [len(unique_images)] + [len(sub_array) for sub_array in similar_groups]
+        self.img_num = [len(self.unique_list)] + [len(sub_array) for sub_array in similar_groups]
+        # 按显示顺序排列的全部图片（唯一图片在前，之后依次为各相似组），以及各组第一张图片的序号（前缀和）
+        self.flat_files = self.unique_list + [image for group in similar_groups for image in group]
+        self.group_starts = [0]
+        for num in self.img_num:
+            self.group_starts.append(self.group_starts[-1] + num)
 
     @classmethod
     def deserialize(cls, filepath):
@@ -59,14 +68,43 @@ class ImageDescriptor:
     
     def file_by_idx(self, idx):
         # 根据索引获取文件
-        if idx < len(self.unique_images):
-            return list(self.unique_images)[idx]
-        else:
-            count = len(self.unique_images)
-            for group in self.similar_groups:
-                if idx < count + len(group):
-                    return group[idx - count]
-                else:
-                    count += len(group)
-            logging.error("Invalid index")
-            return None
\ No newline at end of file
+        if 0 <= idx < len(self.flat_files):
+            return self.flat_files[idx]
+        logging.error("Invalid index")
+        return None
+
+    def group_of_idx(self, idx):
+        """图片序号所在的组，0 为唯一图片，i 为第 i 个相似组。"""
+        return bisect_right(self.group_starts, idx) - 1
+
+class MappedImageDescriptor:
+    """
+    基于内存映射二进制描述文件的图像描述器，接口与 ImageDescriptor 的查看部分一致。
+    打开时只读取组偏移表和组标志，文件名在绘制时按全局序号直接从条目和字符串表读取。
+    """
+
+    def __init__(self, filepath):
+        self.binary = BinaryDescriptor(filepath)
+        sizes = self.binary.list_sizes()
+        self.img_num = sizes[:-1]
+        self.similar_groups_flg = ["removed" if self.binary.group_removed(group_idx) else "" for group_idx in range(self.binary.group_count)]
+        self.new_unique_images = self.binary.new_unique_images()
+        self.group_starts = [0]
+        for num in self.img_num:
+            self.group_starts.append(self.group_starts[-1] + num)
+
+    def file_by_idx(self, idx):
+        if 0 <= idx < self.group_starts[-1]:
+            return self.binary.entry(idx)
+        logging.error("Invalid index")
+        return None
+
+    def group_of_idx(self, idx):
+        """图片序号所在的组，0 为唯一图片，i 为第 i 个相似组。"""
+        return bisect_right(self.group_starts, idx) - 1
+
+def load_descriptor(filepath):
+    """打开描述文件：存在不旧于文本文件的二进制描述文件时内存映射读取，否则解析文本。"""
+    if binary_is_current(filepath):
+        return MappedImageDescriptor(binary_descriptor_path(filepath))
+    return ImageDescriptor.deserialize(filepath)
@@ -0,0 +1,246 @@
+from bisect import bisect_right
+from PyQt5.QtWidgets import QStyledItemDelegate, QListView, QAbstractItemView
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize, pyqtSignal
+from PyQt5.QtGui import QFont, QColor
+
+ROW_HEADER = 0
+ROW_IMAGES = 1
+
+class ImageGridModel(QAbstractListModel):
+    """
+    图片网格的虚拟化模型：每一行是一个组标题行，或一行最多 num_columns 张图片。
+    模型只保存各组的图片数和两组前缀和（各组第一张图片的序号、各组标题行的行号），
+    行号与图片序号之间的换算都是二分查找加算术运算，视图只为可见的行调用委托绘制，
+    因此打开、改变列数和滚动的代价都与图片总数无关。
+    inline_headers 为 True 时标题不单独占一行，而是占据该组第一行的第一格，适合大量小组（如聚类结果）的紧凑显示。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.titles = []
+        self.removed = []
+        self.group_sizes = []
+        self.image_starts = [0]  # 各组第一张图片的全局序号，末尾为图片总数
+        self.group_rows = []  # 各组标题行的行号
+        self.total_rows = 0
+        self.num_columns = 1
+        self.inline_headers = False
+        self.file_lookup = None
+        self.highlighted = set()
+        self.pixmaps = {}
+
+    def set_groups(self, groups, file_lookup=None, highlighted=(), num_columns=None, inline_headers=False):
+        """
+        设置要显示的图片组。
+        groups: [(标题, 图片数, 是否标黄)]
+        file_lookup: 图片全局序号 -> 文件名，例如 ImageDescriptor.file_by_idx。
+        """
+        self.titles = [title for title, _, _ in groups]
+        self.group_sizes = [size for _, size, _ in groups]
+        self.removed = [removed for _, _, removed in groups]
+        self.image_starts = [0]
+        for size in self.group_sizes:
+            self.image_starts.append(self.image_starts[-1] + size)
+        self.file_lookup = file_lookup
+        self.highlighted = set(highlighted)
+        self.pixmaps = {}
+        self.inline_headers = inline_headers
+        if num_columns is not None:
+            self.num_columns = num_columns
+        self._rebuild_rows()
+
+    def set_placeholder(self, text):
+        """没有图片时只显示一行提示文字。"""
+        self.set_groups([(text, 0, False)])
+
+    def set_num_columns(self, num_columns):
+        if num_columns != self.num_columns:
+            self.num_columns = num_columns
+            self._rebuild_rows()
+
+    def _rebuild_rows(self):
+        # 只按组计算行号前缀和，代价与组数成正比，与图片数无关
+        self.beginResetModel()
+        self.group_rows = []
+        row = 0
+        for size in self.group_sizes:
+            self.group_rows.append(row)
+            if self.inline_headers:
+                row += (size + self.num_columns) // self.num_columns
+            else:
+                row += 1 + (size + self.num_columns - 1) // self.num_columns
+        self.total_rows = row
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.total_rows
+
+    def row_info(self, row):
+        """返回 (行类型, 组序号, 第一张图片的全局序号, 图片数)。"""
+        group_idx = bisect_right(self.group_rows, row) - 1
+        offset = row - self.group_rows[group_idx]
+        if self.inline_headers:
+            # 标题占第一格，组内第 k 张图片位于第 k + 1 格
+            first_in_group = max(0, offset * self.num_columns - 1)
+            count = min(self.num_columns - (offset == 0), self.group_sizes[group_idx] - first_in_group)
+            if count <= 0:
+                return ROW_HEADER, group_idx, self.image_starts[group_idx], 0
+            return ROW_IMAGES, group_idx, self.image_starts[group_idx] + first_in_group, count
+        if offset == 0:
+            return ROW_HEADER, group_idx, self.image_starts[group_idx], 0
+        first_in_group = (offset - 1) * self.num_columns
+        count = min(self.num_columns, self.group_sizes[group_idx] - first_in_group)
+        return ROW_IMAGES, group_idx, self.image_starts[group_idx] + first_in_group, count
+
+    def header_columns(self, row):
+        """行首被内嵌标题占据的格数：内嵌标题时各组第一行为 1，其余为 0。"""
+        if not self.inline_headers:
+            return 0
+        group_idx = bisect_right(self.group_rows, row) - 1
+        return 1 if self.group_rows[group_idx] == row else 0
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        kind, group_idx, _, _ = self.row_info(index.row())
+        if role == Qt.DisplayRole and (kind == ROW_HEADER or self.header_columns(index.row())):
+            return self.titles[group_idx]
+        return None
+
+    def image_range(self, row):
+        """某一行包含的图片全局序号范围，标题行为空。"""
+        kind, _, first, count = self.row_info(row)
+        return range(first, first + count) if kind == ROW_IMAGES else range(0)
+
+    def images_in_rows(self, first_row, last_row):
+        """闭区间内各行包含的图片序号，只访问这些行。"""
+        images = []
+        for row in range(first_row, last_row + 1):
+            images.extend(self.image_range(row))
+        return images
+
+    def file_by_idx(self, img_idx):
+        return self.file_lookup(img_idx) if self.file_lookup is not None else None
+
+    def row_of_image(self, img_idx):
+        if not 0 <= img_idx < self.image_starts[-1]:
+            return -1
+        group_idx = bisect_right(self.image_starts, img_idx) - 1
+        if self.inline_headers:
+            return self.group_rows[group_idx] + (img_idx - self.image_starts[group_idx] + 1) // self.num_columns
+        return self.group_rows[group_idx] + 1 + (img_idx - self.image_starts[group_idx]) // self.num_columns
+
+    def set_pixmap(self, img_idx, pixmap):
+        self.pixmaps[img_idx] = pixmap
+        row = self.row_of_image(img_idx)
+        if row >= 0:
+            self.dataChanged.emit(self.index(row), self.index(row))
+
+    def drop_pixmaps(self, keep):
+        """卸载不在 keep 中的缩略图。"""
+        self.pixmaps = {img_idx: pixmap for img_idx, pixmap in self.pixmaps.items() if img_idx in keep}
+
+class ImageGridDelegate(QStyledItemDelegate):
+    """绘制标题行和图片行：已载入的图片居中绘制，未载入的图片画灰色占位，图片下方为序号和文件名。"""
+
+    def __init__(self, img_width, img_height, label_height, horizontal_spacing, vertical_spacing, parent=None):
+        super().__init__(parent)
+        self.img_width = img_width
+        self.img_height = img_height
+        self.label_height = label_height
+        self.horizontal_spacing = horizontal_spacing
+        self.vertical_spacing = vertical_spacing
+        self.title_font = QFont("Arial", 20, QFont.Bold)
+        self.inline_title_font = QFont("Arial", 12, QFont.Bold)
+
+    def row_height(self):
+        return self.img_height + self.label_height + self.vertical_spacing * 2
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.row_height())
+
+    def paint(self, painter, option, index):
+        model = index.model()
+        kind, group_idx, first, count = model.row_info(index.row())
+        rect = option.rect
+        painter.save()
+        if kind == ROW_HEADER:
+            painter.setFont(self.title_font)
+            painter.setPen(QColor('yellow') if model.removed[group_idx] else option.palette.text().color())
+            if model.inline_headers:
+                self.paint_inline_title(painter, option, model, group_idx)
+            else:
+                painter.drawText(rect.adjusted(0, 0, 0, -self.vertical_spacing), Qt.AlignLeft | Qt.AlignBottom, model.titles[group_idx])
+        else:
+            header_columns = model.header_columns(index.row())
+            if header_columns:
+                self.paint_inline_title(painter, option, model, group_idx)
+            for column, img_idx in enumerate(range(first, first + count), header_columns):
+                x = rect.left() + column * (self.img_width + self.horizontal_spacing)
+                img_rect = QRect(x, rect.top() + self.vertical_spacing, self.img_width, self.img_height)
+                pixmap = model.pixmaps.get(img_idx)
+                if pixmap is None or pixmap.isNull():
+                    painter.fillRect(img_rect, QColor('gray'))  # 灰色占位图
+                else:
+                    painter.drawPixmap(img_rect.left() + (self.img_width - pixmap.width()) // 2,
+                                       img_rect.top() + (self.img_height - pixmap.height()) // 2, pixmap)
+                filename = model.file_by_idx(img_idx)
+                text_rect = QRect(x, img_rect.bottom() + 1, self.img_width, self.label_height)
+                painter.setPen(QColor('yellow') if filename in model.highlighted else option.palette.text().color())
+                text = painter.fontMetrics().elidedText(f"[{img_idx}] {filename.split('.')[0]}", Qt.ElideRight, self.img_width)
+                painter.drawText(text_rect, Qt.AlignTop | Qt.AlignHCenter, text)
+        painter.restore()
+
+    def paint_inline_title(self, painter, option, model, group_idx):
+        """在行首第一格内换行绘制组标题。"""
+        painter.save()
+        painter.setFont(self.inline_title_font)
+        painter.setPen(QColor('yellow') if model.removed[group_idx] else option.palette.text().color())
+        title_rect = QRect(option.rect.left(), option.rect.top() + self.vertical_spacing, self.img_width,
+                           self.img_height + self.label_height)
+        painter.drawText(title_rect, Qt.AlignLeft | Qt.AlignVCenter | Qt.TextWordWrap, model.titles[group_idx])
+        painter.restore()
+
+class ImageGridView(QListView):
+    """
+    图片网格视图，所有行等高（uniformItemSizes），视图据此直接算出可见行，不需要逐行测量。
+    点击图片时发出 image_clicked(图片全局序号)，点击标题行时发出 header_clicked(组序号)。
+    """
+    image_clicked = pyqtSignal(int)
+    header_clicked = pyqtSignal(int)
+
+    def __init__(self, delegate, parent=None):
+        super().__init__(parent)
+        self.grid_delegate = delegate
+        self.setItemDelegate(delegate)
+        self.setUniformItemSizes(True)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setMouseTracking(False)
+
+    def cell_width(self):
+        return self.grid_delegate.img_width + self.grid_delegate.horizontal_spacing
+
+    def visible_rows(self):
+        """返回可见行的闭区间 (first, last)，没有行时返回 (0, -1)。行高一致且按像素滚动，可见行由滚动位置直接算出。"""
+        count = self.model().rowCount() if self.model() is not None else 0
+        if count == 0:
+            return 0, -1
+        row_height = self.grid_delegate.row_height()
+        top = self.verticalScrollBar().value()
+        first = min(top // row_height, count - 1)
+        last = min((top + self.viewport().height() - 1) // row_height, count - 1)
+        return first, last
+
+    def mousePressEvent(self, event):
+        index = self.indexAt(event.pos())
+        if index.isValid():
+            kind, group_idx, _, _ = self.model().row_info(index.row())
+            column = event.pos().x() // self.cell_width() - self.model().header_columns(index.row())
+            if kind == ROW_HEADER or column < 0:
+                self.header_clicked.emit(group_idx)
+            else:
+                img_range = self.model().image_range(index.row())
+                if column < len(img_range):
+                    self.image_clicked.emit(img_range[column])
+        super().mousePressEvent(event)
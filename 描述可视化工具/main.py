@@ -1,16 +1,20 @@
+import os
 import sys
 from PyQt5.QtWidgets import QApplication
+# 预览图集等模块位于仓库根目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from descriptor_viewer import DescripterViewer
 from utils import setup_logging
 
 def main():
+    # 用法: python main.py [--perf]，--perf 开启性能记录，退出时在当前目录写出 viewer_perf_*.json
     app = QApplication(sys.argv)
     setup_logging()
     # viewer = DescripterViewer("/Users/chenweichu/dev/data/test_副本")
     # viewer = DescripterViewer("/Volumes/192.168.1.173/pic/陈都灵_503[167_MB]")
-    viewer = DescripterViewer("/Volumes/192.168.1.173/pic/鞠婧祎_4999[5_GB]")
+    viewer = DescripterViewer("/Volumes/192.168.1.173/pic/鞠婧祎_4999[5_GB]", instrument='--perf' in sys.argv)
     viewer.show()
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+
+class PerfRecorder:
+    """
+    查看工具的性能记录器。
+    record 记录一次操作的耗时（毫秒），gauge 记录队列深度等采样值；每个名字保留最近 window 个值用于计算滚动分位数，
+    同时把每个事件追加到追踪记录（最多 max_events 条），退出时用 dump 写出 JSON 追踪文件。
+    enabled 为 False 时所有方法直接返回，不产生开销。
+    """
+
+    def __init__(self, enabled=False, window=500, max_events=200000):
+        self.enabled = enabled
+        self.window = window
+        self.max_events = max_events
+        self.start_time = time.perf_counter()
+        self.created_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.samples = {}  # 名字 -> 最近 window 个值
+        self.totals = {}  # 名字 -> [次数, 总和, 最大值]
+        self.events = []
+        self.dropped_events = 0
+        self.cache_stats = None  # 返回 {'hits': .., 'misses': ..} 的函数
+
+    def _add(self, kind, name, value, fields):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+            self.totals[name] = [0, 0.0, float('-inf')]
+        samples.append(value)
+        total = self.totals[name]
+        total[0] += 1
+        total[1] += value
+        total[2] = max(total[2], value)
+        if len(self.events) < self.max_events:
+            event = {'t': round((time.perf_counter() - self.start_time) * 1000, 3), 'kind': kind, 'name': name, 'value': round(value, 3)}
+            if fields:
+                event.update(fields)
+            self.events.append(event)
+        else:
+            self.dropped_events += 1
+
+    def record(self, name, duration_ms, **fields):
+        if self.enabled:
+            self._add('time', name, duration_ms, fields)
+
+    def gauge(self, name, value, **fields):
+        if self.enabled:
+            self._add('gauge', name, float(value), fields)
+
+    @contextmanager
+    def measure(self, name, **fields):
+        """记录 with 语句块的耗时。"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000, **fields)
+
+    def percentiles(self, name, qs=(50, 90, 99)):
+        samples = self.samples.get(name)
+        if not samples:
+            return None
+        return np.percentile(np.fromiter(samples, dtype=np.float64), qs)
+
+    def cache_hit_rate(self):
+        if self.cache_stats is None:
+            return None
+        stats = self.cache_stats()
+        lookups = stats['hits'] + stats['misses']
+        return stats['hits'] / lookups if lookups else None
+
+    def summary_text(self, names=(('descriptor_parse', '解析'), ('layout_construct', '布局'), ('visible_scan', '可见扫描'),
+                                  ('image_load_latency', '加载延迟'), ('image_decode', '解码'))):
+        """状态栏显示的滚动分位数摘要（p50/p90，毫秒）。"""
+        parts = []
+        for name, label in names:
+            values = self.percentiles(name, (50, 90))
+            if values is not None:
+                parts.append(f"{label} {values[0]:.1f}/{values[1]:.1f}")
+        depth = self.samples.get('queue_depth')
+        if depth:
+            parts.append(f"队列 {int(depth[-1])}")
+        hit_rate = self.cache_hit_rate()
+        if hit_rate is not None:
+            parts.append(f"缓存命中 {hit_rate:.0%}")
+        return ("p50/p90 ms: " + " | ".join(parts)) if parts else "暂无性能数据"
+
+    def summary(self):
+        result = {}
+        for name, (count, total, maximum) in self.totals.items():
+            p50, p90, p99 = self.percentiles(name)
+            result[name] = {'count': count, 'mean': total / count, 'max': maximum,
+                            'recent_p50': p50, 'recent_p90': p90, 'recent_p99': p99}
+        return result
+
+    def dump(self, path=None):
+        """写出 JSON 追踪文件，返回文件路径。"""
+        if not self.enabled:
+            return None
+        if path is None:
+            path = os.path.join(os.getcwd(), f"viewer_perf_{time.strftime('%Y%m%d%H%M%S')}.json")
+        trace = {
+            'created_at': self.created_at,
+            'duration_s': time.perf_counter() - self.start_time,
+            'summary': self.summary(),
+            'cache': self.cache_stats() if self.cache_stats is not None else None,
+            'dropped_events': self.dropped_events,
+            'events': self.events,
+        }
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(trace, file, ensure_ascii=False)
+        logging.info(f"性能追踪已保存到: {path}")
+        return path
@@ -0,0 +1,200 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from PyQt5.QtCore import Qt, QRect, QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader
+
+class ThumbnailCache:
+    """按字节数限制大小的 LRU 缓存，保存缩放后的 QImage，滚动回来的图片不必重新读盘解码。"""
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        image = self.images.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self.images.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image):
+        if key in self.images:
+            self.total_bytes -= self.images.pop(key).sizeInBytes()
+        self.images[key] = image
+        self.total_bytes += image.sizeInBytes()
+        while self.total_bytes > self.max_bytes and len(self.images) > 1:
+            _, evicted = self.images.popitem(last=False)
+            self.total_bytes -= evicted.sizeInBytes()
+
+    def clear(self):
+        self.images.clear()
+        self.total_bytes = 0
+
+def read_scaled_image(path, width, height):
+    """
+    读取并缩放图片。先把目标尺寸交给 QImageReader，JPEG 可以在解码时直接降采样，
+    比完整解码后再缩放快得多；再做一次平滑缩放得到精确尺寸。
+    """
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid() and (size.width() > width * 2 or size.height() > height * 2):
+        reader.setScaledSize(size.scaled(width * 2, height * 2, Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        logging.error(f"读取图片失败 {path}: {reader.errorString()}")
+        return image
+    return image.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+def read_atlas_page(page_path, tiles, width, height):
+    """顺序读取整张预览图集页面，在内存中切出其中的全部预览: [(缩略图路径, QImage)]。"""
+    page = QImage(page_path)
+    if page.isNull():
+        logging.error(f"读取预览图集页面失败 {page_path}")
+        return []
+    results = []
+    for path, (x, y, tile_width, tile_height) in tiles:
+        image = page.copy(QRect(x, y, tile_width, tile_height))
+        # 与逐个读取文件时一致，缩放到刚好放入显示区域
+        if tile_width != width and tile_height != height:
+            image = image.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        results.append((path, image))
+    return results
+
+class _LoaderSignals(QObject):
+    finished = pyqtSignal(int, object, object, float)
+
+class ThumbnailLoadTask(QRunnable):
+    """在线程池中执行一个加载任务（单个缩略图文件或一整张图集页面），结果通过信号回到 GUI 线程。"""
+
+    def __init__(self, generation, job, work, signals):
+        super().__init__()
+        self.generation = generation
+        self.job = job
+        self.work = work
+        self.signals = signals
+
+    def run(self):
+        start = time.perf_counter()
+        results = self.work()
+        self.signals.finished.emit(self.generation, self.job, results, (time.perf_counter() - start) * 1000)
+
+class ThumbnailLoader(QObject):
+    """
+    后台缩略图加载器。
+    每次视图刷新用 schedule 提交所需图片及优先级（与可视区域的距离越近优先级越高），
+    任务在 QThreadPool 中执行，已缓存的图片直接返回，不再需要的排队任务被撤回，优先级变化的任务重新排队。
+    设置了预览图集时，图集中的图片按页面合并为一个任务，读取整页后切出该页全部预览放入缓存；
+    不在图集中的图片逐个读取缩略图文件。
+    GUI 线程只在 image_ready 时把 QImage 转成 QPixmap 并重绘。
+    """
+    image_ready = pyqtSignal(object, QImage)
+
+    def __init__(self, width, height, cache_bytes=256 * 1024 ** 2, max_threads=None, perf=None, parent=None):
+        super().__init__(parent)
+        self.width = width
+        self.height = height
+        # PerfRecorder，记录读取解码耗时、从提交到完成的延迟和队列深度
+        self.perf = perf
+        self.cache = ThumbnailCache(cache_bytes)
+        self.atlas = None
+        self.pool = QThreadPool(self)
+        if max_threads:
+            self.pool.setMaxThreadCount(max_threads)
+        self.signals = _LoaderSignals()
+        self.signals.finished.connect(self._on_finished, Qt.QueuedConnection)
+        self.generation = 0
+        self.pending = {}  # 任务标识 -> [任务, 优先级, [(key, 路径)], 提交时间]，仅当前代
+        # 已提交但尚未完成的任务，任务对象必须保留到执行结束
+        self.in_flight = {}  # (代, 任务标识) -> 任务
+
+    def reset(self, atlas=None):
+        """切换显示内容时撤回全部排队任务并设置新的预览图集，已在执行的任务完成后其结果会被丢弃。"""
+        self.schedule([])
+        self.generation += 1
+        self.pending = {}
+        self.atlas = atlas
+
+    def queue_depth(self):
+        return len(self.pending)
+
+    def _job_of(self, path):
+        if self.atlas is not None:
+            page = self.atlas.locate(os.path.basename(path))
+            if page is not None:
+                return ('page', page)
+        return ('file', path)
+
+    def _create_task(self, job):
+        kind, target = job
+        if kind == 'page':
+            page_path, tiles = self.atlas.page_path(target), self.atlas.page_tiles(target)
+            work = lambda: read_atlas_page(page_path, tiles, self.width, self.height)
+        else:
+            work = lambda: [(target, read_scaled_image(target, self.width, self.height))]
+        task = ThumbnailLoadTask(self.generation, job, work, self.signals)
+        task.setAutoDelete(False)
+        return task
+
+    def schedule(self, requests):
+        """
+        用一次视图刷新需要的全部图片替换待加载集合。
+        requests: [(key, 路径, 优先级)]
+        返回: 缓存命中的 {key: QImage}，其余图片加载完成后通过 image_ready 发出。
+        """
+        ready = {}
+        jobs = {}  # 任务标识 -> [优先级, [(key, 路径)]]
+        for key, path, priority in requests:
+            image = self.cache.get(path)
+            if image is not None:
+                ready[key] = image
+                continue
+            entry = jobs.setdefault(self._job_of(path), [priority, []])
+            entry[0] = max(entry[0], priority)
+            entry[1].append((key, path))
+        # 撤回不再需要或优先级变化的排队任务，已开始执行的任务无法撤回，继续等待其结果
+        for job in list(self.pending):
+            task, priority = self.pending[job][:2]
+            if (job not in jobs or jobs[job][0] != priority) and self.pool.tryTake(task):
+                del self.pending[job]
+                del self.in_flight[(self.generation, job)]
+        for job, (priority, members) in jobs.items():
+            if job in self.pending:
+                self.pending[job][2] = members
+                continue
+            task = self._create_task(job)
+            self.pending[job] = [task, priority, members, time.perf_counter()]
+            self.in_flight[(self.generation, job)] = task
+            self.pool.start(task, priority)
+        if self.perf is not None:
+            self.perf.gauge('queue_depth', len(self.pending))
+        return ready
+
+    def _on_finished(self, generation, job, results, elapsed_ms):
+        self.in_flight.pop((generation, job), None)
+        if generation != self.generation:
+            return
+        entry = self.pending.pop(job, None)
+        if self.perf is not None:
+            self.perf.record('image_decode', elapsed_ms, job=job[0], images=len(results))
+            if entry is not None:
+                self.perf.record('image_load_latency', (time.perf_counter() - entry[3]) * 1000, job=job[0])
+        loaded = {path: image for path, image in results if not image.isNull()}
+        for path, image in loaded.items():
+            self.cache.put(path, image)
+        if entry is None:
+            return
+        for key, path in entry[2]:
+            if path in loaded:
+                self.image_ready.emit(key, loaded[path])
+
+    def shutdown(self):
+        self.reset()
+        self.pool.waitForDone()
@@ -1,3 +1,4 @@
+import os
 import logging
 
 def setup_logging():
@@ -11,4 +12,23 @@ def is_descriptor_file(filepath):
             return "Unique Images:" in first_line
     except Exception as e:
         logging.error(f"Error checking descriptor file: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def is_cluster_file(filepath):
+    # 检查是否为人脸聚类结果文件（face_classify_*.txt，内容为 JSON）
+    if not os.path.basename(filepath).startswith('face_classify'):
+        return False
+    try:
+        with open(filepath, 'r', encoding='utf-8') as file:
+            return file.read(64).lstrip().startswith('{')
+    except Exception as e:
+        logging.error(f"Error checking cluster file: {e}")
+        return False
+
+def file_kind(filepath):
+    """描述文件返回 'descriptor'，聚类结果文件返回 'cluster'，其他返回 None。"""
+    if is_descriptor_file(filepath):
+        return 'descriptor'
+    if is_cluster_file(filepath):
+        return 'cluster'
+    return None
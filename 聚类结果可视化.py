@@ -1,16 +1,39 @@
 # 迭代编号：3
 import os
+import json
+import hashlib
+import argparse
 import numpy as np
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
 from sklearn.manifold import TSNE
-from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap, BoundaryNorm
-from custom_face_data import CustomFace, deserialize_face
+import matplotlib.image as mpimg
+from face_store import open_face_store
+from similarity_engine import normalize_embeddings
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def label_colors(labels):
+    """
+    为任意数量的标签生成区分度较高的颜色：色相按黄金分割比例递增，饱和度和亮度分三档轮换。
+    标签 -1（噪声）为灰色。返回 (点数, 3) 的 RGB 数组，取值 0~1。
+    """
+    labels = np.asarray(labels)
+    unique_labels, inverse = np.unique(labels, return_inverse=True)
+    ranks = np.arange(len(unique_labels))
+    hue = (ranks * 0.618033988749895) % 1
+    saturation = np.array([0.85, 0.6, 1.0])[ranks % 3]
+    value = np.array([0.95, 0.8, 0.65])[(ranks // 3) % 3]
+    # HSV -> RGB 向量化转换
+    i = np.floor(hue * 6).astype(int) % 6
+    f = hue * 6 - np.floor(hue * 6)
+    p, q, t = value * (1 - saturation), value * (1 - f * saturation), value * (1 - (1 - f) * saturation)
+    rgb = np.choose(i[:, None], [np.stack(c, axis=1) for c in
+                                 [(value, t, p), (q, value, p), (p, value, t), (p, q, value), (t, p, value), (value, p, q)]])
+    rgb[unique_labels == -1] = 0.6
+    return rgb[inverse]
+
 def plot_embeddings(embeddings, labels=None, visualize_method='pca_3d', size=50, alpha=0.5):
     """
     可视化嵌入空间中的点。
@@ -22,9 +45,7 @@ def plot_embeddings(embeddings, labels=None, visualize_method='pca_3d', size=50,
         size: int, 样本点的基础大小。
     """
     point_size = np.ones(len(embeddings)) * size  # 设置所有点的大小
-    unique_labels = np.unique(labels)
-    color_map = {label: color for label, color in zip(unique_labels, ['darkorange', 'blue', 'forestgreen', 'firebrick', 'darkcyan', 'gold', 'purple', 'yellow', 'pink', 'cyan'][:len(unique_labels)])}
-    colors = [color_map[label] for label in labels]
+    colors = label_colors(labels) if labels is not None else None
 
     if visualize_method == 'pca_2d':
         pca = PCA(n_components=2)
@@ -58,4 +79,152 @@ def plot_embeddings(embeddings, labels=None, visualize_method='pca_3d', size=50,
         else:
             scatter = ax.scatter(embeddings_reduced[:, 0], embeddings_reduced[:, 1], embeddings_reduced[:, 2], color='blue', s=point_size, alpha=alpha)
         # plt.colorbar(scatter, ticks=unique_labels)
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+def stratified_sample(labels, sample_size, seed=0):
+    """按标签分层抽样，每个簇按比例抽取，且至少保留一个点。所有标签相同时即为均匀抽样。"""
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    n = len(labels)
+    if n <= sample_size:
+        return np.arange(n)
+    order = rng.permutation(n)
+    order = order[np.argsort(labels[order], kind='stable')]
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    sizes = np.diff(np.r_[starts, n])
+    quotas = np.maximum(1, np.round(sizes * sample_size / n)).astype(int)
+    # 组内已随机打乱，取每组的前 quota 个
+    rank_in_group = np.arange(n) - np.repeat(starts, sizes)
+    return np.sort(order[rank_in_group < np.repeat(quotas, sizes)])
+
+def compute_projection(embeddings, method='ipca_2d', labels=None, sample_size=20000, batch_size=10000, seed=0):
+    """
+    把特征降到 2 维或 3 维。
+    method:
+        'ipca_2d' / 'ipca_3d': 增量 PCA，按批拟合和变换，内存占用与总点数无关。
+        'tsne_2d': 只在分层抽样的点上运行 t-SNE，其余点放在特征空间中最相近的 5 个样本点的平均位置。
+    """
+    n = len(embeddings)
+    if method in ('ipca_2d', 'ipca_3d'):
+        n_components = 2 if method == 'ipca_2d' else 3
+        batch_size = max(batch_size, n_components)
+        ipca = IncrementalPCA(n_components=n_components)
+        for start in range(0, n, batch_size):
+            batch = np.asarray(embeddings[start:start + batch_size], dtype=np.float32)
+            # 最后一批不足 n_components 个点时并入拟合会报错，跳过即可
+            if len(batch) >= n_components:
+                ipca.partial_fit(batch)
+        return np.concatenate([ipca.transform(np.asarray(embeddings[start:start + batch_size], dtype=np.float32))
+                               for start in range(0, n, batch_size)]).astype(np.float32)
+    if method == 'tsne_2d':
+        sample = stratified_sample(labels, sample_size, seed) if labels is not None else stratified_sample(np.zeros(n), sample_size, seed)
+        x_sample = normalize_embeddings(embeddings[sample])
+        logging.info(f"t-SNE 样本点数: {len(sample)}")
+        sample_projection = TSNE(n_components=2, perplexity=min(30, max(1, len(sample) - 1) / 3), init='pca',
+                                 random_state=seed).fit_transform(x_sample)
+        projection = np.empty((n, 2), dtype=np.float32)
+        neighbors = min(5, len(sample))
+        for start in range(0, n, batch_size):
+            sims = normalize_embeddings(embeddings[start:start + batch_size]) @ x_sample.T
+            top = np.argpartition(-sims, neighbors - 1, axis=1)[:, :neighbors]
+            projection[start:start + batch_size] = sample_projection[top].mean(axis=1)
+        projection[sample] = sample_projection
+        return projection
+    raise ValueError(f"不支持的可视化方法: {method}")
+
+def cached_projection(directory_path, names, embeddings, method='ipca_2d', labels=None, sample_size=20000, seed=0):
+    """
+    读取或计算并缓存降维结果，缓存保存在 <目录>/projection_cache 下。
+    缓存以人脸名列表、方法和抽样参数为键，不含标签，因此重新聚类后只需重新着色，不必重新降维。
+    t-SNE 的样本只在首次计算时按当时的标签分层抽取，之后重新聚类沿用缓存的结果。
+    """
+    params = [method, str(sample_size), str(seed)] if method == 'tsne_2d' else [method]
+    key = hashlib.sha1('\n'.join(params + list(names)).encode('utf-8')).hexdigest()[:16]
+    cache_dir = os.path.join(directory_path, 'projection_cache')
+    cache_path = os.path.join(cache_dir, f"{method}_{len(names)}_{key}.npy")
+    if os.path.exists(cache_path):
+        logging.info(f"使用缓存的降维结果: {cache_path}")
+        return np.load(cache_path)
+    projection = compute_projection(embeddings, method, labels, sample_size, seed=seed)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(cache_path, projection)
+    logging.info(f"降维结果已缓存到: {cache_path}")
+    return projection
+
+def rasterize(points, colors, width, height, point_radius=1):
+    """
+    把二维点直接栅格化为 RGB 图像和计数图，每个像素取落入其中的点的平均颜色。
+    全部为向量化的 bincount 运算，百万个点也只需不到一秒。
+    """
+    lo, hi = points.min(axis=0), points.max(axis=0)
+    span = np.where(hi > lo, hi - lo, 1)
+    margin = point_radius + 1
+    px = (margin + (points[:, 0] - lo[0]) / span[0] * (width - 1 - 2 * margin)).astype(np.int64)
+    py = (margin + (hi[1] - points[:, 1]) / span[1] * (height - 1 - 2 * margin)).astype(np.int64)
+    counts = np.zeros(width * height)
+    color_sums = np.zeros((width * height, 3))
+    for dx in range(-point_radius, point_radius + 1):
+        for dy in range(-point_radius, point_radius + 1):
+            if dx * dx + dy * dy > point_radius * point_radius:
+                continue
+            pixel = (py + dy) * width + (px + dx)
+            counts += np.bincount(pixel, minlength=width * height)
+            for channel in range(3):
+                color_sums[:, channel] += np.bincount(pixel, weights=colors[:, channel], minlength=width * height)
+    return counts.reshape(height, width), color_sums.reshape(height, width, 3)
+
+def render_projection(projection, labels, output_path, mode='scatter', width=2000, height=2000, point_radius=1):
+    """
+    不依赖图形界面，把降维结果渲染为 PNG。
+    mode:
+        'scatter': 按簇着色（颜色数量不限），像素亮度随点密度增加。
+        'density': 只画点密度（对数刻度），不需要标签。
+    3 维结果渲染为 xy / xz / yz 三个视图横向拼接。
+    """
+    views = [(0, 1)] if projection.shape[1] == 2 else [(0, 1), (0, 2), (1, 2)]
+    colors = label_colors(labels) if labels is not None else np.full((len(projection), 3), 0.2)
+    panels = []
+    for a, b in views:
+        counts, color_sums = rasterize(projection[:, [a, b]], colors, width, height, point_radius)
+        density = np.log1p(counts) / max(np.log1p(counts.max()), 1e-9)
+        if mode == 'density':
+            panels.append(plt.get_cmap('magma')(density)[:, :, :3])
+        else:
+            mean_colors = color_sums / np.maximum(counts, 1)[:, :, None]
+            alpha = np.clip(0.35 + 0.65 * density, 0, 1)[:, :, None] * (counts > 0)[:, :, None]
+            panels.append(1 - alpha + alpha * mean_colors)
+    mpimg.imsave(output_path, np.clip(np.concatenate(panels, axis=1), 0, 1))
+    logging.info(f"已渲染 {len(projection)} 个点到: {output_path}")
+
+def load_labels(cluster_file_path, names):
+    """读取 face_classify_*.txt 中的聚类结果，返回与 names 对应的标签数组，不在结果中的人脸为 -1。"""
+    with open(cluster_file_path, 'r', encoding='utf-8') as file:
+        cluster_dict = json.load(file)['cluster_dict']
+    name_to_label = {name: int(label) for label, members in cluster_dict.items() for name in members}
+    return np.array([name_to_label.get(name, -1) for name in names], dtype=np.int64)
+
+def main(directory_path, cluster_file_path=None, method='ipca_2d', mode='scatter', output_path=None, sample_size=20000, size=2000):
+    store = open_face_store(directory_path)
+    rows = np.flatnonzero(store.live_mask())
+    names = [store.names[row] for row in rows]
+    embeddings = store.column('embedding')[rows]
+    labels = load_labels(cluster_file_path, names) if cluster_file_path else None
+    projection = cached_projection(directory_path, names, embeddings, method, labels, sample_size)
+    if output_path is None:
+        suffix = os.path.splitext(os.path.basename(cluster_file_path))[0] if cluster_file_path else 'all'
+        output_path = os.path.join(directory_path, f"embedding_{method}_{mode}_{suffix}.png")
+    render_projection(projection, labels, output_path, mode, size, size)
+    return output_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="无界面渲染人脸特征的降维可视化图，降维结果会缓存到磁盘")
+    parser.add_argument('directory', help="目标目录（包含 face_store）")
+    parser.add_argument('--labels', help="聚类结果文件 face_classify_*.txt")
+    parser.add_argument('--method', default='ipca_2d', choices=['ipca_2d', 'ipca_3d', 'tsne_2d'], help="降维方法")
+    parser.add_argument('--mode', default='scatter', choices=['scatter', 'density'], help="渲染方式")
+    parser.add_argument('--output', help="输出 PNG 路径")
+    parser.add_argument('--sample-size', type=int, default=20000, help="t-SNE 分层抽样的点数")
+    parser.add_argument('--size', type=int, default=2000, help="图像边长（像素）")
+    args = parser.parse_args()
+    main(args.directory, args.labels, args.method, args.mode, args.output, args.sample_size, args.size)